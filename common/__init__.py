@@ -0,0 +1,7 @@
+"""
+Shared building blocks for the e-commerce microservices.
+
+This package holds infrastructure code that every service needs in the same shape,
+such as the pooled SQLite connection layer, so that the four services do not each
+carry a private copy of it.
+"""
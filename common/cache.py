@@ -0,0 +1,134 @@
+"""
+In-process, size-bounded LRU cache with per-entry TTL.
+
+Used in front of the hottest single-row lookups (good details) so repeated reads skip
+the database entirely. Writers invalidate the keys they change; every invalidation bumps
+a generation counter, and a reader only stores what it loaded if no invalidation
+happened while it was reading, so a slow reader cannot put a stale row back into the
+cache after a writer cleared it.
+
+Hit, miss, eviction, expiry and invalidation counters are kept so the cache can be sized
+from production traffic.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Thread-safe least-recently-used cache whose entries also expire after a TTL.
+
+    Args:
+        maxsize (int): Maximum number of entries; the least recently used is evicted first.
+        ttl (float): Seconds an entry stays valid after it was stored.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """
+        Returns the cached value of a key, or None on a miss or an expired entry.
+
+        Args:
+            key: The cache key.
+
+        Returns:
+            The cached value, or None.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def generation(self):
+        """
+        Returns:
+            int: The current invalidation generation, to pass to `set` after a load.
+        """
+        return self._generation
+
+    def set(self, key, value, generation=None, ttl=None):
+        """
+        Stores a value, evicting the least recently used entries beyond `maxsize`.
+
+        Args:
+            key: The cache key.
+            value: The value to store.
+            generation (int, optional): The generation read before loading the value. If
+                an invalidation happened since, the value may be stale and is not stored.
+            ttl (float, optional): Seconds this entry stays valid, when it must expire
+                sooner than the cache's TTL (for example a token close to its expiry).
+
+        Returns:
+            bool: True if the value was stored.
+        """
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else min(ttl, self.ttl)))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            return True
+
+    def invalidate(self, key):
+        """
+        Removes a key and bumps the generation so in-flight loads are not stored.
+
+        Args:
+            key: The cache key.
+        """
+        with self._lock:
+            self._generation += 1
+            self._data.pop(key, None)
+            self.invalidations += 1
+
+    def clear(self):
+        """
+        Removes every entry and bumps the generation.
+        """
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+
+    def stats(self):
+        """
+        Returns:
+            dict: Size, configuration and counters of the cache, with the hit ratio.
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+            }
@@ -0,0 +1,462 @@
+"""
+Pooled SQLite connection layer shared by all services.
+
+Every service used to open and close a fresh ``sqlite3.connect(...)`` inside each data
+function, so a single request could pay for two or three connection set-ups and schema
+parses. This module keeps a bounded, thread-safe pool of open connections per database
+file and adds a per-request connection scope: while a scope is active on a thread, every
+call to ``connect()`` hands back the same connection and ``commit()`` is deferred to the
+end of the scope, so chained data functions share one connection and one transaction.
+
+Dependencies:
+    - sqlite3: Database engine used by every service.
+    - threading / queue: Synchronisation primitives for the pool.
+"""
+
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from common.storage import STORAGE_SETTINGS, get_env_setting, resolve_storage_profile
+
+
+class PoolTimeoutError(sqlite3.OperationalError):
+    """
+    Raised when no pooled connection becomes available within the pool timeout.
+
+    It subclasses ``sqlite3.OperationalError`` so the existing ``except sqlite3.Error``
+    handlers in the services treat pool exhaustion like any other database failure.
+    """
+
+
+class PooledConnection(object):
+    """
+    Thin proxy around a pooled ``sqlite3.Connection``.
+
+    Attribute reads and writes (``cursor``, ``execute``, ``row_factory``, ...) are
+    forwarded to the underlying connection. ``commit()`` and ``close()`` are
+    intercepted: ``commit()`` is deferred while a request scope owns the transaction,
+    and ``close()`` hands the connection back to the pool instead of closing it.
+    """
+
+    def __init__(self, pool, raw):
+        object.__setattr__(self, '_pool', pool)
+        object.__setattr__(self, '_raw', raw)
+
+    def __getattr__(self, name):
+        raw = object.__getattribute__(self, '_raw')
+        if raw is None:
+            raise sqlite3.ProgrammingError("Cannot operate on a connection returned to the pool.")
+        return getattr(raw, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._raw, name, value)
+
+    def commit(self):
+        """
+        Commits the current transaction, unless a request scope owns the transaction.
+        """
+        if not self._pool.in_scope():
+            self._raw.commit()
+
+    def close(self):
+        """
+        Hands the connection back; the pool reclaims it once its last holder is done.
+        """
+        raw = self._raw
+        if raw is None:
+            return
+        object.__setattr__(self, '_raw', None)
+        self._pool._return(raw)
+
+
+class ConnectionPool(object):
+    """
+    Bounded, thread-safe pool of SQLite connections for a single database file.
+
+    Connections are created lazily up to ``size`` and configured once at creation time
+    with the busy timeout and the given PRAGMAs, so per-call set-up disappears from the
+    request path.
+
+    Args:
+        database (str): Path of the SQLite database file.
+        size (int): Maximum number of open connections.
+        timeout (float): Seconds to wait for a free connection before raising
+            ``PoolTimeoutError``.
+        busy_timeout (int): SQLite busy timeout in milliseconds applied to every connection.
+        pragmas (dict, optional): Extra ``PRAGMA name = value`` settings applied to every
+            new connection, in insertion order.
+    """
+
+    def __init__(self, database, size=5, timeout=30.0, busy_timeout=5000, pragmas=None):
+        self.profile = None
+        self.database = database
+        self.size = size
+        self.timeout = timeout
+        self.busy_timeout = busy_timeout
+        self.pragmas = dict(pragmas or {})
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._created = 0
+
+    @classmethod
+    def from_profile(cls, database, service_name, size=5, timeout=30.0):
+        """
+        Builds a pool whose connections follow the service's storage profile.
+
+        The profile and the pool size can be chosen through the environment, see
+        ``common.storage``; ``<SERVICE>_DB_POOL_SIZE`` or ``DB_POOL_SIZE`` override ``size``.
+
+        Args:
+            database (str): Path of the SQLite database file.
+            service_name (str): Name of the service, used as environment variable prefix.
+            size (int): Default maximum number of open connections.
+            timeout (float): Seconds to wait for a free connection.
+
+        Returns:
+            ConnectionPool: The configured pool.
+        """
+        name, settings = resolve_storage_profile(service_name)
+        busy_timeout = int(settings.pop('busy_timeout', 5000))
+        size = int(get_env_setting(service_name, 'DB_POOL_SIZE') or size)
+        pool = cls(database, size=size, timeout=timeout, busy_timeout=busy_timeout, pragmas=settings)
+        pool.profile = name
+        return pool
+
+    def _new_connection(self):
+        """
+        Opens and configures a new raw connection.
+
+        URI filenames are enabled, so a service can attach another database read-only
+        through a 'file:...?mode=ro' URI; a plain path is opened as before.
+
+        Returns:
+            sqlite3.Connection: A connection with the busy timeout and PRAGMAs applied.
+        """
+        conn = sqlite3.connect(self.database, timeout=self.busy_timeout / 1000.0,
+                               check_same_thread=False, uri=True)
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout)}")
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        with self._lock:
+            self._created += 1
+        return conn
+
+    def _acquire(self):
+        """
+        Borrows a raw connection, opening a new one if the pool is not yet full.
+
+        Returns:
+            sqlite3.Connection: A raw connection owned by the caller until released.
+
+        Raises:
+            PoolTimeoutError: If every connection stays busy for ``timeout`` seconds.
+        """
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeoutError(f"Timed out waiting for a connection to '{self.database}'")
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return self._new_connection()
+        except Exception:
+            self._slots.release()
+            raise
+
+    def _release(self, raw):
+        """
+        Resets a raw connection and puts it back into the idle pool.
+
+        Any transaction left open by the borrower is rolled back and the row factory is
+        cleared, so the next borrower sees the same state as a freshly opened connection.
+
+        Args:
+            raw (sqlite3.Connection): The connection to release.
+        """
+        try:
+            if raw.in_transaction:
+                raw.rollback()
+            raw.row_factory = None
+            self._idle.put(raw)
+        except sqlite3.Error:
+            raw.close()
+            with self._lock:
+                self._created -= 1
+        finally:
+            self._slots.release()
+
+    def _borrow(self):
+        """
+        Returns the calling thread's connection, acquiring one on first use.
+
+        A thread holds at most one pooled connection at a time. Nested borrows (for
+        example `add_good` calling `get_good_by_id` before closing its own connection)
+        share it, so a thread never waits on the pool for a second connection.
+
+        Returns:
+            sqlite3.Connection: The raw connection held by the calling thread.
+        """
+        local = self._local
+        if getattr(local, 'raw', None) is None:
+            local.raw = self._acquire()
+            local.refs = 0
+        local.refs += 1
+        return local.raw
+
+    def _return(self, raw):
+        """
+        Drops one reference to the calling thread's connection and releases it at zero.
+
+        Args:
+            raw (sqlite3.Connection): The connection the reference was taken on. Stale
+                references to a connection the thread no longer holds are ignored.
+        """
+        local = self._local
+        if getattr(local, 'raw', None) is not raw:
+            return
+        local.refs -= 1
+        if local.refs == 0:
+            raw = local.raw
+            local.raw = None
+            self._release(raw)
+
+    def connect(self):
+        """
+        Returns a connection for the calling thread.
+
+        The connection is borrowed from the pool on first use and handed back when every
+        caller on the thread has closed it. Inside a request scope the scope keeps it
+        borrowed until the scope ends, so chained calls share one transaction.
+
+        Returns:
+            PooledConnection: A proxy that behaves like a ``sqlite3.Connection``.
+        """
+        raw = self._borrow()
+        local = self._local
+        if self.in_scope() and not local.scope_holds:
+            # The scope takes its own reference so closing the proxy does not release it
+            self._borrow()
+            local.scope_holds = True
+        return PooledConnection(self, raw)
+
+    def begin_scope(self):
+        """
+        Opens (or nests into) a request scope on the calling thread.
+        """
+        depth = getattr(self._local, 'depth', 0)
+        if depth == 0:
+            self._local.scope_holds = False
+            self._local.callbacks = []
+        self._local.depth = depth + 1
+
+    def end_scope(self, commit=True):
+        """
+        Leaves a request scope; the outermost exit commits or rolls back and releases.
+
+        Callbacks registered with `after_commit` during the scope run once the connection
+        has been handed back, whether the scope committed or not.
+
+        Args:
+            commit (bool): Commit the scope's transaction if True, roll it back otherwise.
+
+        Raises:
+            sqlite3.Error: If the final commit fails. The connection is handed back (and
+                its transaction rolled back) before the error propagates.
+        """
+        depth = getattr(self._local, 'depth', 0)
+        if depth == 0:
+            return
+        self._local.depth = depth - 1
+        if depth > 1:
+            return
+        callbacks = self._local.callbacks
+        self._local.callbacks = []
+        try:
+            if self._local.scope_holds:
+                self._local.scope_holds = False
+                raw = self._local.raw
+                try:
+                    if commit:
+                        raw.commit()
+                    else:
+                        raw.rollback()
+                finally:
+                    # Release even if a caller forgot to close its connection during the scope
+                    self._local.refs = 1
+                    self._return(raw)
+        finally:
+            for callback in callbacks:
+                callback()
+
+    def after_commit(self, callback):
+        """
+        Runs a callback once the calling thread's writes are visible to other connections.
+
+        Inside a request scope the commit is deferred, so the callback is queued until the
+        scope ends; outside a scope the caller has already committed and it runs at once.
+        Use it for side effects such as cache invalidation that must not run before other
+        readers can see the new data.
+
+        Args:
+            callback (function): A function taking no arguments.
+        """
+        if self.in_scope():
+            self._local.callbacks.append(callback)
+        else:
+            callback()
+
+    def commit_scope(self):
+        """
+        Commits the calling thread's scope transaction early, keeping the scope open.
+
+        Long-running requests such as bulk imports use it to commit in chunks, so the
+        write lock is released between chunks instead of being held until the response.
+        Callbacks registered with `after_commit` so far run once the commit is done.
+        Outside a scope, or before the scope has used a connection, it does nothing.
+        """
+        if not self.in_scope() or not self._local.scope_holds:
+            return
+        self._local.raw.commit()
+        callbacks = self._local.callbacks
+        self._local.callbacks = []
+        for callback in callbacks:
+            callback()
+
+    def release_scope(self):
+        """
+        Commits the calling thread's scope transaction and hands its connection back,
+        keeping the scope open.
+
+        Requests that go on to slow work that needs no database, such as password
+        hashing, call it so they do not hold a pooled connection meanwhile; a later
+        `connect()` in the scope borrows one again. Callers must have closed their own
+        connections first, as the connection goes back to the pool regardless.
+        """
+        if not self.in_scope() or not self._local.scope_holds:
+            return
+        self.commit_scope()
+        self._local.scope_holds = False
+        self._local.refs = 1
+        self._return(self._local.raw)
+
+    def in_scope(self):
+        """
+        Returns:
+            bool: True if the calling thread currently has an open request scope.
+        """
+        return getattr(self._local, 'depth', 0) > 0
+
+    @contextmanager
+    def scope(self):
+        """
+        Context manager form of ``begin_scope``/``end_scope``.
+
+        The transaction is committed when the block exits normally and rolled back when
+        it raises.
+        """
+        self.begin_scope()
+        try:
+            yield
+        except BaseException:
+            self.end_scope(commit=False)
+            raise
+        self.end_scope(commit=True)
+
+    def init_app(self, app):
+        """
+        Binds a request scope to every Flask request handled by ``app``.
+
+        The scope is committed in ``after_request`` so a failed commit can still turn the
+        response into a 500. Server errors roll the scope back instead, and
+        ``teardown_request`` releases whatever is left when the view raised.
+
+        Args:
+            app (flask.Flask): The application to bind to.
+        """
+        from flask import jsonify
+
+        @app.before_request
+        def _begin_db_scope():
+            self.begin_scope()
+
+        @app.after_request
+        def _commit_db_scope(response):
+            try:
+                self.end_scope(commit=response.status_code < 500)
+            except sqlite3.Error as e:
+                print(f"Error committing request transaction: {e}")
+                response = jsonify({"error": "Database commit failed"})
+                response.status_code = 500
+            return response
+
+        @app.teardown_request
+        def _rollback_db_scope(exc):
+            while self.in_scope():
+                self.end_scope(commit=False)
+
+    def use_database(self, database):
+        """
+        Points the pool at another database file, closing the idle connections to the
+        previous one.
+
+        Tests use it to run a service against a temporary database through its own pool,
+        whose request scope is already bound to the application. No connection may be
+        borrowed while it is called.
+
+        Args:
+            database (str): Path of the SQLite database file.
+        """
+        self.close_all()
+        self.database = database
+
+    def close_all(self):
+        """
+        Closes every idle connection held by the pool.
+        """
+        while True:
+            try:
+                raw = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            raw.close()
+            with self._lock:
+                self._created -= 1
+
+    def report(self):
+        """
+        Prints the storage settings actually in effect on a pooled connection.
+
+        The values are read back from SQLite rather than echoed from the configuration,
+        so a profile that could not be applied (for example WAL on a read-only mount)
+        shows up in the startup log.
+
+        Returns:
+            dict: The effective value of every setting in ``STORAGE_SETTINGS``.
+        """
+        conn = self.connect()
+        try:
+            effective = {}
+            for key in STORAGE_SETTINGS:
+                row = conn.execute(f"PRAGMA {key}").fetchone()
+                effective[key] = row[0] if row else None
+        finally:
+            conn.close()
+        settings = ", ".join(f"{key}={value}" for key, value in effective.items())
+        print(f"Storage profile '{self.profile or 'custom'}' on {self.database} (pool size {self.size}): {settings}")
+        return effective
+
+    def stats(self):
+        """
+        Returns:
+            dict: The configured size, the number of open connections and how many are idle.
+        """
+        return {
+            "database": self.database,
+            "size": self.size,
+            "open": self._created,
+            "idle": self._idle.qsize(),
+        }
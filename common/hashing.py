@@ -0,0 +1,144 @@
+"""
+Password hashing off the request threads.
+
+Password hashes are deliberately slow to compute. Run inline, every login or
+registration holds a request thread (and the GIL) for tens of milliseconds, so a login
+spike stalls every other request of the worker. `PasswordHasher` runs the hashing in a
+small process pool instead, so it uses other cores and does not hold the GIL of the web
+process.
+
+The number of hashes waiting or running is bounded. When the bound is reached the
+caller gets `HasherBusy` immediately, which the service answers with a fast 503, rather
+than queueing work that would finish after the client has given up.
+"""
+
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HasherBusy(Exception):
+    """
+    Raised when the hashing queue is full or a hash did not finish in time.
+    """
+
+
+class PasswordHasher(object):
+    """
+    Hashes and checks passwords in a bounded process pool.
+
+    Args:
+        workers (int): Number of worker processes. 0 hashes inline on the calling thread.
+        max_pending (int): Maximum number of hashes queued or running at once.
+        method (str, optional): werkzeug hash method and cost, e.g. 'scrypt:32768:8:1'
+            or 'pbkdf2:sha256:600000'. Defaults to werkzeug's default method.
+        timeout (float): Seconds to wait for a hash before giving up.
+    """
+
+    def __init__(self, workers=2, max_pending=32, method=None, timeout=10.0):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.method = method
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self.rejected = 0
+
+    def _get_executor(self):
+        """
+        Returns:
+            ProcessPoolExecutor: The worker pool, started on first use.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _run(self, fn, *args, **kwargs):
+        """
+        Runs a hashing function in the pool, or inline when there are no workers.
+
+        Args:
+            fn (function): `generate_password_hash` or `check_password_hash`.
+            *args: Positional arguments of `fn`.
+            **kwargs: Keyword arguments of `fn`.
+
+        Returns:
+            The result of `fn`.
+
+        Raises:
+            HasherBusy: If `max_pending` hashes are already queued or running, or the
+                hash did not finish within `timeout`.
+        """
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusy("Too many password hashes in progress")
+        if self.workers <= 0:
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._slots.release()
+        try:
+            future = self._get_executor().submit(fn, *args, **kwargs)
+        except BrokenProcessPool:
+            self._slots.release()
+            self.reset()
+            raise HasherBusy("Password hashing pool restarted")
+        # The slot is held until the worker is done, even if the caller timed out
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            raise HasherBusy("Password hashing timed out")
+        except BrokenProcessPool:
+            self.reset()
+            raise HasherBusy("Password hashing pool restarted")
+
+    def hash(self, password):
+        """
+        Hashes a password with the configured method.
+
+        Args:
+            password (str): The plain-text password.
+
+        Returns:
+            str: The salted hash, in werkzeug's format.
+
+        Raises:
+            HasherBusy: If the hashing queue is full.
+        """
+        if self.method:
+            return self._run(generate_password_hash, password, method=self.method)
+        return self._run(generate_password_hash, password)
+
+    def check(self, password_hash, password):
+        """
+        Checks a password against a stored hash.
+
+        The cost is the one recorded in the hash, so hashes made with an older method
+        keep working after the method is changed.
+
+        Args:
+            password_hash (str): The stored hash.
+            password (str): The plain-text password to check.
+
+        Returns:
+            bool: True if the password matches.
+
+        Raises:
+            HasherBusy: If the hashing queue is full.
+        """
+        return self._run(check_password_hash, password_hash, password)
+
+    def reset(self):
+        """
+        Shuts the worker pool down; a new one is started on the next hash.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
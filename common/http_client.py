@@ -0,0 +1,405 @@
+"""
+Pooled HTTP client for calls between the services.
+
+Opening a new TCP connection for every call to another service adds a connection
+set-up to every request that depends on it. `ServiceClient` keeps a small pool of
+keep-alive connections per dependency instead, and guards each call:
+
+- connect and read timeouts are separate and strict, so a hung dependency costs a
+  bounded amount of time;
+- failed idempotent calls are retried a bounded number of times, with exponential
+  backoff and full jitter so retrying clients do not hit the dependency in lockstep.
+  Only GET, HEAD and OPTIONS are idempotent by themselves: the services' PUT routes
+  deduct stock, so a mutating call is only retried when it carries an Idempotency-Key;
+- a kept-alive connection the dependency has closed in the meantime is replaced by a
+  fresh one before the request is sent, so it never fails a call that cannot be retried;
+- a circuit breaker stops calling a dependency that keeps failing and fails fast
+  instead, letting one trial call through after a cool-down;
+- the latency of every call is recorded per dependency in a shared
+  `LatencyRecorder`, so slow dependencies show up in the service's metrics.
+"""
+
+import http.client
+import json
+import queue
+import random
+import select
+import threading
+import time
+from urllib.parse import urlencode, urlsplit
+
+from common.metrics import LatencyRecorder
+
+# Latency of the calls made by every client, grouped by dependency name
+dependency_latency = LatencyRecorder()
+
+# Methods that may be retried without risking a duplicate side effect; other methods, PUT
+# and DELETE included, are only retried when the request carries an Idempotency-Key header
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Status codes meaning the dependency is overloaded or restarting, worth a retry
+RETRY_STATUSES = (502, 503, 504)
+
+
+class ServiceUnavailable(Exception):
+    """
+    Raised when a dependency could not be reached or kept failing after the retries.
+    """
+
+
+class CircuitOpenError(ServiceUnavailable):
+    """
+    Raised without calling the dependency while its circuit breaker is open.
+    """
+
+
+class ServiceResponse(object):
+    """
+    Response of a dependency, read in full so its connection can be reused.
+
+    Args:
+        status (int): HTTP status code.
+        headers (dict): Response headers, with lower-case names.
+        body (bytes): Response body.
+    """
+
+    def __init__(self, status, headers, body):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        """
+        Returns:
+            The decoded JSON body.
+
+        Raises:
+            ValueError: If the body is not valid JSON.
+        """
+        return json.loads(self.body.decode('utf-8'))
+
+
+class CircuitBreaker(object):
+    """
+    Counts consecutive failures of a dependency and opens after `threshold` of them.
+
+    While open every call is refused. Once `reset_timeout` seconds have passed a single
+    trial call is let through (half-open): its success closes the breaker, its failure
+    opens it again for another `reset_timeout`.
+
+    Args:
+        threshold (int): Consecutive failures that open the breaker.
+        reset_timeout (float): Seconds the breaker stays open before a trial call.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=10.0):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        """
+        Returns:
+            str: 'closed', 'open' or 'half_open'.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return 'closed'
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return 'half_open'
+            return 'open'
+
+    def allow(self):
+        """
+        Tells whether a call may be made now, claiming the trial call when half-open.
+
+        Returns:
+            bool: True if the call may go ahead.
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+            self._trial = True
+            return True
+
+    def record_success(self):
+        """
+        Closes the breaker and resets the failure count.
+        """
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        """
+        Counts a failure, opening the breaker at the threshold or after a failed trial.
+        """
+        with self._lock:
+            self.failures += 1
+            if self._trial or self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+            self._trial = False
+
+
+class ServiceClient(object):
+    """
+    HTTP client for one dependency, with keep-alive pooling, retries and a circuit breaker.
+
+    A client is thread-safe and meant to be created once per dependency at import time,
+    like the services' connection pools.
+
+    Args:
+        name (str): Name of the dependency, used for its latency group and messages.
+        base_url (str): Scheme, host and port of the dependency, e.g. 'http://localhost:5001'.
+        connect_timeout (float): Seconds allowed to open a connection.
+        read_timeout (float): Seconds allowed to wait for each read of the response.
+        retries (int): Additional attempts after a failed attempt of a retryable request.
+        backoff (float): Base of the exponential backoff between attempts, in seconds.
+        max_backoff (float): Upper bound of a single backoff, in seconds.
+        pool_size (int): Maximum number of idle keep-alive connections kept.
+        breaker (CircuitBreaker, optional): The dependency's breaker. Defaults to a new one.
+        latency (LatencyRecorder, optional): Where call latencies are recorded. Defaults
+            to the module's shared `dependency_latency`.
+    """
+
+    def __init__(self, name, base_url, connect_timeout=1.0, read_timeout=3.0, retries=2, backoff=0.05,
+                 max_backoff=1.0, pool_size=8, breaker=None, latency=None):
+        url = urlsplit(base_url)
+        self.name = name
+        self.host = url.hostname
+        self.port = url.port
+        self.https = url.scheme == 'https'
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = breaker or CircuitBreaker()
+        self.latency = latency or dependency_latency
+        self._idle = queue.LifoQueue(maxsize=pool_size)
+        self._lock = threading.Lock()
+        self.counters = {"requests": 0, "retries": 0, "failures": 0, "rejected": 0, "connections": 0}
+
+    def _count(self, counter):
+        """
+        Increments one of the client's counters.
+
+        Args:
+            counter (str): Name of the counter.
+        """
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _connect(self):
+        """
+        Takes an idle pooled connection that is still open, or opens a new one.
+
+        Returns:
+            tuple: The (http.client.HTTPConnection, reused) pair, where `reused` is True
+                for a connection taken from the pool.
+        """
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return self._new_connection(), False
+            if not self._is_stale(conn):
+                return conn, True
+            conn.close()
+
+    @staticmethod
+    def _is_stale(conn):
+        """
+        Tells whether the dependency closed an idle kept-alive connection.
+
+        An idle connection has nothing to read, so a readable socket means the peer
+        closed it (or sent something unexpected); either way it must not be reused.
+
+        Args:
+            conn (http.client.HTTPConnection): An idle connection.
+
+        Returns:
+            bool: True if the connection must be discarded.
+        """
+        if conn.sock is None:
+            return True
+        try:
+            readable, _, _ = select.select([conn.sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def _new_connection(self):
+        """
+        Returns:
+            http.client.HTTPConnection: A newly opened connection.
+        """
+        connection_class = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        conn = connection_class(self.host, self.port, timeout=self.connect_timeout)
+        conn.connect()
+        # The connect timeout only covers opening the socket; reads get their own limit
+        conn.sock.settimeout(self.read_timeout)
+        self._count("connections")
+        return conn
+
+    def _release(self, conn, reusable):
+        """
+        Keeps a connection for the next call, or closes it.
+
+        Args:
+            conn (http.client.HTTPConnection): The connection.
+            reusable (bool): False if the response asked to close it or the call failed.
+        """
+        if reusable:
+            try:
+                self._idle.put_nowait(conn)
+                return
+            except queue.Full:
+                pass
+        conn.close()
+
+    def _attempt(self, method, path, body, headers):
+        """
+        Sends one request and reads the whole response.
+
+        If sending on a pooled connection fails, the dependency cannot have received the
+        request, so it is sent once more on a fresh connection whatever the method.
+
+        Returns:
+            ServiceResponse: The response.
+
+        Raises:
+            OSError, http.client.HTTPException: If the connection failed or timed out.
+        """
+        conn, reused = self._connect()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            if not reused:
+                raise
+            conn = self._new_connection()
+            try:
+                conn.request(method, path, body=body, headers=headers)
+            except Exception:
+                conn.close()
+                raise
+        try:
+            response = conn.getresponse()
+            data = response.read()
+        except Exception:
+            conn.close()
+            raise
+        self._release(conn, not response.will_close)
+        return ServiceResponse(response.status, {key.lower(): value for key, value in response.getheaders()}, data)
+
+    def request(self, method, path, params=None, json_body=None, headers=None, idempotency_key=None):
+        """
+        Calls the dependency, retrying retryable failures within the configured bounds.
+
+        Connection errors, timeouts and 502/503/504 answers count as failures. Requests
+        are retried only if they are idempotent: GET, HEAD and OPTIONS, or any request
+        carrying an Idempotency-Key header. Callers of mutating routes should pass
+        `idempotency_key` so their calls may be retried, provided the route honours the
+        header. Other answers, including 4xx and 500, are returned to the caller as they are.
+
+        Args:
+            method (str): HTTP method.
+            path (str): Path of the resource, e.g. '/api/goods/changes'.
+            params (dict, optional): Query string parameters.
+            json_body (optional): Value sent as a JSON body.
+            headers (dict, optional): Additional request headers.
+            idempotency_key (str, optional): Sent as the Idempotency-Key header.
+
+        Returns:
+            ServiceResponse: The dependency's response.
+
+        Raises:
+            CircuitOpenError: If the dependency's circuit breaker is open.
+            ServiceUnavailable: If every attempt failed.
+        """
+        method = method.upper()
+        headers = dict(headers or {})
+        if idempotency_key:
+            headers['Idempotency-Key'] = idempotency_key
+        body = None
+        if json_body is not None:
+            body = json.dumps(json_body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        if params:
+            path = f"{path}?{urlencode(params)}"
+        retryable = method in IDEMPOTENT_METHODS or 'Idempotency-Key' in headers
+        attempts = 1 + (self.retries if retryable else 0)
+
+        if not self.breaker.allow():
+            self._count("rejected")
+            raise CircuitOpenError(f"{self.name} is unavailable: circuit open")
+        self._count("requests")
+        started = time.perf_counter()
+        try:
+            for attempt in range(attempts):
+                if attempt:
+                    self._count("retries")
+                    time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+                try:
+                    response = self._attempt(method, path, body, headers)
+                except (OSError, http.client.HTTPException) as e:
+                    error = f"{type(e).__name__}: {e}"
+                    continue
+                if response.status in RETRY_STATUSES:
+                    error = f"HTTP {response.status}"
+                    continue
+                self.breaker.record_success()
+                return response
+        finally:
+            self.latency.record(self.name, time.perf_counter() - started)
+        self._count("failures")
+        self.breaker.record_failure()
+        raise ServiceUnavailable(f"{self.name} is unavailable after {attempts} attempts: {error}")
+
+    def get(self, path, params=None, headers=None):
+        """
+        Sends a GET request; see `request`.
+        """
+        return self.request('GET', path, params=params, headers=headers)
+
+    def post(self, path, json_body=None, headers=None, idempotency_key=None):
+        """
+        Sends a POST request; see `request`. It is only retried with an `idempotency_key`.
+        """
+        return self.request('POST', path, json_body=json_body, headers=headers, idempotency_key=idempotency_key)
+
+    def put(self, path, json_body=None, headers=None, idempotency_key=None):
+        """
+        Sends a PUT request; see `request`. It is only retried with an `idempotency_key`.
+        """
+        return self.request('PUT', path, json_body=json_body, headers=headers, idempotency_key=idempotency_key)
+
+    def stats(self):
+        """
+        Returns:
+            dict: The breaker 'state', the number of 'idle_connections' and the
+                request, retry, failure, rejection and connection counters.
+        """
+        with self._lock:
+            counters = dict(self.counters)
+        counters["state"] = self.breaker.state
+        counters["idle_connections"] = self._idle.qsize()
+        return counters
+
+    def close(self):
+        """
+        Closes every idle connection.
+        """
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
@@ -0,0 +1,141 @@
+"""
+Idempotency key store shared by the services.
+
+Clients that retry a request after a timeout send the same ``Idempotency-Key`` header
+again. The service records the key, a fingerprint of the request and the response in a
+compact table, in the same transaction as the write it protects, so a replay returns the
+stored response instead of applying the write a second time. Keys expire after a TTL and
+expired rows are purged every few hundred saves.
+
+Only successful results are stored: a refused or failed request wrote nothing, so
+running it again on retry is harmless and lets the client succeed once it has fixed the
+cause (for example by topping up its wallet).
+"""
+
+import hashlib
+import json
+import threading
+import time
+
+
+class IdempotencyConflict(Exception):
+    """
+    Raised when a key is replayed with a request that differs from the original one.
+    """
+
+
+class IdempotencyStore(object):
+    """
+    Stores the responses of idempotent operations in a SQLite table.
+
+    The methods take a cursor so that lookups and saves run inside the caller's
+    transaction, next to the write they protect.
+
+    Args:
+        ttl (int): Seconds a key is remembered.
+        table (str): Name of the table holding the keys.
+        purge_every (int): Number of saves between two purges of expired keys.
+    """
+
+    def __init__(self, ttl=86400, table='idempotency_keys', purge_every=500):
+        self.ttl = ttl
+        self.table = table
+        self.purge_every = purge_every
+        self._saves = 0
+        self._lock = threading.Lock()
+
+    def create_table(self, conn):
+        """
+        Creates the key table and its expiry index if they do not already exist.
+
+        Args:
+            conn (sqlite3.Connection): Connection to the service database.
+        """
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.table} (
+                operation TEXT NOT NULL,
+                idempotency_key TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                response TEXT NOT NULL,
+                expires_at INTEGER NOT NULL,
+                PRIMARY KEY (operation, idempotency_key)
+            ) WITHOUT ROWID;
+        ''')
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table}_expires_at ON {self.table} (expires_at)")
+
+    @staticmethod
+    def fingerprint(*params):
+        """
+        Returns a short digest identifying the parameters of a request.
+
+        Args:
+            *params: JSON-serialisable request parameters.
+
+        Returns:
+            str: A 32 character hex digest.
+        """
+        payload = json.dumps(params, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+    def lookup(self, cur, operation, key, fingerprint):
+        """
+        Returns the stored response of a key that has not expired yet.
+
+        Args:
+            cur (sqlite3.Cursor): Cursor inside the caller's transaction.
+            operation (str): Name of the protected operation, e.g. 'make_sale'.
+            key (str): The client's idempotency key.
+            fingerprint (str): Fingerprint of the current request.
+
+        Returns:
+            dict: The stored response, or None if the key is unknown or expired.
+
+        Raises:
+            IdempotencyConflict: If the key was used for a different request.
+        """
+        cur.execute(f"""
+            SELECT fingerprint, response FROM {self.table}
+            WHERE operation = ? AND idempotency_key = ? AND expires_at >= ?
+        """, (operation, key, int(time.time())))
+        row = cur.fetchone()
+        if row is None:
+            return None
+        if row[0] != fingerprint:
+            raise IdempotencyConflict(f"Idempotency key '{key}' was already used for a different request.")
+        return json.loads(row[1])
+
+    def save(self, cur, operation, key, fingerprint, response):
+        """
+        Records the response of a key, replacing an expired entry for the same key.
+
+        Args:
+            cur (sqlite3.Cursor): Cursor inside the caller's transaction.
+            operation (str): Name of the protected operation.
+            key (str): The client's idempotency key.
+            fingerprint (str): Fingerprint of the request.
+            response (dict): The JSON-serialisable response to replay.
+        """
+        now = int(time.time())
+        cur.execute(f"""
+            INSERT OR REPLACE INTO {self.table} (operation, idempotency_key, fingerprint, response, expires_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (operation, key, fingerprint, json.dumps(response), now + self.ttl))
+        with self._lock:
+            self._saves += 1
+            purge = self._saves % self.purge_every == 0
+        if purge:
+            self.purge_expired(cur, now)
+
+    def purge_expired(self, cur, now=None):
+        """
+        Deletes every expired key.
+
+        Args:
+            cur (sqlite3.Cursor): Cursor inside the caller's transaction.
+            now (int, optional): Current epoch time in seconds.
+
+        Returns:
+            int: The number of keys deleted.
+        """
+        cur.execute(f"DELETE FROM {self.table} WHERE expires_at < ?", (int(time.time()) if now is None else now,))
+        return cur.rowcount
@@ -0,0 +1,71 @@
+"""
+Request latency percentiles.
+
+`LatencyRecorder` keeps the most recent samples of each named group (a route, a group of
+routes or a downstream dependency) in a fixed-size window and computes percentiles from
+them on demand, so recording stays O(1) and memory stays bounded however long the
+service runs.
+"""
+
+import threading
+from collections import deque
+
+
+class LatencyRecorder(object):
+    """
+    Records latencies per group and reports their percentiles over a sliding window.
+
+    Args:
+        window (int): Number of most recent samples kept per group.
+    """
+
+    def __init__(self, window=2048):
+        self.window = window
+        self._samples = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, group, seconds):
+        """
+        Records one latency sample.
+
+        Args:
+            group (str): Name of the group, e.g. 'login'.
+            seconds (float): The measured latency.
+        """
+        with self._lock:
+            samples = self._samples.get(group)
+            if samples is None:
+                samples = self._samples[group] = deque(maxlen=self.window)
+            samples.append(seconds)
+            self._counts[group] = self._counts.get(group, 0) + 1
+
+    def percentiles(self):
+        """
+        Returns:
+            dict: For each group, the total 'count' of samples and the p50, p90, p99 and
+                max latency in milliseconds over the window.
+        """
+        with self._lock:
+            snapshot = {group: sorted(samples) for group, samples in self._samples.items()}
+            counts = dict(self._counts)
+        report = {}
+        for group, samples in snapshot.items():
+            def at(fraction):
+                return round(samples[min(len(samples) - 1, int(fraction * len(samples)))] * 1000, 3)
+            report[group] = {
+                "count": counts[group],
+                "p50_ms": at(0.50),
+                "p90_ms": at(0.90),
+                "p99_ms": at(0.99),
+                "max_ms": round(samples[-1] * 1000, 3),
+            }
+        return report
+
+    def reset(self):
+        """
+        Drops every sample.
+        """
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
@@ -0,0 +1,192 @@
+"""
+Versioned schema migrations and query plan reporting shared by the services.
+
+Each service lists its schema changes as numbered `Migration` entries and runs them
+from `create_db_table()`. Every migration that is applied is recorded in a small
+``schema_migrations`` table, so a database is brought up to date exactly once, whatever
+version it started from. Each migration runs in its own ``BEGIN IMMEDIATE`` transaction
+and re-checks the recorded version first, so two processes starting together cannot
+apply the same migration twice.
+
+`explain_query_plans` runs ``EXPLAIN QUERY PLAN`` over a service's hot queries and prints
+the plans at startup; a query that falls back to a full table scan is marked, so a
+dropped or unused index shows up in the startup log.
+"""
+
+import sqlite3
+from collections import namedtuple
+
+# version (int): Strictly increasing number of the migration.
+# description (str): Short human readable summary, stored with the version.
+# apply (list or function): SQL statements to run, or a function taking the connection.
+Migration = namedtuple('Migration', ['version', 'description', 'apply'])
+
+
+def table_exists(conn, table):
+    """
+    Tells whether a table or view exists.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the database.
+        table (str): Name of the table.
+
+    Returns:
+        bool: True if the table exists.
+    """
+    row = conn.execute("SELECT 1 FROM sqlite_master WHERE type IN ('table', 'view') AND name = ?",
+                       (table,)).fetchone()
+    return row is not None
+
+
+def add_column_if_missing(conn, table, column, definition):
+    """
+    Adds a column to an existing table unless it is already there.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the database.
+        table (str): Name of the table.
+        column (str): Name of the column.
+        definition (str): Column type and constraints, e.g. 'BOOLEAN DEFAULT 0'.
+
+    Returns:
+        bool: True if the column was added.
+    """
+    if not table_exists(conn, table):
+        return False
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+    if column in columns:
+        return False
+    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    return True
+
+
+def create_index_if_missing(conn, name, table, columns):
+    """
+    Creates an index unless the table is missing or already has an index on these columns.
+
+    An existing index whose leading columns match, such as the automatic index behind a
+    PRIMARY KEY or UNIQUE constraint, already serves the same lookups, so a second one
+    would only slow down writes.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the database.
+        name (str): Name of the index to create.
+        table (str): Name of the indexed table.
+        columns (list): Names of the indexed columns, in order.
+
+    Returns:
+        bool: True if the index was created.
+    """
+    if not table_exists(conn, table):
+        return False
+    for index in conn.execute(f"PRAGMA index_list({table})").fetchall():
+        indexed = [row[2] for row in conn.execute(f"PRAGMA index_info({index[1]})")]
+        if indexed[:len(columns)] == list(columns):
+            return False
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})")
+    return True
+
+
+class MigrationRunner(object):
+    """
+    Applies a service's pending migrations in version order and records them.
+
+    Args:
+        migrations (list): The service's `Migration` entries.
+        table (str): Name of the table recording the applied versions.
+    """
+
+    def __init__(self, migrations, table='schema_migrations'):
+        self.migrations = sorted(migrations, key=lambda migration: migration.version)
+        self.table = table
+
+    def current_version(self, conn):
+        """
+        Returns the highest migration version applied to a database.
+
+        Args:
+            conn (sqlite3.Connection): Connection to the database.
+
+        Returns:
+            int: The schema version, 0 for a database that was never migrated.
+        """
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS {self.table} (
+                version INTEGER PRIMARY KEY NOT NULL,
+                description TEXT NOT NULL,
+                applied_at TEXT NOT NULL
+            );
+        ''')
+        row = conn.execute(f"SELECT MAX(version) FROM {self.table}").fetchone()
+        return row[0] or 0
+
+    def migrate(self, conn):
+        """
+        Applies every migration newer than the database's schema version.
+
+        Args:
+            conn (sqlite3.Connection): Connection to the database. It must not be inside
+                a transaction; each migration is committed on its own.
+
+        Returns:
+            int: The schema version after migrating.
+
+        Raises:
+            sqlite3.Error: If a migration fails. It is rolled back and the later ones are
+                not attempted, so the recorded version stays accurate.
+        """
+        version = self.current_version(conn)
+        conn.commit()
+        for migration in self.migrations:
+            if migration.version <= version:
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                # Another process may have migrated while this one waited for the lock
+                version = self.current_version(conn)
+                if migration.version <= version:
+                    conn.rollback()
+                    continue
+                if callable(migration.apply):
+                    migration.apply(conn)
+                else:
+                    for statement in migration.apply:
+                        conn.execute(statement)
+                conn.execute(f"INSERT INTO {self.table} (version, description, applied_at) VALUES (?, ?, datetime('now'))",
+                             (migration.version, migration.description))
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
+            version = migration.version
+            print(f"Applied migration {migration.version}: {migration.description}")
+        return version
+
+
+def explain_query_plans(conn, queries):
+    """
+    Prints the query plan of each hot query and marks the ones doing a full table scan.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the database.
+        queries (dict): Maps a query name to a (sql, params) tuple. The params only need
+            the right types; their values do not change the plan.
+
+    Returns:
+        dict: Maps each query name to a dict with the 'plan' (list of str) and whether it
+            does a 'full_scan' (bool).
+    """
+    report = {}
+    for name, (query, params) in queries.items():
+        try:
+            plan = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+        except sqlite3.Error as e:
+            print(f"Query plan of {name} unavailable: {e}")
+            continue
+        # A scan that is not driven by an index reads every row of the table; virtual
+        # tables such as FTS indexes report their own lookups as scans
+        full_scan = any(step.startswith('SCAN') and 'USING' not in step and 'VIRTUAL TABLE' not in step
+                        for step in plan)
+        report[name] = {"plan": plan, "full_scan": full_scan}
+        print(f"Query plan of {name}{' (FULL TABLE SCAN)' if full_scan else ''}: {'; '.join(plan)}")
+    return report
@@ -0,0 +1,95 @@
+"""
+Streaming NDJSON responses for bulk listings.
+
+Listing endpoints normally `fetchall()` every row into a Python list and serialize it
+in one piece, so memory grows with the table. The helpers here run the query inside a
+generator instead, pull rows with `fetchmany` and yield them as newline-delimited JSON
+(one object per line), so memory stays flat and the first bytes leave immediately.
+
+The generator opens its own connection when iteration starts: Flask iterates a
+streamed body after the request (and its pooled connection scope) has ended.
+"""
+
+import json
+import sqlite3
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def iter_cursor_ndjson(cur, batch_size=500):
+    """
+    Yields the remaining rows of an executed cursor as NDJSON text, one batch at a time.
+
+    Args:
+        cur (sqlite3.Cursor): A cursor on which a SELECT statement was executed.
+        batch_size (int): Number of rows pulled by each `fetchmany` call.
+
+    Yields:
+        str: One or more complete NDJSON lines.
+    """
+    columns = [description[0] for description in cur.description]
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        yield "".join(json.dumps(dict(zip(columns, row))) + "\n" for row in rows)
+
+
+def iter_ndjson(connect, query, params=(), batch_size=500):
+    """
+    Runs a query and yields its rows as NDJSON text, one batch at a time.
+
+    Args:
+        connect (function): Returns a database connection, e.g. a service's `connect_to_db`.
+        query (str): The SELECT statement to run.
+        params (tuple): Parameters bound to the query.
+        batch_size (int): Number of rows pulled by each `fetchmany` call.
+
+    Yields:
+        str: One or more complete NDJSON lines. If the query fails part way, a final
+            line with an 'error' key is yielded, since the status code is already sent.
+    """
+    conn = connect()
+    try:
+        cur = conn.cursor()
+        cur.execute(query, params)
+        for lines in iter_cursor_ndjson(cur, batch_size):
+            yield lines
+    except sqlite3.Error as e:
+        print(f"Error streaming rows: {e}")
+        yield json.dumps({"error": "Stream aborted"}) + "\n"
+    finally:
+        conn.close()
+
+
+def ndjson_response(connect, query, params=(), batch_size=500):
+    """
+    Builds a Flask response that streams a query result as NDJSON.
+
+    Args:
+        connect (function): Returns a database connection.
+        query (str): The SELECT statement to run.
+        params (tuple): Parameters bound to the query.
+        batch_size (int): Number of rows pulled by each `fetchmany` call.
+
+    Returns:
+        flask.Response: A streamed 'application/x-ndjson' response.
+    """
+    from flask import Response
+
+    return Response(iter_ndjson(connect, query, params, batch_size), mimetype=NDJSON_MIMETYPE)
+
+
+def wants_ndjson(request):
+    """
+    Tells whether a request asked for the NDJSON streaming format.
+
+    Args:
+        request (flask.Request): The current request.
+
+    Returns:
+        bool: True for `?format=ndjson` or an `Accept: application/x-ndjson` header.
+    """
+    if request.args.get('format') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best == NDJSON_MIMETYPE
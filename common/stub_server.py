@@ -0,0 +1,158 @@
+"""
+Local HTTP stub of a dependency, for testing inter-service calls.
+
+`StubServer` listens on a free port of 127.0.0.1 in a background thread and answers
+with canned responses registered per method and path. It speaks HTTP/1.1 with
+keep-alive, records every request and the client connections they came in on, and can
+delay or fail answers or drop idle connections, so tests can check pooling, timeouts, retries and circuit
+breaking without starting the real services.
+"""
+
+import json
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+
+class StubServer(object):
+    """
+    Serves canned responses on a local port until it is stopped.
+
+    Use it as a context manager, or call `start` and `stop`.
+    """
+
+    def __init__(self):
+        self.routes = {}
+        self.requests = []
+        self.connections = set()
+        self._sockets = []
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        """
+        Returns:
+            str: The base URL of the running stub, e.g. 'http://127.0.0.1:54321'.
+        """
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def add(self, method, path, status=200, body=None, headers=None, delay=0.0, times=None):
+        """
+        Registers the response to a method and path; later registrations come first.
+
+        Args:
+            method (str): HTTP method, e.g. 'GET'.
+            path (str): Path without the query string.
+            status (int): Status code of the response.
+            body (optional): Value sent as a JSON body.
+            headers (dict, optional): Additional response headers.
+            delay (float): Seconds to wait before answering, e.g. to trigger a read timeout.
+            times (int, optional): Number of requests answered this way before the
+                previous registration (if any) takes over. Defaults to every request.
+        """
+        with self._lock:
+            self.routes.setdefault((method.upper(), path), []).insert(0, {
+                "status": status, "body": body, "headers": headers or {}, "delay": delay, "times": times,
+            })
+
+    def _respond(self, method, path):
+        """
+        Picks the registered response to a request and records the request.
+
+        Returns:
+            dict: The response, or None if nothing is registered for the method and path.
+        """
+        with self._lock:
+            self.requests.append((method, path))
+            responses = self.routes.get((method, urlsplit(path).path), [])
+            for response in responses:
+                if response["times"] is None:
+                    return response
+                if response["times"] > 0:
+                    response["times"] -= 1
+                    return response
+            return None
+
+    def drop_connections(self):
+        """
+        Closes every client connection from the server side, as an idle timeout would,
+        without telling the clients.
+        """
+        with self._lock:
+            sockets, self._sockets = self._sockets, []
+        for sock in sockets:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def start(self):
+        """
+        Starts serving on a free local port.
+
+        Returns:
+            StubServer: The stub itself.
+        """
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def handle_one_request(self):
+                with stub._lock:
+                    stub.connections.add(self.client_address)
+                    if self.connection not in stub._sockets:
+                        stub._sockets.append(self.connection)
+                BaseHTTPRequestHandler.handle_one_request(self)
+
+            def _serve(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    self.rfile.read(length)
+                response = stub._respond(self.command, self.path)
+                if response is None:
+                    response = {"status": 404, "body": {"error": "Not stubbed"}, "headers": {}, "delay": 0.0}
+                if response["delay"]:
+                    threading.Event().wait(response["delay"])
+                data = json.dumps(response["body"]).encode('utf-8') if response["body"] is not None else b''
+                try:
+                    self.send_response(response["status"])
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(data)))
+                    for name, value in response["headers"].items():
+                        self.send_header(name, value)
+                    self.end_headers()
+                    self.wfile.write(data)
+                except OSError:
+                    # The client gave up waiting, e.g. after a read timeout
+                    self.close_connection = True
+
+            do_GET = do_POST = do_PUT = do_DELETE = _serve
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops serving and closes the listening socket.
+        """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
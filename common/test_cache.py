@@ -0,0 +1,54 @@
+import pytest
+import time
+from common.cache import LRUCache
+
+"""
+Test Suite for the shared LRU/TTL cache using pytest.
+
+This module contains unit tests for `common/cache.py`. It checks LRU eviction, TTL expiry,
+and that a load racing with an invalidation is not stored.
+
+Dependencies:
+    - pytest: Framework for writing and running tests.
+    - common.cache: The module under test.
+"""
+
+def test_least_recently_used_entry_is_evicted():
+    """
+    Test that the least recently used entry is evicted when the cache is full.
+    """
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None, "The least recently used entry should be evicted."
+    assert cache.get('a') == 1 and cache.get('c') == 3, "Recently used entries should be kept."
+    assert cache.stats()['evictions'] == 1, "The eviction should be counted."
+
+
+def test_entries_expire_after_ttl():
+    """
+    Test that an entry is not returned once its TTL has passed.
+    """
+    cache = LRUCache(maxsize=4, ttl=0.01)
+    cache.set('a', 1)
+    time.sleep(0.02)
+    assert cache.get('a') is None, "An expired entry should be a miss."
+    assert cache.stats()['expirations'] == 1, "The expiry should be counted."
+
+    cache = LRUCache(maxsize=4, ttl=60)
+    cache.set('short', 1, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get('short') is None, "A per-entry TTL should expire the entry sooner."
+
+
+def test_load_racing_an_invalidation_is_not_stored():
+    """
+    Test that a value loaded before an invalidation is not put back into the cache.
+    """
+    cache = LRUCache(maxsize=4, ttl=60)
+    generation = cache.generation()
+    cache.invalidate('a')
+    assert cache.set('a', 'stale', generation) is False, "A stale load should be rejected."
+    assert cache.get('a') is None, "The stale value should not be cached."
@@ -0,0 +1,387 @@
+import pytest
+import os
+import sqlite3
+import threading
+from common.db_pool import ConnectionPool, PoolTimeoutError
+
+"""
+Test Suite for the shared SQLite connection pool using pytest.
+
+This module contains unit tests for `common/db_pool.py`. It checks that connections are
+reused, that the pool is bounded, and that a request scope shares one connection and one
+transaction between chained calls.
+
+Dependencies:
+    - pytest: Framework for writing and running tests.
+    - sqlite3: Database engine used by the pool.
+    - common.db_pool: The module under test.
+"""
+
+@pytest.fixture
+def pool():
+    """
+    Pytest fixture that provides a small pool over a test database with one table.
+
+    Yields:
+        ConnectionPool: A pool of at most two connections to the test database.
+    """
+    database = 'test_pool_database.db'
+    conn = sqlite3.connect(database)
+    conn.execute("CREATE TABLE IF NOT EXISTS items (item_id INTEGER PRIMARY KEY, name TEXT NOT NULL)")
+    conn.commit()
+    conn.close()
+
+    test_pool = ConnectionPool(database, size=2, timeout=0.2, busy_timeout=1000)
+    yield test_pool
+
+    test_pool.close_all()
+    os.remove(database)
+
+
+def test_connection_is_reused(pool):
+    """
+    Test that closing a pooled connection returns it to the pool for the next caller.
+
+    Args:
+        pool (ConnectionPool): The pool fixture.
+    """
+    first = pool.connect()
+    first_raw = first._raw
+    first.close()
+
+    second = pool.connect()
+    assert second._raw is first_raw, "The idle connection should be handed out again."
+    second.close()
+    assert pool.stats()['open'] == 1, "Only one connection should have been opened."
+
+
+def test_nested_borrow_shares_connection(pool):
+    """
+    Test that a thread borrowing twice shares one connection instead of taking two.
+
+    Args:
+        pool (ConnectionPool): The pool fixture.
+    """
+    outer = pool.connect()
+    inner = pool.connect()
+    assert inner._raw is outer._raw, "A nested borrow should share the thread's connection."
+    inner.close()
+    outer.execute("SELECT 1")
+    outer.close()
+    assert pool.stats()['idle'] == 1, "The connection should be back in the pool once both are closed."
+
+
+def test_pool_is_bounded(pool):
+    """
+    Test that borrowing more connections than the pool size times out.
+
+    Args:
+        pool (ConnectionPool): The pool fixture.
+    """
+    holding = threading.Barrier(3)
+    done = threading.Event()
+
+    def holder():
+        conn = pool.connect()
+        holding.wait()
+        done.wait()
+        conn.close()
+
+    threads = [threading.Thread(target=holder) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    holding.wait()
+    with pytest.raises(PoolTimeoutError):
+        pool.connect()
+    done.set()
+    for thread in threads:
+        thread.join()
+
+
+def test_scope_shares_connection_and_transaction(pool):
+    """
+    Test that chained calls in a scope reuse one connection and commit once at the end.
+
+    Args:
+        pool (ConnectionPool): The pool fixture.
+    """
+    with pool.scope():
+        writer = pool.connect()
+        writer.execute("INSERT INTO items (name) VALUES ('scoped')")
+        writer.commit()
+        raw = writer._raw
+        writer.close()
+
+        reader = pool.connect()
+        assert reader._raw is raw, "The scope should return the same connection."
+        assert reader.in_transaction, "The inner commit should be deferred to the scope."
+
+        outside = sqlite3.connect(pool.database)
+        count = outside.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+        outside.close()
+        assert count == 0, "Uncommitted scope writes should not be visible to other connections."
+
+    outside = sqlite3.connect(pool.database)
+    count = outside.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+    outside.close()
+    assert count == 1, "The scope should commit its transaction on exit."
+
+
+def test_scope_rolls_back_on_error(pool):
+    """
+    Test that an exception inside a scope rolls back every write made in it.
+
+    Args:
+        pool (ConnectionPool): The pool fixture.
+    """
+    with pytest.raises(RuntimeError):
+        with pool.scope():
+            conn = pool.connect()
+            conn.execute("INSERT INTO items (name) VALUES ('lost')")
+            conn.commit()
+            raise RuntimeError("boom")
+
+    conn = pool.connect()
+    count = conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+    conn.close()
+    assert count == 0, "Writes made in a failed scope should be rolled back."
+
+
+def test_scopes_are_per_thread(pool):
+    """
+    Test that concurrent threads each get their own scoped connection.
+
+    Args:
+        pool (ConnectionPool): The pool fixture.
+    """
+    seen = []
+
+    def worker(barrier):
+        with pool.scope():
+            seen.append(id(pool.connect()._raw))
+            barrier.wait()
+
+    barrier = threading.Barrier(2)
+    threads = [threading.Thread(target=worker, args=(barrier,)) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(seen)) == 2, "Each thread should hold a distinct connection."
+
+
+def test_scope_releases_unclosed_connection(pool):
+    """
+    Test that the end of a scope returns the connection even if a caller never closed it.
+
+    Args:
+        pool (ConnectionPool): The pool fixture.
+    """
+    with pool.scope():
+        leaked = pool.connect()
+        leaked.execute("SELECT 1")
+    assert pool.stats()['idle'] == 1, "The scope should hand its connection back to the pool."
+    leaked.close()
+    assert pool.stats()['idle'] == 1, "Closing a stale proxy should not release the connection twice."
+
+
+def test_after_commit_waits_for_scope(pool):
+    """
+    Test that after-commit callbacks run at the end of a scope, or at once outside one.
+
+    Args:
+        pool (ConnectionPool): The pool fixture.
+    """
+    calls = []
+    with pool.scope():
+        pool.after_commit(lambda: calls.append('scoped'))
+        assert calls == [], "The callback should wait for the scope to end."
+    assert calls == ['scoped'], "The callback should run when the scope ends."
+
+    pool.after_commit(lambda: calls.append('direct'))
+    assert calls == ['scoped', 'direct'], "Outside a scope the callback should run at once."
+
+
+def test_commit_scope_commits_early(pool):
+    """
+    Test that a scope can commit its transaction before it ends.
+
+    Args:
+        pool (ConnectionPool): The pool fixture.
+    """
+    calls = []
+    with pool.scope():
+        conn = pool.connect()
+        conn.execute("INSERT INTO items (name) VALUES ('chunk')")
+        conn.commit()
+        pool.after_commit(lambda: calls.append('chunk'))
+        pool.commit_scope()
+        other = sqlite3.connect('test_pool_database.db')
+        count = other.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+        other.close()
+        assert count == 1, "The committed chunk should be visible to other connections."
+        assert calls == ['chunk'], "Queued callbacks should run after the early commit."
+        conn.close()
+
+
+def test_release_scope_hands_connection_back(pool):
+    """
+    Test that a scope can hand its connection back before it ends and borrow one again later.
+
+    Args:
+        pool (ConnectionPool): The pool fixture.
+    """
+    with pool.scope():
+        conn = pool.connect()
+        conn.execute("INSERT INTO items (name) VALUES ('before')")
+        conn.close()
+        pool.release_scope()
+        assert pool.stats()['idle'] == 1, "The released connection should be idle in the pool."
+        other = sqlite3.connect('test_pool_database.db')
+        count = other.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+        other.close()
+        assert count == 1, "The work done before the release should be committed."
+
+        conn = pool.connect()
+        conn.execute("INSERT INTO items (name) VALUES ('after')")
+        conn.close()
+        assert pool.stats()['idle'] == 0, "A later connect should borrow a connection again."
+    assert pool.stats()['idle'] == 1, "The end of the scope should hand it back once more."
+    conn = pool.connect()
+    assert conn.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 2, "The scope should commit at its end."
+    conn.close()
+
+
+def make_app(test_pool):
+    """
+    Builds a Flask application whose requests run in request scopes of the given pool.
+
+    Its '/items/<name>' route inserts an item through two chained connections and answers
+    with the status code passed in the 'status' query parameter.
+
+    Args:
+        test_pool (ConnectionPool): The pool to bind to the application.
+
+    Returns:
+        flask.Flask: The application.
+    """
+    from flask import Flask, jsonify, request
+
+    app = Flask(__name__)
+    test_pool.init_app(app)
+
+    @app.route('/items/<name>', methods=['POST'])
+    def add_item(name):
+        conn = test_pool.connect()
+        conn.execute("INSERT INTO items (name) VALUES (?)", (name,))
+        conn.commit()
+        conn.close()
+        other = test_pool.connect()
+        count = other.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+        other.close()
+        return jsonify({"count": count}), int(request.args.get('status', 200))
+
+    return app
+
+
+def count_committed_items():
+    """
+    Returns:
+        int: The number of items another connection can see in the test database.
+    """
+    conn = sqlite3.connect('test_pool_database.db')
+    try:
+        return conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_init_app_commits_at_the_end_of_the_request(pool):
+    """
+    Test that a request's writes are committed once, after the view returned.
+
+    Args:
+        pool (ConnectionPool): The pool fixture.
+    """
+    seen = []
+    app = make_app(pool)
+
+    @app.after_request
+    def record_visibility(response):
+        # Runs before the scope's commit hook, registered first, which Flask calls last
+        seen.append(count_committed_items())
+        return response
+
+    response = app.test_client().post('/items/deferred')
+    assert response.get_json()['count'] == 1, "Chained connections should see the request's own write."
+    assert seen == [0], "The commit should be deferred until the request ends."
+    assert count_committed_items() == 1, "The write should be committed at the end of the request."
+    assert pool.stats()['idle'] == pool.stats()['open'], "The connection should be handed back."
+
+
+def test_init_app_rolls_back_server_errors(pool):
+    """
+    Test that the writes of a request answering with a 5xx status are rolled back.
+
+    Args:
+        pool (ConnectionPool): The pool fixture.
+    """
+    client = make_app(pool).test_client()
+    assert client.post('/items/failed?status=500').status_code == 500, "The view's status should be kept."
+    assert count_committed_items() == 0, "A server error should roll the request back."
+    assert client.post('/items/refused?status=400').status_code == 400, "The view's status should be kept."
+    assert count_committed_items() == 1, "A client error should still commit."
+
+
+def test_init_app_turns_a_failed_commit_into_a_500():
+    """
+    Test that a request whose commit fails answers 500 instead of the view's response.
+
+    A deferred foreign key is only checked at commit, so the view succeeds and the commit
+    at the end of the request fails.
+    """
+    database = 'test_pool_commit_database.db'
+    conn = sqlite3.connect(database)
+    conn.execute("CREATE TABLE IF NOT EXISTS owners (owner_id INTEGER PRIMARY KEY)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS items (
+            item_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            owner_id INTEGER DEFAULT 1 REFERENCES owners (owner_id) DEFERRABLE INITIALLY DEFERRED
+        )
+    """)
+    conn.commit()
+    conn.close()
+    test_pool = ConnectionPool(database, size=2, timeout=0.2, busy_timeout=1000, pragmas={'foreign_keys': 'ON'})
+    try:
+        response = make_app(test_pool).test_client().post('/items/orphan')
+        assert response.status_code == 500, "A failed commit should turn the response into a 500."
+        assert response.get_json() == {"error": "Database commit failed"}, "The failure should be reported."
+        assert test_pool.stats()['idle'] == test_pool.stats()['open'], "The connection should be handed back."
+        conn = test_pool.connect()
+        assert conn.execute("SELECT COUNT(*) FROM items").fetchone()[0] == 0, "Nothing should be committed."
+        conn.close()
+    finally:
+        test_pool.close_all()
+        os.remove(database)
+
+
+def test_use_database_repoints_the_pool(pool, tmp_path):
+    """
+    Test that a pool pointed at another database drops its idle connections to the old one.
+
+    Args:
+        pool (ConnectionPool): The pool fixture.
+        tmp_path (Path): Pytest temporary directory.
+    """
+    conn = pool.connect()
+    conn.close()
+    assert pool.stats()['open'] == 1, "A connection should be open on the first database."
+
+    pool.use_database(str(tmp_path / 'other.db'))
+    assert pool.stats()['open'] == 0, "The connections to the first database should be closed."
+    conn = pool.connect()
+    tables = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'items'").fetchone()[0]
+    conn.close()
+    assert tables == 0, "New connections should open the other database."
+    pool.use_database('test_pool_database.db')
@@ -0,0 +1,64 @@
+import pytest
+import threading
+import time
+from common.hashing import HasherBusy, PasswordHasher
+from common.metrics import LatencyRecorder
+
+"""
+Test Suite for the shared password hasher and latency recorder using pytest.
+
+This module contains unit tests for `common/hashing.py` and `common/metrics.py`. It
+checks that hashes made in worker processes verify, that a full queue is rejected at
+once, and that latency percentiles are computed per group.
+
+Dependencies:
+    - pytest: Framework for writing and running tests.
+    - common.hashing, common.metrics: The modules under test.
+"""
+
+def test_hash_and_check_in_worker_process():
+    """
+    Test that a hash computed in the process pool verifies the right password only.
+    """
+    hasher = PasswordHasher(workers=1, max_pending=4, method='pbkdf2:sha256:1000')
+    try:
+        password_hash = hasher.hash('secret')
+        assert password_hash.startswith('pbkdf2:sha256:1000$'), "The configured method should be used."
+        assert hasher.check(password_hash, 'secret'), "The right password should verify."
+        assert not hasher.check(password_hash, 'wrong'), "A wrong password should not verify."
+    finally:
+        hasher.reset()
+
+
+def test_full_queue_is_rejected_immediately():
+    """
+    Test that a hash requested while the queue is full fails fast with HasherBusy.
+    """
+    hasher = PasswordHasher(workers=1, max_pending=1, method='pbkdf2:sha256:3000000')
+    slow = threading.Thread(target=hasher.hash, args=('secret',))
+    try:
+        slow.start()
+        time.sleep(0.05)
+        started = time.perf_counter()
+        with pytest.raises(HasherBusy):
+            hasher.hash('other')
+        assert time.perf_counter() - started < 0.1, "The rejection should not wait for the queue."
+        assert hasher.rejected == 1, "The rejection should be counted."
+    finally:
+        slow.join()
+        hasher.reset()
+
+
+def test_latency_percentiles_per_group():
+    """
+    Test that percentiles are computed per group over the sliding window.
+    """
+    recorder = LatencyRecorder(window=100)
+    for ms in range(1, 201):
+        recorder.record('login', ms / 1000)
+    recorder.record('other', 0.005)
+    report = recorder.percentiles()
+    assert report['login']['count'] == 200, "Every sample should be counted."
+    assert report['login']['p50_ms'] == 151.0, "Only the last 100 samples should be in the window."
+    assert report['login']['max_ms'] == 200.0, "The max should be the slowest sample in the window."
+    assert report['other']['p99_ms'] == 5.0, "Groups should be reported separately."
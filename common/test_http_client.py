@@ -0,0 +1,133 @@
+import pytest
+import time
+from common.http_client import CircuitBreaker, CircuitOpenError, ServiceClient, ServiceUnavailable
+from common.metrics import LatencyRecorder
+from common.stub_server import StubServer
+
+"""
+Test Suite for the shared inter-service HTTP client using pytest.
+
+This module contains unit tests for `common/http_client.py`, run against the local
+`StubServer`. It checks that connections are kept alive and reused, that timeouts and
+overloaded answers are retried within bounds, that non-idempotent calls are not
+retried, and that the circuit breaker opens, fails fast and recovers.
+
+Dependencies:
+    - pytest: Framework for writing and running tests.
+    - common.http_client: The module under test.
+    - common.stub_server: Local stand-in for the dependency.
+"""
+
+@pytest.fixture
+def stub():
+    """
+    Pytest fixture that runs a stub dependency for the duration of a test.
+
+    Yields:
+        StubServer: The running stub.
+    """
+    with StubServer() as server:
+        yield server
+
+
+def test_connections_are_kept_alive(stub):
+    """
+    Test that consecutive calls reuse one pooled connection and record their latency.
+
+    Args:
+        stub (StubServer): The stub fixture.
+    """
+    stub.add('GET', '/api/goods/changes', body={'changes': []})
+    latency = LatencyRecorder()
+    client = ServiceClient('inventory', stub.url, latency=latency)
+    try:
+        for after_seq in range(5):
+            response = client.get('/api/goods/changes', params={'after_seq': after_seq})
+            assert response.json() == {'changes': []}, "The stubbed body should be returned."
+        assert client.stats()['connections'] == 1, "Every call should reuse the kept-alive connection."
+        assert len(stub.connections) == 1, "The stub should have seen a single client connection."
+        assert latency.percentiles()['inventory']['count'] == 5, "Each call should be timed per dependency."
+    finally:
+        client.close()
+
+
+def test_retries_are_bounded_and_idempotent_only(stub):
+    """
+    Test that overloaded answers and read timeouts are retried, but only for idempotent calls.
+
+    Args:
+        stub (StubServer): The stub fixture.
+    """
+    stub.add('GET', '/flaky', body={'ok': True})
+    stub.add('GET', '/flaky', status=503, times=2)
+    stub.add('GET', '/slow', body={}, delay=0.3)
+    stub.add('POST', '/sale', status=503)
+    stub.add('PUT', '/api/goods/deduct/1', status=504)
+    client = ServiceClient('sales', stub.url, read_timeout=0.1, retries=2, backoff=0.001)
+    try:
+        assert client.get('/flaky').status == 200, "Two overloaded answers should be retried past."
+        started = time.perf_counter()
+        with pytest.raises(ServiceUnavailable):
+            client.get('/slow')
+        assert time.perf_counter() - started < 0.6, "Each attempt should be cut by the read timeout."
+        with pytest.raises(ServiceUnavailable):
+            client.post('/sale', json_body={})
+        assert stub.requests.count(('POST', '/sale')) == 1, "A plain POST should not be retried."
+        with pytest.raises(ServiceUnavailable):
+            client.post('/sale', json_body={}, headers={'Idempotency-Key': 'k1'})
+        assert stub.requests.count(('POST', '/sale')) == 4, "A POST with an Idempotency-Key may be retried."
+        with pytest.raises(ServiceUnavailable):
+            client.put('/api/goods/deduct/1', json_body={'quantity': 1})
+        assert stub.requests.count(('PUT', '/api/goods/deduct/1')) == 1, \
+            "A PUT deducting stock should not be retried without an Idempotency-Key."
+    finally:
+        client.close()
+
+
+def test_stale_pooled_connection_is_replaced(stub):
+    """
+    Test that a kept-alive connection closed by the dependency is not used for the next call,
+    so even a POST, which is never retried, goes through.
+
+    Args:
+        stub (StubServer): The stub fixture.
+    """
+    stub.add('POST', '/sale', body={'status': 'Sale successful'})
+    client = ServiceClient('sales', stub.url, retries=0)
+    try:
+        assert client.post('/sale', json_body={}).status == 200, "The first POST should succeed."
+        stub.drop_connections()
+        time.sleep(0.05)
+        assert client.post('/sale', json_body={}).status == 200, "The POST should be sent on a fresh connection."
+        assert stub.requests.count(('POST', '/sale')) == 2, "Each POST should reach the dependency exactly once."
+        assert client.stats()['connections'] == 2, "The dropped connection should have been replaced."
+    finally:
+        client.close()
+
+
+def test_circuit_breaker_fails_fast_and_recovers(stub):
+    """
+    Test that repeated failures open the breaker, which then refuses calls until a trial succeeds.
+
+    Args:
+        stub (StubServer): The stub fixture.
+    """
+    stub.add('GET', '/wallet', status=503)
+    breaker = CircuitBreaker(threshold=2, reset_timeout=0.2)
+    client = ServiceClient('wallet', stub.url, retries=0, breaker=breaker)
+    try:
+        for _ in range(2):
+            with pytest.raises(ServiceUnavailable):
+                client.get('/wallet')
+        assert breaker.state == 'open', "Two consecutive failures should open the breaker."
+        with pytest.raises(CircuitOpenError):
+            client.get('/wallet')
+        assert len(stub.requests) == 2, "An open breaker should not call the dependency."
+
+        time.sleep(0.25)
+        stub.add('GET', '/wallet', body={'balance': 10})
+        assert client.get('/wallet').json() == {'balance': 10}, "The trial call should go through."
+        assert breaker.state == 'closed', "A successful trial should close the breaker."
+        assert client.stats()['rejected'] == 1, "The refused call should be counted."
+    finally:
+        client.close()
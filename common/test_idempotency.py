@@ -0,0 +1,63 @@
+import pytest
+import sqlite3
+from common.idempotency import IdempotencyConflict, IdempotencyStore
+
+"""
+Test Suite for the shared idempotency key store using pytest.
+
+This module contains unit tests for `common/idempotency.py`. It checks that stored
+responses are replayed, that a key cannot be reused for another request, and that keys
+expire after their TTL.
+
+Dependencies:
+    - pytest: Framework for writing and running tests.
+    - sqlite3: Database engine backing the store.
+    - common.idempotency: The module under test.
+"""
+
+@pytest.fixture
+def cur():
+    """
+    Pytest fixture that provides a cursor on an in-memory database with the key table.
+
+    Yields:
+        sqlite3.Cursor: A cursor on the test database.
+    """
+    conn = sqlite3.connect(':memory:')
+    IdempotencyStore().create_table(conn)
+    yield conn.cursor()
+    conn.close()
+
+
+def test_lookup_replays_saved_response(cur):
+    """
+    Test that a saved response is returned for the same key and request.
+
+    Args:
+        cur (sqlite3.Cursor): The cursor fixture.
+    """
+    store = IdempotencyStore()
+    fingerprint = store.fingerprint('alice', 10.0)
+    assert store.lookup(cur, 'charge', 'k1', fingerprint) is None, "An unknown key should not match."
+    store.save(cur, 'charge', 'k1', fingerprint, {"status": "ok"})
+    assert store.lookup(cur, 'charge', 'k1', fingerprint) == {"status": "ok"}, "The response should be replayed."
+    assert store.lookup(cur, 'deduct', 'k1', fingerprint) is None, "Keys should be scoped per operation."
+    with pytest.raises(IdempotencyConflict):
+        store.lookup(cur, 'charge', 'k1', store.fingerprint('alice', 20.0))
+
+
+def test_expired_keys_are_ignored_and_purged(cur):
+    """
+    Test that keys past their TTL no longer match and are purged.
+
+    Args:
+        cur (sqlite3.Cursor): The cursor fixture.
+    """
+    store = IdempotencyStore(ttl=-1, purge_every=2)
+    fingerprint = store.fingerprint('bob')
+    store.save(cur, 'charge', 'old', fingerprint, {"status": "ok"})
+    assert store.lookup(cur, 'charge', 'old', fingerprint) is None, "An expired key should not match."
+
+    store.save(cur, 'charge', 'older', fingerprint, {"status": "ok"})
+    cur.execute("SELECT COUNT(*) FROM idempotency_keys")
+    assert cur.fetchone()[0] == 0, "Every second save should purge the expired keys."
@@ -0,0 +1,91 @@
+import pytest
+import sqlite3
+from common.migrations import (
+    Migration, MigrationRunner, add_column_if_missing, create_index_if_missing, explain_query_plans
+)
+
+"""
+Test Suite for the shared schema migration runner using pytest.
+
+This module contains unit tests for `common/migrations.py`. It checks that migrations are
+applied once and in order, that a failing migration is rolled back, and that query plans
+flag full table scans.
+
+Dependencies:
+    - pytest: Framework for writing and running tests.
+    - sqlite3: Database engine for the test database.
+    - common.migrations: The module under test.
+"""
+
+@pytest.fixture
+def conn():
+    """
+    Pytest fixture that provides an in-memory database with an unindexed 'items' table.
+
+    Yields:
+        sqlite3.Connection: A connection to the test database.
+    """
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE items (item_id INTEGER PRIMARY KEY, name TEXT NOT NULL)")
+    yield conn
+    conn.close()
+
+
+def test_migrations_are_applied_once_in_order(conn):
+    """
+    Test that pending migrations run in version order and are recorded.
+
+    Args:
+        conn (sqlite3.Connection): The connection fixture.
+    """
+    calls = []
+    runner = MigrationRunner([
+        Migration(2, "Second", lambda c: calls.append(2)),
+        Migration(1, "First", lambda c: calls.append(1)),
+    ])
+    assert runner.migrate(conn) == 2, "The schema should be at the latest version."
+    assert runner.migrate(conn) == 2, "A second run should keep the version."
+    assert calls == [1, 2], "Each migration should run once, in version order."
+
+
+def test_failed_migration_is_rolled_back(conn):
+    """
+    Test that a failing migration leaves neither its changes nor its version behind.
+
+    Args:
+        conn (sqlite3.Connection): The connection fixture.
+    """
+    runner = MigrationRunner([
+        Migration(1, "Index items", ["CREATE INDEX idx_items_name ON items (name)"]),
+        Migration(2, "Broken", ["CREATE INDEX idx_items_size ON items (size)"]),
+    ])
+    with pytest.raises(sqlite3.Error):
+        runner.migrate(conn)
+    assert runner.current_version(conn) == 1, "Only the first migration should be recorded."
+
+
+def test_helpers_skip_existing_schema(conn):
+    """
+    Test that the helpers do not duplicate columns or indexes, nor touch missing tables.
+
+    Args:
+        conn (sqlite3.Connection): The connection fixture.
+    """
+    assert add_column_if_missing(conn, 'items', 'size', 'INTEGER'), "A new column should be added."
+    assert not add_column_if_missing(conn, 'items', 'size', 'INTEGER'), "An existing column should be kept."
+    assert create_index_if_missing(conn, 'idx_items_name', 'items', ['name']), "A new index should be created."
+    assert not create_index_if_missing(conn, 'idx_items_name2', 'items', ['name']), "A duplicate should be skipped."
+    assert not create_index_if_missing(conn, 'idx_other', 'other', ['name']), "A missing table should be skipped."
+
+
+def test_query_plans_flag_full_scans(conn):
+    """
+    Test that a lookup on an unindexed column is reported as a full table scan.
+
+    Args:
+        conn (sqlite3.Connection): The connection fixture.
+    """
+    queries = {"by_name": ("SELECT * FROM items WHERE name = ?", ('x',))}
+    assert explain_query_plans(conn, queries)['by_name']['full_scan'], "An unindexed lookup should scan."
+    create_index_if_missing(conn, 'idx_items_name', 'items', ['name'])
+    assert not explain_query_plans(conn, queries)['by_name']['full_scan'], "An indexed lookup should search."
@@ -0,0 +1,94 @@
+import pytest
+import os
+from common.db_pool import ConnectionPool
+from common.storage import resolve_storage_profile
+
+"""
+Test Suite for the shared SQLite storage profiles using pytest.
+
+This module contains unit tests for `common/storage.py`. It checks how profiles are
+selected from the environment and that a pool built from a profile applies it to its
+connections.
+
+Dependencies:
+    - pytest: Framework for writing and running tests.
+    - common.storage / common.db_pool: The modules under test.
+"""
+
+@pytest.fixture
+def clean_env(monkeypatch):
+    """
+    Pytest fixture that removes every storage variable from the environment.
+
+    Yields:
+        MonkeyPatch: The monkeypatch helper, for setting variables in the test.
+    """
+    for key in list(os.environ):
+        if 'DB_' in key:
+            monkeypatch.delenv(key)
+    yield monkeypatch
+
+
+def test_default_profile_is_wal(clean_env):
+    """
+    Test that services default to the WAL profile.
+
+    Args:
+        clean_env (MonkeyPatch): The clean environment fixture.
+    """
+    name, settings = resolve_storage_profile('service1')
+    assert name == 'wal', "The default profile should be 'wal'."
+    assert settings['journal_mode'] == 'WAL', "The default profile should enable WAL."
+    assert list(settings)[0] == 'journal_mode', "journal_mode should be applied first."
+
+
+def test_service_variable_overrides_global(clean_env):
+    """
+    Test that a service-specific variable wins over the global one.
+
+    Args:
+        clean_env (MonkeyPatch): The clean environment fixture.
+    """
+    clean_env.setenv('DB_PROFILE', 'legacy')
+    clean_env.setenv('SERVICE3_DB_PROFILE', 'durable')
+    clean_env.setenv('DB_BUSY_TIMEOUT', '250')
+
+    assert resolve_storage_profile('service1')[0] == 'legacy', "service1 should use the global profile."
+    name, settings = resolve_storage_profile('service3')
+    assert name == 'durable', "service3 should use its own profile."
+    assert settings['busy_timeout'] == '250', "Single settings should be overridable."
+
+
+def test_unknown_profile_is_rejected(clean_env):
+    """
+    Test that selecting an unknown profile fails at startup.
+
+    Args:
+        clean_env (MonkeyPatch): The clean environment fixture.
+    """
+    clean_env.setenv('DB_PROFILE', 'turbo')
+    with pytest.raises(ValueError):
+        resolve_storage_profile('service2')
+
+
+def test_pool_applies_profile(clean_env):
+    """
+    Test that a pool built from a profile reports the settings in effect.
+
+    Args:
+        clean_env (MonkeyPatch): The clean environment fixture.
+    """
+    database = 'test_storage_database.db'
+    clean_env.setenv('SERVICE4_DB_POOL_SIZE', '3')
+    pool = ConnectionPool.from_profile(database, 'service4')
+    try:
+        effective = pool.report()
+        assert pool.size == 3, "The pool size should come from the environment."
+        assert effective['journal_mode'] == 'wal', "The connection should be in WAL mode."
+        assert effective['busy_timeout'] == 5000, "The busy timeout should be applied."
+        assert effective['temp_store'] == 2, "Temporary tables should be kept in memory."
+    finally:
+        pool.close_all()
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(database + suffix):
+                os.remove(database + suffix)
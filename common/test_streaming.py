@@ -0,0 +1,64 @@
+import pytest
+import json
+import os
+import sqlite3
+from flask import Flask
+from common.db_pool import ConnectionPool
+from common.streaming import ndjson_response
+
+"""
+Test Suite for the shared NDJSON streaming helpers using pytest.
+
+This module contains unit tests for `common/streaming.py`. It streams a table through a
+Flask app bound to a connection pool, to check that the stream works after the request
+scope has ended and that its connection goes back to the pool.
+
+Dependencies:
+    - pytest: Framework for writing and running tests.
+    - flask: Web framework used to serve the stream.
+    - common.streaming / common.db_pool: The modules under test.
+"""
+
+@pytest.fixture
+def setup():
+    """
+    Pytest fixture that provides a pooled Flask app streaming a 1200 row table.
+
+    Yields:
+        tuple: The Flask test client and the connection pool.
+    """
+    database = 'test_streaming_database.db'
+    conn = sqlite3.connect(database)
+    conn.execute("CREATE TABLE items (item_id INTEGER PRIMARY KEY, name TEXT NOT NULL)")
+    conn.executemany("INSERT INTO items (name) VALUES (?)", [(f"item{i}",) for i in range(1200)])
+    conn.commit()
+    conn.close()
+
+    pool = ConnectionPool(database, size=2)
+    app = Flask(__name__)
+    pool.init_app(app)
+
+    @app.route('/items')
+    def items():
+        return ndjson_response(pool.connect, "SELECT * FROM items ORDER BY item_id", batch_size=500)
+
+    with app.test_client() as client:
+        yield client, pool
+
+    pool.close_all()
+    os.remove(database)
+
+
+def test_stream_returns_every_row(setup):
+    """
+    Test that every row is streamed, across several fetchmany batches, in order.
+
+    Args:
+        setup (tuple): The test client and pool fixture.
+    """
+    client, pool = setup
+    response = client.get('/items')
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert len(rows) == 1200, "Every row should be streamed."
+    assert rows[0] == {"item_id": 1, "name": "item0"}, "Rows should be streamed as objects in order."
+    assert pool.stats()['idle'] == pool.stats()['open'], "The stream should hand its connection back."
@@ -15,17 +15,90 @@ Dependencies:
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import sqlite3
+import csv
+import io
+import json
 import cProfile
 import pstats
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.db_pool import ConnectionPool
+from common.idempotency import IdempotencyConflict, IdempotencyStore
+from common.migrations import Migration, MigrationRunner, explain_query_plans, table_exists
+from common.storage import get_env_setting
+from common.streaming import ndjson_response, wants_ndjson
+
+DATABASE = 'customer_database.db'
+
+# Connections are borrowed from a shared pool configured by the service's storage profile
+db_pool = ConnectionPool.from_profile(DATABASE, 'service1', size=8)
+
+# Responses of successful wallet operations, replayed when a client retries with the same key
+idempotency_store = IdempotencyStore(ttl=int(get_env_setting('service1', 'IDEMPOTENCY_TTL') or 86400))
+
+# Columns a customer listing may project; the password is never listed
+CUSTOMER_LIST_FIELDS = ['customer_id', 'full_name', 'username', 'age', 'address', 'gender',
+                        'marital_status', 'wallet_balance']
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+# Schema changes applied by create_db_table, in version order; never edit an applied entry
+MIGRATIONS = [
+    Migration(1, "Create the idempotency key table", idempotency_store.create_table),
+    Migration(2, "Record wallet changes in an append-only ledger with balance snapshots",
+              lambda conn: create_wallet_ledger(conn)),
+    Migration(3, "Read customers with their wallet balance from the ledger",
+              lambda conn: create_customer_accounts_view(conn)),
+]
+
+# Live wallet balance of a customer: the running total carried by its newest ledger entry,
+# found through the (customer_id, entry_id) index. 'customers.wallet_balance' is only a
+# cache, refreshed by take_wallet_snapshots and used while a wallet has no entry yet
+WALLET_BALANCE_SQL = """
+    IFNULL((SELECT balance_after FROM wallet_ledger
+            WHERE wallet_ledger.customer_id = customers.customer_id
+            ORDER BY entry_id DESC LIMIT 1), customers.wallet_balance)
+"""
+
+# Upper bound on the number of lines accepted by a single wallet batch, and the number of
+# usernames looked up per query (below SQLite's limit on bound parameters)
+MAX_WALLET_BATCH_LINES = 10000
+WALLET_LOOKUP_CHUNK = 500
+
+# Fields of an imported customer row, in insertion order; rows are inserted in chunks of
+# IMPORT_CHUNK_SIZE, each committed on its own so other writers are not blocked for long
+CUSTOMER_IMPORT_FIELDS = ['full_name', 'username', 'password', 'age', 'address', 'gender', 'marital_status']
+IMPORT_CHUNK_SIZE = 500
+MAX_IMPORT_ROWS = 250000
+
+# Largest difference tolerated between two wallet totals, since balances are floats
+WALLET_TOLERANCE = 1e-6
+DEFAULT_LEDGER_PAGE_SIZE = 50
+migration_runner = MigrationRunner(MIGRATIONS)
+
+# Hot queries whose plans are reported at startup, with sample parameters
+HOT_QUERIES = {
+    "get_customer_by_id": ("SELECT * FROM customer_accounts WHERE customer_id = ?", (1,)),
+    "get_customer_by_username": ("SELECT * FROM customer_accounts WHERE username = ?", ('username',)),
+    "get_customers_page": ("SELECT * FROM customer_accounts WHERE customer_id > ? ORDER BY customer_id LIMIT ?",
+                           (0, 1)),
+    "get_wallet_ledger": ("SELECT * FROM wallet_ledger WHERE customer_id = ? AND entry_id > ? "
+                          "ORDER BY entry_id LIMIT ?", (1, 0, 50)),
+}
+
 def connect_to_db():
     """
-    Establishes a connection to the SQLite database.
+    Borrows a connection to the SQLite database from the service's connection pool.
+
+    Inside a request the same connection is returned to every caller, so chained calls
+    such as `insert_customer` followed by `get_customer_by_id` share one transaction.
 
     Returns:
-        sqlite3.Connection: A connection object to the 'customer_database.db' SQLite database.
+        PooledConnection: A pooled connection to the 'customer_database.db' SQLite database.
     """
-    conn = sqlite3.connect('customer_database.db')
-    return conn
+    return db_pool.connect()
 
 def create_db_table():
     """
@@ -33,7 +106,8 @@ def create_db_table():
 
     The table includes fields for customer ID, full name, username, password, age,
     address, gender, marital status, and wallet balance. If the table already exists,
-    an error message is printed.
+    an error message is printed. The pending schema migrations, such as the idempotency key
+    table, are applied afterwards.
 
     Returns:
         None
@@ -59,6 +133,252 @@ def create_db_table():
         print("Customer table creation failed - Maybe table already exists")
     finally:
         conn.close()
+    migrate_db()
+
+def create_wallet_ledger(conn):
+    """
+    Creates the 'wallet_ledger' and 'wallet_snapshots' tables and opens the ledger of
+    every existing customer with their current balance.
+
+    Every wallet change appends a signed entry with the balance after it, so the history of
+    a wallet can be read back and its balance recomputed. Snapshots record the balance of a
+    customer at a given entry, so a reconciliation only has to add up the entries after it.
+    The ledger is the source of truth of the balances, see `WALLET_BALANCE_SQL`.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the customer database.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS wallet_ledger (
+            entry_id INTEGER PRIMARY KEY NOT NULL,
+            customer_id INTEGER NOT NULL,
+            operation TEXT NOT NULL,
+            amount REAL NOT NULL,
+            balance_after REAL NOT NULL,
+            created_at TEXT NOT NULL
+        );
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_wallet_ledger_customer ON wallet_ledger (customer_id, entry_id)")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS wallet_snapshots (
+            customer_id INTEGER NOT NULL,
+            entry_id INTEGER NOT NULL,
+            balance REAL NOT NULL,
+            taken_at TEXT NOT NULL,
+            PRIMARY KEY (customer_id, entry_id)
+        ) WITHOUT ROWID;
+    ''')
+    conn.execute("""
+        INSERT INTO wallet_ledger (customer_id, operation, amount, balance_after, created_at)
+        SELECT customer_id, 'opening', wallet_balance, wallet_balance, datetime('now')
+        FROM customers WHERE wallet_balance != 0
+    """)
+
+def create_customer_accounts_view(conn):
+    """
+    Creates the 'customer_accounts' view: the customers with their live wallet balance.
+
+    Customer reads go through the view, so they see every wallet change as soon as its
+    ledger entry is committed, while the changes themselves never write the customer row.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the customer database.
+    """
+    if not table_exists(conn, 'customers'):
+        return
+    conn.execute("DROP VIEW IF EXISTS customer_accounts")
+    conn.execute(f"""
+        CREATE VIEW customer_accounts AS
+        SELECT customer_id, full_name, username, password, age, address, gender, marital_status,
+               {WALLET_BALANCE_SQL} AS wallet_balance
+        FROM customers
+    """)
+
+def record_wallet_entry(cur, operation, username, amount):
+    """
+    Applies a wallet change by appending its entry to the ledger.
+
+    The entry's 'balance_after' is the running total of the customer's previous entry plus
+    the signed amount, so the change is one indexed read and one append; the customer row
+    is only read. It must run inside a write transaction, so concurrent changes to the
+    same wallet are serialized.
+
+    Args:
+        cur (sqlite3.Cursor): Cursor inside the wallet change's transaction.
+        operation (str): 'charge' or 'deduct'.
+        username (str): The unique username of the customer.
+        amount (float): The amount of the change, positive for both operations.
+
+    Returns:
+        bool: True if the entry was appended, False if the customer does not exist.
+    """
+    signed = amount if operation == 'charge' else -amount
+    cur.execute(f"""
+        INSERT INTO wallet_ledger (customer_id, operation, amount, balance_after, created_at)
+        SELECT customer_id, ?, ?, {WALLET_BALANCE_SQL} + ?, datetime('now') FROM customers WHERE username = ?
+    """, (operation, signed, signed, username))
+    return cur.rowcount > 0
+
+def get_wallet(username, after_id=0, limit=DEFAULT_LEDGER_PAGE_SIZE):
+    """
+    Retrieves a customer's wallet balance and one page of its ledger, oldest entry first.
+
+    The balance is the running total of the newest ledger entry, so reading it does not
+    depend on the length of the ledger.
+
+    Args:
+        username (str): The unique username of the customer.
+        after_id (int): Return ledger entries whose ID is greater than this value.
+        limit (int): Maximum number of entries to return.
+
+    Returns:
+        dict: The 'username', 'wallet_balance', 'entries' (list) and 'next_after_id' (None
+            on the last page), or an empty dictionary if the customer does not exist.
+    """
+    wallet = {}
+    try:
+        conn = connect_to_db()
+        conn.row_factory = sqlite3.Row
+        cur = conn.cursor()
+        cur.execute("SELECT customer_id, wallet_balance FROM customer_accounts WHERE username = ?", (username,))
+        row = cur.fetchone()
+        if row:
+            cur.execute("""
+                SELECT entry_id, operation, amount, balance_after, created_at FROM wallet_ledger
+                WHERE customer_id = ? AND entry_id > ?
+                ORDER BY entry_id
+                LIMIT ?
+            """, (row["customer_id"], after_id, limit + 1))
+            entries = [dict(entry) for entry in cur.fetchall()]
+            wallet = {
+                "username": username,
+                "wallet_balance": row["wallet_balance"],
+                "entries": entries[:limit],
+                "next_after_id": entries[limit - 1]["entry_id"] if len(entries) > limit else None,
+            }
+    except sqlite3.Error as e:
+        print(f"Error retrieving wallet: {e}")
+        wallet = {}
+    finally:
+        conn.close()
+    return wallet
+
+def take_wallet_snapshots():
+    """
+    Records a balance snapshot for every customer whose ledger grew since the last snapshot,
+    and refreshes the cached 'wallet_balance' of their customer rows.
+
+    Only the entries appended after the newest snapshot are read, so running it
+    periodically costs in proportion to the wallet activity since the previous run, and
+    the busy customer rows are written once per run rather than once per wallet change.
+
+    Returns:
+        int: The number of snapshots taken, or None on error.
+    """
+    try:
+        conn = connect_to_db()
+        cur = conn.cursor()
+        # Hold the write lock so no entry is appended between the snapshot and the cache refresh
+        if not conn.in_transaction:
+            cur.execute("BEGIN IMMEDIATE")
+        last_snapshot = cur.execute("SELECT IFNULL(MAX(entry_id), 0) FROM wallet_snapshots").fetchone()[0]
+        cur.execute("""
+            INSERT OR IGNORE INTO wallet_snapshots (customer_id, entry_id, balance, taken_at)
+            SELECT ledger.customer_id, ledger.entry_id, ledger.balance_after, datetime('now')
+            FROM wallet_ledger AS ledger
+            JOIN (
+                SELECT customer_id, MAX(entry_id) AS entry_id FROM wallet_ledger
+                WHERE entry_id > ?
+                GROUP BY customer_id
+            ) AS latest ON latest.entry_id = ledger.entry_id
+        """, (last_snapshot,))
+        taken = cur.rowcount
+        cur.execute(f"""
+            UPDATE customers SET wallet_balance = {WALLET_BALANCE_SQL}
+            WHERE customer_id IN (SELECT customer_id FROM wallet_ledger WHERE entry_id > ?)
+        """, (last_snapshot,))
+        conn.commit()
+        return taken
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Error taking wallet snapshots: {e}")
+        return None
+    finally:
+        conn.close()
+
+def reconcile_wallets():
+    """
+    Verifies every wallet against its ledger.
+
+    Two checks are made per customer: the newest snapshot must equal the sum of the ledger
+    entries up to it, and the live balance (the running total of the newest entry) must
+    equal that snapshot plus the entries appended after it.
+
+    Returns:
+        dict: The number of wallets 'checked' and the 'mismatches' (list of dicts with the
+            username, the 'wallet_balance', the 'expected_balance' from the ledger, and
+            whether the 'snapshot' or the 'balance' check failed), or None on error.
+    """
+    try:
+        conn = connect_to_db()
+        cur = conn.cursor()
+        cur.execute(f"""
+            SELECT customers.username, {WALLET_BALANCE_SQL}, snapshot.balance,
+                   (SELECT IFNULL(SUM(amount), 0) FROM wallet_ledger
+                    WHERE customer_id = customers.customer_id AND entry_id <= IFNULL(snapshot.entry_id, 0)),
+                   (SELECT IFNULL(SUM(amount), 0) FROM wallet_ledger
+                    WHERE customer_id = customers.customer_id AND entry_id > IFNULL(snapshot.entry_id, 0))
+            FROM customers
+            LEFT JOIN wallet_snapshots AS snapshot ON snapshot.customer_id = customers.customer_id
+                AND snapshot.entry_id = (SELECT MAX(entry_id) FROM wallet_snapshots
+                                         WHERE customer_id = customers.customer_id)
+        """)
+        rows = cur.fetchall()
+    except sqlite3.Error as e:
+        print(f"Error reconciling wallets: {e}")
+        return None
+    finally:
+        conn.close()
+
+    mismatches = []
+    for username, balance, snapshot_balance, ledger_at_snapshot, ledger_tail in rows:
+        expected = (snapshot_balance or 0) + ledger_tail
+        if snapshot_balance is not None and abs(snapshot_balance - ledger_at_snapshot) > WALLET_TOLERANCE:
+            mismatches.append({"username": username, "wallet_balance": balance,
+                               "expected_balance": ledger_at_snapshot + ledger_tail, "check": "snapshot"})
+        elif abs(balance - expected) > WALLET_TOLERANCE:
+            mismatches.append({"username": username, "wallet_balance": balance,
+                               "expected_balance": expected, "check": "balance"})
+    return {"checked": len(rows), "mismatches": mismatches}
+
+def migrate_db():
+    """
+    Brings the database schema up to date by applying the pending entries of `MIGRATIONS`.
+
+    Returns:
+        int: The schema version after migrating, or None if a migration failed.
+    """
+    try:
+        conn = connect_to_db()
+        return migration_runner.migrate(conn)
+    except sqlite3.Error as e:
+        print(f"Error migrating the customer database: {e}")
+        return None
+    finally:
+        conn.close()
+
+def report_query_plans():
+    """
+    Prints the query plan of every entry of `HOT_QUERIES`, marking full table scans.
+
+    Returns:
+        dict: Maps each query name to its plan and whether it scans the whole table.
+    """
+    conn = connect_to_db()
+    try:
+        return explain_query_plans(conn, HOT_QUERIES)
+    finally:
+        conn.close()
 
 def insert_customer(customer):
     """
@@ -80,6 +400,7 @@ def insert_customer(customer):
     inserted_customer = {}
     try:
         conn = connect_to_db()
+        conn.row_factory = sqlite3.Row
         cur = conn.cursor()
         cur.execute("""
             INSERT INTO customers (
@@ -94,8 +415,10 @@ def insert_customer(customer):
             customer['gender'],
             customer['marital_status']
         ))
+        # Read the row back on the same connection rather than opening another one
+        cur.execute("SELECT * FROM customer_accounts WHERE customer_id = ?", (cur.lastrowid,))
+        inserted_customer = dict(cur.fetchone())
         conn.commit()
-        inserted_customer = get_customer_by_id(cur.lastrowid)
     except sqlite3.IntegrityError:
         conn.rollback()
         print("Error: Username already taken")
@@ -103,19 +426,111 @@ def insert_customer(customer):
         conn.close()
     return inserted_customer
 
+def validate_import_row(row):
+    """
+    Validates one customer row of a bulk import.
+
+    Values read from CSV are all strings, so a numeric string is accepted for the age.
+
+    Args:
+        row (dict): The customer fields, as parsed from the request body.
+
+    Returns:
+        tuple: The (values, error) pair. `values` is the tuple of CUSTOMER_IMPORT_FIELDS
+            and `error` is None for a valid row; otherwise `values` is None and `error`
+            describes the problem.
+    """
+    if not isinstance(row, dict):
+        return None, "Row must be an object"
+    values = []
+    for field in CUSTOMER_IMPORT_FIELDS:
+        value = row.get(field)
+        if value is None:
+            return None, f"Missing field: {field}"
+        if field == 'age':
+            if isinstance(value, str) and value.strip().isdigit():
+                value = int(value)
+            if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+                return None, "Invalid age"
+        elif not isinstance(value, str):
+            return None, f"Invalid {field}"
+        elif field in ('full_name', 'username', 'password') and not value.strip():
+            return None, f"Missing field: {field}"
+        values.append(value)
+    return tuple(values), None
+
+def import_customers(rows):
+    """
+    Inserts many validated customers in chunked transactions.
+
+    Each chunk looks up which of its usernames are already taken with one IN query, inserts
+    the others with one `executemany` and commits, so a duplicate username is reported
+    for its row without aborting the rest of the import. A chunk that fails for another
+    reason is rolled back and its rows are reported; the following chunks still run.
+
+    Args:
+        rows (list): A list of (index, values) pairs, where `index` is the position of the
+            row in the request and `values` a tuple of CUSTOMER_IMPORT_FIELDS.
+
+    Returns:
+        dict: A dictionary with the number of customers 'inserted' and the 'rejected'
+            rows, each a dictionary with its 'index', 'username' and 'error'.
+    """
+    result = {"inserted": 0, "rejected": []}
+    for start in range(0, len(rows), IMPORT_CHUNK_SIZE):
+        chunk = rows[start:start + IMPORT_CHUNK_SIZE]
+        try:
+            conn = connect_to_db()
+            cur = conn.cursor()
+            # Hold the write lock between the lookup and the insert
+            if not conn.in_transaction:
+                cur.execute("BEGIN IMMEDIATE")
+            usernames = list({values[1] for _, values in chunk})
+            cur.execute(f"SELECT username FROM customers WHERE username IN ({', '.join('?' * len(usernames))})",
+                        usernames)
+            taken = {row[0] for row in cur.fetchall()}
+            new_customers, conflicts = [], []
+            for index, values in chunk:
+                if values[1] in taken:
+                    conflicts.append({"index": index, "username": values[1], "error": "Username already taken"})
+                else:
+                    taken.add(values[1])
+                    new_customers.append(values)
+            cur.executemany("""
+                INSERT INTO customers (
+                    full_name, username, password, age, address, gender, marital_status
+                ) VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, new_customers)
+            conn.commit()
+            # Inside a request the commit is deferred; release the write lock per chunk
+            db_pool.commit_scope()
+            result["inserted"] += len(new_customers)
+            result["rejected"].extend(conflicts)
+        except sqlite3.Error as e:
+            conn.rollback()
+            print(f"Error importing customers: {e}")
+            result.setdefault("failed", 0)
+            result["failed"] += len(chunk)
+            result["rejected"].extend({"index": index, "username": values[1], "error": "Cannot insert customer"}
+                                      for index, values in chunk)
+        finally:
+            conn.close()
+    return result
+
 def get_customers():
     """
-    Retrieves all customers from the 'customers' table.
+    Retrieves all customers from the 'customers' table, without their passwords.
 
     Returns:
-        list: A list of dictionaries, each representing a customer. Returns an empty list if an error occurs.
+        list: A list of dictionaries, each holding the CUSTOMER_LIST_FIELDS of a customer.
+            Returns an empty list if an error occurs.
     """
     customers = []
     try:
         conn = connect_to_db()
         conn.row_factory = sqlite3.Row
         cur = conn.cursor()
-        cur.execute("SELECT * FROM customers")
+        cur.execute(f"SELECT {', '.join(CUSTOMER_LIST_FIELDS)} FROM customer_accounts ORDER BY customer_id")
         rows = cur.fetchall()
         for row in rows:
             customer = dict(row)
@@ -127,6 +542,49 @@ def get_customers():
         conn.close()
     return customers
 
+def get_customers_page(after_id=0, limit=DEFAULT_PAGE_SIZE, fields=None):
+    """
+    Retrieves one page of customers ordered by ID, using keyset pagination.
+
+    The page starts right after `after_id`, so the query is a range scan on the primary
+    key no matter how deep the client pages, and only the requested columns are read.
+
+    Args:
+        after_id (int): Return customers whose ID is greater than this value.
+        limit (int): Maximum number of customers to return.
+        fields (list, optional): Columns to return, from CUSTOMER_LIST_FIELDS. Defaults
+            to all of them. 'customer_id' is always included.
+
+    Returns:
+        dict: A dictionary with:
+            - 'customers' (list): The customers of the page.
+            - 'next_after_id' (int): The cursor for the next page, or None on the last page.
+    """
+    columns = [field for field in CUSTOMER_LIST_FIELDS if fields is None or field in fields]
+    if 'customer_id' not in columns:
+        columns.insert(0, 'customer_id')
+    page = {"customers": [], "next_after_id": None}
+    try:
+        conn = connect_to_db()
+        conn.row_factory = sqlite3.Row
+        cur = conn.cursor()
+        # Fetch one extra row to know whether another page follows
+        cur.execute(f"""
+            SELECT {", ".join(columns)} FROM customer_accounts
+            WHERE customer_id > ?
+            ORDER BY customer_id
+            LIMIT ?
+        """, (after_id, limit + 1))
+        rows = cur.fetchall()
+        page["customers"] = [dict(row) for row in rows[:limit]]
+        if len(rows) > limit:
+            page["next_after_id"] = page["customers"][-1]["customer_id"]
+    except sqlite3.Error as e:
+        print(f"Error retrieving customers page: {e}")
+    finally:
+        conn.close()
+    return page
+
 def get_customer_by_id(customer_id):
     """
     Retrieves a single customer by their ID.
@@ -142,7 +600,7 @@ def get_customer_by_id(customer_id):
         conn = connect_to_db()
         conn.row_factory = sqlite3.Row
         cur = conn.cursor()
-        cur.execute("SELECT * FROM customers WHERE customer_id = ?", (customer_id,))
+        cur.execute("SELECT * FROM customer_accounts WHERE customer_id = ?", (customer_id,))
         row = cur.fetchone()
         if row:
             customer = dict(row)
@@ -168,7 +626,7 @@ def get_customer_by_username(username):
         conn = connect_to_db()
         conn.row_factory = sqlite3.Row
         cur = conn.cursor()
-        cur.execute("SELECT * FROM customers WHERE username = ?", (username,))
+        cur.execute("SELECT * FROM customer_accounts WHERE username = ?", (username,))
         row = cur.fetchone()
         if row:
             customer = dict(row)
@@ -237,6 +695,13 @@ def delete_customer(username):
     try:
         conn = connect_to_db()
         cur = conn.cursor()
+        # The wallet history goes with the customer, so a reused customer_id starts empty
+        cur.execute("""
+            DELETE FROM wallet_snapshots WHERE customer_id IN (SELECT customer_id FROM customers WHERE username = ?)
+        """, (username,))
+        cur.execute("""
+            DELETE FROM wallet_ledger WHERE customer_id IN (SELECT customer_id FROM customers WHERE username = ?)
+        """, (username,))
         cur.execute("DELETE FROM customers WHERE username = ?", (username,))
         if cur.rowcount > 0:
             conn.commit()
@@ -251,72 +716,202 @@ def delete_customer(username):
         conn.close()
     return message
 
-def charge_customer_wallet(username, amount):
+def _apply_wallet_change(operation, username, amount, idempotency_key):
     """
-    Increases a customer's wallet balance by a specified amount.
+    Applies a wallet change, optionally protected by an idempotency key.
+
+    The change is one ledger append (see `record_wallet_entry`); the customer row is not
+    written. A deduction larger than the balance is refused before the append, under the
+    same write lock. The stored result of a key is looked up in the same transaction, so a
+    replayed request returns that result without touching the wallet again.
 
     Args:
+        operation (str): 'charge' to add the amount, 'deduct' to subtract it.
         username (str): The unique username of the customer.
-        amount (float): The amount to add to the wallet balance.
+        amount (float): The amount to add or subtract.
+        idempotency_key (str): Client-chosen key identifying this change across retries, or None.
 
     Returns:
-        None
+        dict: A message indicating the result of the wallet operation. A replayed result
+            carries 'replayed': True.
     """
+    message = {}
     try:
         conn = connect_to_db()
         cur = conn.cursor()
-        cur.execute("""
-            UPDATE customers
-            SET wallet_balance = wallet_balance + ?
-            WHERE username = ?
-        """, (amount, username))
-        if cur.rowcount > 0:
+        # Take the write lock first, so the running total and a key lookup stay valid until the append
+        if not conn.in_transaction:
+            cur.execute("BEGIN IMMEDIATE")
+        if idempotency_key:
+            fingerprint = idempotency_store.fingerprint(username, amount)
+            stored = idempotency_store.lookup(cur, f"wallet_{operation}", idempotency_key, fingerprint)
+            if stored is not None:
+                conn.rollback()
+                stored["replayed"] = True
+                return stored
+        if operation == 'deduct':
+            cur.execute("SELECT wallet_balance FROM customer_accounts WHERE username = ?", (username,))
+            row = cur.fetchone()
+            if row is not None and row[0] < amount:
+                conn.rollback()
+                message["status"] = "Insufficient funds"
+                return message
+        if record_wallet_entry(cur, operation, username, amount):
+            message["status"] = f"Wallet {'charged' if operation == 'charge' else 'deducted'} successfully"
+            if idempotency_key:
+                idempotency_store.save(cur, f"wallet_{operation}", idempotency_key, fingerprint, message)
             conn.commit()
         else:
-            print("Customer not found for wallet charge")
+            conn.rollback()
+            print(f"Customer not found for wallet {'charge' if operation == 'charge' else 'deduction'}")
+            message["status"] = "Customer not found"
+    except IdempotencyConflict as e:
+        conn.rollback()
+        message["status"] = str(e)
+        message["conflict"] = True
     except sqlite3.Error as e:
         conn.rollback()
-        print(f"Error charging wallet: {e}")
+        print(f"Error {'charging' if operation == 'charge' else 'deducting from'} wallet: {e}")
+        message["status"] = f"Cannot {operation} wallet"
     finally:
         conn.close()
+    return message
 
-def deduct_from_customer_wallet(username, amount):
+def apply_wallet_batch(operation, items, idempotency_key=None):
     """
-    Decreases a customer's wallet balance by a specified amount.
+    Applies many wallet changes of one kind in a single transaction.
+
+    The current balances of all the usernames are read with a few IN queries under the
+    write lock, the running balance of every line is computed in order (so several lines
+    for the same customer add up), then all ledger entries are appended with one
+    `executemany`; the customer rows are not written. Lines for unknown usernames, and
+    deductions larger than the running balance, are reported and skipped without aborting
+    the batch.
 
     Args:
-        username (str): The unique username of the customer.
-        amount (float): The amount to deduct from the wallet balance.
+        operation (str): 'charge' to add the amounts, 'deduct' to subtract them.
+        items (list): A list of (username, amount) pairs. Amounts must be positive.
+        idempotency_key (str, optional): Client-chosen key identifying this batch across
+            retries; a batch that already succeeded with this key is not applied again.
 
     Returns:
-        None
+        dict: A dictionary with:
+            - 'status' (str): The overall result of the batch.
+            - 'applied' (int), 'failed' (int): The number of lines applied and skipped.
+            - 'results' (list): One dictionary per line with 'username', 'amount', 'status'
+              and, when applied, the 'balance_after'.
+        A replayed result carries 'replayed': True and a key conflict 'conflict': True.
     """
+    done = f"Wallet {'charged' if operation == 'charge' else 'deducted'} successfully"
+    sign = 1 if operation == 'charge' else -1
+    result = {}
     try:
         conn = connect_to_db()
         cur = conn.cursor()
-        cur.execute("""
-            UPDATE customers
-            SET wallet_balance = wallet_balance - ?
-            WHERE username = ?
-        """, (amount, username))
-        if cur.rowcount > 0:
-            conn.commit()
-        else:
-            print("Customer not found for wallet deduction")
+        # Take the write lock before reading the balances the new ones are computed from
+        if not conn.in_transaction:
+            cur.execute("BEGIN IMMEDIATE")
+        if idempotency_key:
+            fingerprint = idempotency_store.fingerprint([list(item) for item in items])
+            stored = idempotency_store.lookup(cur, f"wallet_{operation}_batch", idempotency_key, fingerprint)
+            if stored is not None:
+                conn.rollback()
+                stored["replayed"] = True
+                return stored
+
+        usernames = list(dict.fromkeys(username for username, _ in items))
+        wallets = {}
+        for start in range(0, len(usernames), WALLET_LOOKUP_CHUNK):
+            chunk = usernames[start:start + WALLET_LOOKUP_CHUNK]
+            cur.execute(f"""
+                SELECT username, customer_id, wallet_balance FROM customer_accounts
+                WHERE username IN ({", ".join("?" * len(chunk))})
+            """, chunk)
+            for username, customer_id, balance in cur.fetchall():
+                wallets[username] = [customer_id, balance]
+
+        results, entries = [], []
+        for username, amount in items:
+            wallet = wallets.get(username)
+            if wallet is None:
+                results.append({"username": username, "amount": amount, "status": "Customer not found"})
+                continue
+            if wallet[1] + sign * amount < 0:
+                results.append({"username": username, "amount": amount, "status": "Insufficient funds"})
+                continue
+            wallet[1] = wallet[1] + sign * amount
+            entries.append((wallet[0], operation, sign * amount, wallet[1]))
+            results.append({"username": username, "amount": amount, "status": done, "balance_after": wallet[1]})
+
+        cur.executemany("""
+            INSERT INTO wallet_ledger (customer_id, operation, amount, balance_after, created_at)
+            VALUES (?, ?, ?, ?, datetime('now'))
+        """, entries)
+        result = {
+            "status": "Wallet batch applied",
+            "applied": len(entries),
+            "failed": len(items) - len(entries),
+            "results": results,
+        }
+        if idempotency_key:
+            idempotency_store.save(cur, f"wallet_{operation}_batch", idempotency_key, fingerprint, result)
+        conn.commit()
+    except IdempotencyConflict as e:
+        conn.rollback()
+        result = {"status": str(e), "conflict": True}
     except sqlite3.Error as e:
         conn.rollback()
-        print(f"Error deducting from wallet: {e}")
+        print(f"Error applying wallet batch: {e}")
+        result = {"status": f"Cannot {operation} wallets"}
     finally:
         conn.close()
+    return result
+
+def charge_customer_wallet(username, amount, idempotency_key=None):
+    """
+    Increases a customer's wallet balance by a specified amount.
+
+    Args:
+        username (str): The unique username of the customer.
+        amount (float): The amount to add to the wallet balance.
+        idempotency_key (str, optional): Client-chosen key; a charge that already succeeded
+            with this key is not applied again.
+
+    Returns:
+        dict: A message indicating the result of the charge.
+    """
+    return _apply_wallet_change("charge", username, amount, idempotency_key)
+
+def deduct_from_customer_wallet(username, amount, idempotency_key=None):
+    """
+    Decreases a customer's wallet balance by a specified amount.
+
+    Args:
+        username (str): The unique username of the customer.
+        amount (float): The amount to deduct from the wallet balance.
+        idempotency_key (str, optional): Client-chosen key; a deduction that already succeeded
+            with this key is not applied again.
+
+    Returns:
+        dict: A message indicating the result of the deduction; "Insufficient funds" if the
+            amount exceeds the balance.
+    """
+    return _apply_wallet_change("deduct", username, amount, idempotency_key)
 
 # Initialize Flask application
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
+db_pool.init_app(app)
 
 @app.route('/api/customers', methods=['GET'])
 def api_get_customers():
     """
-    API Endpoint to retrieve all customers.
+    API Endpoint to retrieve customers, either all at once or one page at a time.
+
+    Without query parameters all customers are returned as a list. Passing any of the
+    pagination parameters switches to keyset pagination, which returns a bounded page
+    and gives the cursor for the next page. With `format=ndjson` the whole table is
+    streamed one customer per line. No listing includes passwords.
 
     Method:
         GET
@@ -324,14 +919,348 @@ def api_get_customers():
     URL:
         /api/customers
 
+    Query Parameters:
+        after_id (int, optional): Return customers whose ID is greater than this cursor. Default 0.
+        limit (int, optional): Page size, between 1 and MAX_PAGE_SIZE. Default DEFAULT_PAGE_SIZE.
+        fields (str, optional): Comma-separated columns to return, from CUSTOMER_LIST_FIELDS.
+        format (str, optional): 'ndjson' to stream every customer as newline-delimited JSON.
+
     Success Response:
         Code: 200
-        Content: List of customer dictionaries in JSON format.
+        Content: List of customer dictionaries in JSON format, or, when paginating, an object
+            with 'customers' and 'next_after_id' (null on the last page), or an
+            'application/x-ndjson' stream.
+
+    Error Response:
+        Code: 400
+        Content: Error message indicating an invalid query parameter.
 
     Example:
         GET /api/customers
+        GET /api/customers?limit=50&fields=username,full_name
+        GET /api/customers?after_id=50&limit=50&fields=username,full_name
+        GET /api/customers?format=ndjson
+    """
+    if wants_ndjson(request):
+        return ndjson_response(connect_to_db, f"""
+            SELECT {", ".join(CUSTOMER_LIST_FIELDS)} FROM customer_accounts ORDER BY customer_id
+        """)
+    if not any(key in request.args for key in ('after_id', 'limit', 'fields')):
+        return jsonify(get_customers())
+
+    try:
+        after_id = int(request.args.get('after_id', 0))
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "Invalid after_id or limit"}), 400
+    if after_id < 0:
+        return jsonify({"error": "Invalid after_id"}), 400
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return jsonify({"error": f"Invalid limit: must be between 1 and {MAX_PAGE_SIZE}"}), 400
+
+    fields = None
+    if 'fields' in request.args:
+        fields = [field.strip() for field in request.args['fields'].split(',') if field.strip()]
+        unknown = [field for field in fields if field not in CUSTOMER_LIST_FIELDS]
+        if unknown:
+            return jsonify({"error": f"Invalid fields: {', '.join(unknown)}"}), 400
+
+    return jsonify(get_customers_page(after_id, limit, fields)), 200
+
+def parse_wallet_line(line):
+    """
+    Validates one (username, amount) line of a wallet request.
+
+    Args:
+        line (dict): The JSON object sent by the client.
+
+    Returns:
+        tuple: The (username, amount) pair, or None if the line is invalid.
+    """
+    if not isinstance(line, dict):
+        return None
+    username = line.get('username')
+    amount = line.get('amount')
+    if not isinstance(username, str) or not username:
+        return None
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)) or amount <= 0:
+        return None
+    return username, float(amount)
+
+def wallet_change_response(operation):
+    """
+    Handles a single wallet charge or deduction request.
+
+    Args:
+        operation (str): 'charge' or 'deduct'.
+
+    Returns:
+        tuple: The JSON response, its status code and headers.
+    """
+    line = parse_wallet_line(request.get_json(silent=True))
+    if line is None:
+        return jsonify({"error": "Invalid request: a username and a positive amount are required"}), 400, {}
+    if operation == 'charge':
+        message = charge_customer_wallet(*line, idempotency_key=request.headers.get('Idempotency-Key'))
+    else:
+        message = deduct_from_customer_wallet(*line, idempotency_key=request.headers.get('Idempotency-Key'))
+    headers = {"Idempotent-Replayed": "true"} if message.pop("replayed", False) else {}
+    if message["status"].startswith("Wallet "):
+        return jsonify(message), 200, headers
+    elif message["status"] == "Customer not found":
+        return jsonify(message), 404, headers
+    elif message["status"] == "Insufficient funds":
+        return jsonify(message), 400, headers
+    elif message.pop("conflict", False):
+        return jsonify(message), 422, headers
+    return jsonify(message), 500, headers
+
+def wallet_batch_response(operation):
+    """
+    Handles a batch wallet charge or deduction request.
+
+    Args:
+        operation (str): 'charge' or 'deduct'.
+
+    Returns:
+        tuple: The JSON response, its status code and headers.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('items'), list) or not data['items']:
+        return jsonify({"error": "Missing field: items"}), 400, {}
+    if len(data['items']) > MAX_WALLET_BATCH_LINES:
+        return jsonify({"error": f"Too many items: at most {MAX_WALLET_BATCH_LINES} per batch"}), 400, {}
+    items = []
+    for index, item in enumerate(data['items']):
+        line = parse_wallet_line(item)
+        if line is None:
+            return jsonify({"error": f"Invalid username or amount in item {index}"}), 400, {}
+        items.append(line)
+
+    result = apply_wallet_batch(operation, items, request.headers.get('Idempotency-Key'))
+    headers = {"Idempotent-Replayed": "true"} if result.pop("replayed", False) else {}
+    if result["status"] == "Wallet batch applied":
+        return jsonify(result), 200, headers
+    elif result.pop("conflict", False):
+        return jsonify(result), 422, headers
+    return jsonify(result), 500, headers
+
+@app.route('/api/customers/wallet/charge', methods=['POST'])
+def api_charge_wallet():
+    """
+    API Endpoint to add an amount to a customer's wallet.
+
+    Method:
+        POST
+
+    URL:
+        /api/customers/wallet/charge
+
+    Request Headers:
+        Idempotency-Key (str, optional): Client-chosen key for safe retries. Replaying a
+            key whose charge succeeded returns the stored response, marked with an
+            'Idempotent-Replayed: true' header, and does not charge again.
+
+    Request Body:
+        JSON object containing:
+            - 'username' (str): Username of the customer.
+            - 'amount' (float): Amount to add. Must be positive.
+
+    Success Response:
+        Code: 200
+        Content: Message indicating the wallet was charged.
+
+    Error Response:
+        Code: 400
+        Content: Error message indicating a missing username or an invalid amount.
+        Code: 404
+        Content: Error message indicating the customer was not found.
+        Code: 422
+        Content: Error message indicating the Idempotency-Key was used for a different charge.
+
+    Example:
+        POST /api/customers/wallet/charge
+        {
+            "username": "johndoe",
+            "amount": 25.0
+        }
+    """
+    return wallet_change_response('charge')
+
+@app.route('/api/customers/wallet/deduct', methods=['POST'])
+def api_deduct_wallet():
+    """
+    API Endpoint to subtract an amount from a customer's wallet.
+
+    Method:
+        POST
+
+    URL:
+        /api/customers/wallet/deduct
+
+    Request Headers:
+        Idempotency-Key (str, optional): Client-chosen key for safe retries, as for charges.
+
+    Request Body:
+        JSON object containing:
+            - 'username' (str): Username of the customer.
+            - 'amount' (float): Amount to subtract. Must be positive.
+
+    Success Response:
+        Code: 200
+        Content: Message indicating the wallet was deducted.
+
+    Error Response:
+        Code: 400
+        Content: Error message indicating a missing username, an invalid amount or
+            insufficient funds.
+        Code: 404
+        Content: Error message indicating the customer was not found.
+        Code: 422
+        Content: Error message indicating the Idempotency-Key was used for a different deduction.
+
+    Example:
+        POST /api/customers/wallet/deduct
+        {
+            "username": "johndoe",
+            "amount": 10.0
+        }
+    """
+    return wallet_change_response('deduct')
+
+@app.route('/api/customers/wallet/charge/batch', methods=['POST'])
+def api_charge_wallets():
+    """
+    API Endpoint to add amounts to many wallets in one transaction.
+
+    Lines for unknown usernames are reported in the results and skipped; the other lines
+    are applied.
+
+    Method:
+        POST
+
+    URL:
+        /api/customers/wallet/charge/batch
+
+    Request Headers:
+        Idempotency-Key (str, optional): Client-chosen key for safe retries of the whole batch.
+
+    Request Body:
+        JSON object containing:
+            - 'items' (list): Up to MAX_WALLET_BATCH_LINES lines, each an object with
+              'username' (str) and a positive 'amount' (float).
+
+    Success Response:
+        Code: 200
+        Content: The overall 'status', the number of lines 'applied' and 'failed', and a
+            'results' list with the status and new balance of every line.
+
+    Error Response:
+        Code: 400
+        Content: Error message indicating missing items, too many items or an invalid line.
+        Code: 422
+        Content: Error message indicating the Idempotency-Key was used for a different batch.
+        Code: 500
+        Content: Error message indicating server-side failure; nothing is applied.
+
+    Example:
+        POST /api/customers/wallet/charge/batch
+        {
+            "items": [
+                {"username": "johndoe", "amount": 25.0},
+                {"username": "janedoe", "amount": 40.0}
+            ]
+        }
     """
-    return jsonify(get_customers())
+    return wallet_batch_response('charge')
+
+@app.route('/api/customers/wallet/deduct/batch', methods=['POST'])
+def api_deduct_wallets():
+    """
+    API Endpoint to subtract amounts from many wallets in one transaction.
+
+    Lines for unknown usernames, and lines that would take a wallet below zero, are
+    reported in the results and skipped; the other lines are applied.
+
+    Method:
+        POST
+
+    URL:
+        /api/customers/wallet/deduct/batch
+
+    Request Headers:
+        Idempotency-Key (str, optional): Client-chosen key for safe retries of the whole batch.
+
+    Request Body:
+        JSON object containing:
+            - 'items' (list): Lines as for /api/customers/wallet/charge/batch.
+
+    Success Response:
+        Code: 200
+        Content: The overall 'status', the number of lines 'applied' and 'failed', and a
+            'results' list with the status and new balance of every line.
+
+    Error Response:
+        Code: 400
+        Content: Error message indicating missing items, too many items or an invalid line.
+        Code: 422
+        Content: Error message indicating the Idempotency-Key was used for a different batch.
+        Code: 500
+        Content: Error message indicating server-side failure; nothing is applied.
+
+    Example:
+        POST /api/customers/wallet/deduct/batch
+        {
+            "items": [
+                {"username": "johndoe", "amount": 5.0}
+            ]
+        }
+    """
+    return wallet_batch_response('deduct')
+
+@app.route('/api/customers/wallet/<username>', methods=['GET'])
+def api_get_wallet(username):
+    """
+    API Endpoint to retrieve a customer's wallet balance and its ledger history.
+
+    Method:
+        GET
+
+    URL:
+        /api/customers/wallet/<username>
+
+    URL Parameters:
+        username (str): The unique username of the customer.
+
+    Query Parameters:
+        after_id (int, optional): Return ledger entries whose ID is greater than this cursor. Default 0.
+        limit (int, optional): Number of entries, between 1 and MAX_PAGE_SIZE. Default DEFAULT_LEDGER_PAGE_SIZE.
+
+    Success Response:
+        Code: 200
+        Content: The 'wallet_balance', a page of ledger 'entries' (signed 'amount' and
+            'balance_after'), and 'next_after_id' (null on the last page).
+
+    Error Response:
+        Code: 400
+        Content: Error message indicating an invalid query parameter.
+        Code: 404
+        Content: Error message indicating the customer was not found.
+
+    Example:
+        GET /api/customers/wallet/johndoe?limit=20
+    """
+    try:
+        after_id = int(request.args.get('after_id', 0))
+        limit = int(request.args.get('limit', DEFAULT_LEDGER_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "Invalid after_id or limit"}), 400
+    if after_id < 0 or not 1 <= limit <= MAX_PAGE_SIZE:
+        return jsonify({"error": f"Invalid after_id or limit: limit must be between 1 and {MAX_PAGE_SIZE}"}), 400
+    wallet = get_wallet(username, after_id, limit)
+    if not wallet:
+        return jsonify({"error": "Customer not found"}), 404
+    return jsonify(wallet), 200
 
 @app.route('/api/customers/<int:customer_id>', methods=['GET'])
 def api_get_customer(customer_id):
@@ -404,6 +1333,101 @@ def api_add_customer():
     else:
         return jsonify({}), 400
 
+def parse_import_body():
+    """
+    Parses the rows of a bulk import request according to its content type.
+
+    Returns:
+        list: The parsed rows, one dictionary (or other JSON value) per customer.
+
+    Raises:
+        ValueError: If the body cannot be parsed.
+    """
+    body = request.get_data(as_text=True)
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        rows = []
+        for number, line in enumerate(body.splitlines(), start=1):
+            if line.strip():
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    raise ValueError(f"Invalid JSON on line {number}")
+        return rows
+    if request.mimetype == 'text/csv':
+        return list(csv.DictReader(io.StringIO(body)))
+    try:
+        rows = json.loads(body)
+    except ValueError:
+        raise ValueError("Invalid JSON body")
+    if not isinstance(rows, list):
+        raise ValueError("The JSON body must be an array of customers")
+    return rows
+
+@app.route('/api/customers/import', methods=['POST'])
+def api_import_customers():
+    """
+    API Endpoint to add many customers at once.
+
+    Rows are validated, then inserted in chunked transactions. Invalid rows and rows whose
+    username is already taken (including an earlier row of the same import) are reported
+    in the response; every other row is inserted.
+
+    Method:
+        POST
+
+    URL:
+        /api/customers/import
+
+    Request Body:
+        Up to MAX_IMPORT_ROWS customers with the fields of /api/customers/add, as either:
+            - a JSON array (Content-Type: application/json),
+            - one JSON object per line (Content-Type: application/x-ndjson), or
+            - CSV with a header row naming the fields (Content-Type: text/csv).
+
+    Success Response:
+        Code: 200
+        Content: The number of rows 'received' and 'inserted', and the 'rejected' rows,
+            each with its zero-based 'index', 'username' and 'error'.
+
+    Error Response:
+        Code: 400
+        Content: Error message indicating an unparsable, empty or too large body.
+        Code: 500
+        Content: The same report, when a chunk could not be written; its rows are
+            listed as rejected and the other chunks are kept.
+
+    Example:
+        POST /api/customers/import
+        Content-Type: text/csv
+
+        full_name,username,password,age,address,gender,marital_status
+        John Doe,johndoe,securepassword,30,123 Main St,Male,Single
+    """
+    try:
+        rows = parse_import_body()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not rows:
+        return jsonify({"error": "No customers to import"}), 400
+    if len(rows) > MAX_IMPORT_ROWS:
+        return jsonify({"error": f"Too many customers: at most {MAX_IMPORT_ROWS} per import"}), 400
+
+    valid, invalid = [], []
+    for index, row in enumerate(rows):
+        values, error = validate_import_row(row)
+        if error:
+            username = row.get('username') if isinstance(row, dict) else None
+            invalid.append({"index": index, "username": username, "error": error})
+        else:
+            valid.append((index, values))
+
+    result = import_customers(valid)
+    failed = result.pop("failed", 0)
+    result["rejected"] = sorted(invalid + result["rejected"], key=lambda rejected: rejected["index"])
+    result["received"] = len(rows)
+    result["status"] = "Import incomplete" if failed else "Import completed"
+    return jsonify(result), 500 if failed else 200
+
 @app.route('/api/customers/update', methods=['PUT'])
 def api_update_customer():
     """
@@ -479,4 +1503,6 @@ def api_delete_customer(username):
 if __name__ == "__main__":
     # Optionally, create the database table if it doesn't exist
     create_db_table()
+    db_pool.report()
+    report_query_plans()
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -21,8 +21,8 @@ def client():
     """
     Pytest fixture to set up a test client and initialize a test database.
 
-    This fixture configures the Flask application for testing, overrides the database connection
-    to use a test-specific database, creates the necessary database tables, and provides a test client
+    This fixture configures the Flask application for testing, points the service's connection
+    pool at a test-specific database, creates the necessary database tables, and provides a test client
     for making API requests. After the tests are completed, it cleans up by removing the test database file.
 
     Yields:
@@ -32,20 +32,10 @@ def client():
     app.config['TESTING'] = True
     app.config['DATABASE'] = 'test_customer_database.db'
 
-    def connect_to_db_override():
-        """
-        Overrides the default database connection to use the test database.
-
-        Returns:
-            sqlite3.Connection: A connection object to the test SQLite database.
-        """
-        conn = sqlite3.connect(app.config['DATABASE'])
-        conn.row_factory = sqlite3.Row
-        return conn
-
-    # Override the connect_to_db function in service1 with the test database connection
+    # Point the service's own connection pool at the test database, so every test goes
+    # through the request scope bound to the app: deferred commits, rollbacks, after_commit
     import service1
-    service1.connect_to_db = connect_to_db_override
+    service1.db_pool.use_database(app.config['DATABASE'])
 
     # Create the necessary database tables in the test database
     create_db_table()
@@ -54,8 +44,11 @@ def client():
     with app.test_client() as client:
         yield client
 
-    # Clean up by removing the test database file after tests are done
-    os.remove(app.config['DATABASE'])
+    # Clean up by closing the pooled connections and removing the test database files
+    service1.db_pool.use_database(service1.DATABASE)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(app.config['DATABASE'] + suffix):
+            os.remove(app.config['DATABASE'] + suffix)
 
 
 def test_add_customer(client):
@@ -90,16 +83,23 @@ def test_get_customers(client):
     Test the API endpoint for retrieving all customers.
 
     This test sends a GET request to the `/api/customers` endpoint and verifies that the response
-    status code is 200 and that the returned data is a list.
+    status code is 200 and that the returned data is a list of customers without passwords.
 
     Args:
         client (FlaskClient): The test client fixture.
     """
+    client.post('/api/customers/add', json={
+        'full_name': 'Listed Customer', 'username': 'listed', 'password': 'password123',
+        'age': 41, 'address': '4 Index Rd', 'gender': 'Male', 'marital_status': 'Married'
+    })
+
     # Test retrieving all customers
     response = client.get('/api/customers')
     assert response.status_code == 200, "Expected status code 200 for successful retrieval of customers."
     data = response.get_json()
     assert isinstance(data, list), "Response should be a list of customers."
+    assert [customer['username'] for customer in data] == ['listed'], "The added customer should be listed."
+    assert 'password' not in data[0], "The full listing should not include passwords."
 
 
 def test_get_customer_by_id(client):
@@ -210,3 +210,262 @@ def test_delete_customer(client):
     customers = get_response.get_json()
     usernames = [customer['username'] for customer in customers]
     assert 'emilydavis' not in usernames, "Deleted customer 'emilydavis' should not be present in the customers list."
+
+
+def test_wallet_idempotency_key(client):
+    """
+    Test that a wallet charge retried with the same idempotency key is applied once.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    import service1
+
+    new_customer = {
+        'full_name': 'Rita Retry',
+        'username': 'ritaretry',
+        'password': 'password123',
+        'age': 40,
+        'address': '9 Loop Rd',
+        'gender': 'Female',
+        'marital_status': 'Single'
+    }
+    client.post('/api/customers/add', json=new_customer)
+
+    first = service1.charge_customer_wallet('ritaretry', 50.0, idempotency_key='topup-1')
+    replay = service1.charge_customer_wallet('ritaretry', 50.0, idempotency_key='topup-1')
+    assert first['status'] == 'Wallet charged successfully', "The first charge should be applied."
+    assert replay.get('replayed') is True, "The retry should be answered from the key store."
+
+    conflict = service1.charge_customer_wallet('ritaretry', 75.0, idempotency_key='topup-1')
+    assert 'different request' in conflict['status'], "Reusing a key with another amount should be rejected."
+
+    customer = service1.get_customer_by_username('ritaretry')
+    assert customer['wallet_balance'] == 50.0, "The wallet should be charged exactly once."
+
+
+def test_get_customers_paginated(client):
+    """
+    Test keyset pagination and field projection on the customer listing.
+
+    This test adds three customers, pages through them two at a time with a field projection,
+    and verifies the page contents, the next cursor and that passwords are not listed.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    for index in range(3):
+        client.post('/api/customers/add', json={
+            'full_name': f'Page Customer {index}',
+            'username': f'pagecustomer{index}',
+            'password': 'password123',
+            'age': 20 + index,
+            'address': 'Page St',
+            'gender': 'Female',
+            'marital_status': 'Single'
+        })
+
+    response = client.get('/api/customers?limit=2&fields=username')
+    assert response.status_code == 200, "Expected status code 200 for the first page."
+    page = response.get_json()
+    assert [c['username'] for c in page['customers']] == ['pagecustomer0', 'pagecustomer1'], \
+        "The first page should hold the first two customers."
+    assert set(page['customers'][0]) == {'customer_id', 'username'}, "Only the projected fields should be returned."
+    assert page['next_after_id'] == page['customers'][-1]['customer_id'], "The cursor should point at the last row."
+
+    page = client.get(f"/api/customers?limit=2&after_id={page['next_after_id']}").get_json()
+    assert [c['username'] for c in page['customers']] == ['pagecustomer2'], "The second page should hold the rest."
+    assert page['next_after_id'] is None, "The last page should not have a next cursor."
+    assert 'password' not in page['customers'][0], "Passwords should never be listed."
+
+    response = client.get('/api/customers?fields=password')
+    assert response.status_code == 400, "Expected status code 400 for a field that cannot be listed."
+
+
+def test_wallet_ledger_snapshots_and_reconciliation(client):
+    """
+    Test that wallet changes are appended to the ledger and reconcile against snapshots.
+
+    This test charges and deducts a wallet, checks the ledger history and balance, takes
+    snapshots, and verifies that reconciliation passes, then detects a running total that
+    was changed behind the ledger's back. Wallet changes must leave the cached balance on
+    the customer row alone until a snapshot refreshes it.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    import service1
+    client.post('/api/customers/add', json={
+        'full_name': 'Lena Ledger', 'username': 'lenaledger', 'password': 'password123',
+        'age': 33, 'address': '1 Book St', 'gender': 'Female', 'marital_status': 'Single'
+    })
+    service1.charge_customer_wallet('lenaledger', 100.0)
+    service1.deduct_from_customer_wallet('lenaledger', 30.0)
+    conn = sqlite3.connect('test_customer_database.db')
+    cached = conn.execute("SELECT wallet_balance FROM customers WHERE username = 'lenaledger'").fetchone()[0]
+    conn.close()
+    assert cached == 0, "Wallet changes should only append to the ledger, not write the customer row."
+    assert service1.get_customer_by_username('lenaledger')['wallet_balance'] == 70.0, \
+        "Customer reads should see the ledger's running total."
+    assert service1.take_wallet_snapshots() == 1, "The changed wallet should be snapshotted."
+    assert service1.take_wallet_snapshots() == 0, "An unchanged wallet should not be snapshotted again."
+    conn = sqlite3.connect('test_customer_database.db')
+    cached = conn.execute("SELECT wallet_balance FROM customers WHERE username = 'lenaledger'").fetchone()[0]
+    conn.close()
+    assert cached == 70.0, "A snapshot should refresh the cached balance."
+    service1.charge_customer_wallet('lenaledger', 5.0)
+
+    response = client.get('/api/customers/wallet/lenaledger?limit=2')
+    assert response.status_code == 200, "The wallet should be returned."
+    wallet = response.get_json()
+    assert wallet['wallet_balance'] == 75.0, "The balance should include every change."
+    assert [entry['amount'] for entry in wallet['entries']] == [100.0, -30.0], "Entries are signed and ordered."
+    assert wallet['entries'][1]['balance_after'] == 70.0, "Each entry records the balance after it."
+    rest = client.get(f"/api/customers/wallet/lenaledger?after_id={wallet['next_after_id']}").get_json()
+    assert [entry['amount'] for entry in rest['entries']] == [5.0], "The next page should hold the last entry."
+
+    assert service1.reconcile_wallets()['mismatches'] == [], "A consistent wallet should reconcile."
+    conn = sqlite3.connect('test_customer_database.db')
+    conn.execute("UPDATE wallet_ledger SET balance_after = 1000 WHERE entry_id = (SELECT MAX(entry_id) FROM wallet_ledger)")
+    conn.commit()
+    conn.close()
+    mismatches = service1.reconcile_wallets()['mismatches']
+    assert [m['username'] for m in mismatches] == ['lenaledger'], "A tampered running total should be reported."
+    assert mismatches[0]['expected_balance'] == 75.0, "The ledger total should be reported."
+
+    assert client.get('/api/customers/wallet/nobody').status_code == 404, "An unknown customer is a 404."
+
+
+def test_wallet_endpoints_and_batch(client):
+    """
+    Test the wallet charge/deduct endpoints and the batch endpoints.
+
+    This test charges and deducts single wallets over HTTP, replays a request with the same
+    Idempotency-Key, then applies a batch with a repeated and an unknown username and checks
+    the per-line results, the balances and the ledger reconciliation.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    import service1
+    for username in ('batchann', 'batchbob'):
+        client.post('/api/customers/add', json={
+            'full_name': 'Batch Customer', 'username': username, 'password': 'password123',
+            'age': 30, 'address': '2 Bulk Ave', 'gender': 'Female', 'marital_status': 'Single'
+        })
+
+    response = client.post('/api/customers/wallet/charge', json={'username': 'batchann', 'amount': 20},
+                           headers={'Idempotency-Key': 'single-1'})
+    assert response.status_code == 200, "A valid charge should succeed."
+    replay = client.post('/api/customers/wallet/charge', json={'username': 'batchann', 'amount': 20},
+                         headers={'Idempotency-Key': 'single-1'})
+    assert replay.headers.get('Idempotent-Replayed') == 'true', "A retried charge should be replayed."
+    conflict = client.post('/api/customers/wallet/charge', json={'username': 'batchann', 'amount': 25},
+                           headers={'Idempotency-Key': 'single-1'})
+    assert conflict.status_code == 422, "Reusing a key for another charge should be rejected."
+    assert client.post('/api/customers/wallet/deduct', json={'username': 'batchann', 'amount': 5}).status_code == 200, \
+        "A valid deduction should succeed."
+    assert client.post('/api/customers/wallet/charge', json={'username': 'nobody', 'amount': 5}).status_code == 404, \
+        "Charging an unknown customer should return 404."
+    assert client.post('/api/customers/wallet/charge', json={'username': 'batchann', 'amount': -5}).status_code == 400, \
+        "A non-positive amount should be rejected."
+
+    batch = {'items': [
+        {'username': 'batchann', 'amount': 10},
+        {'username': 'nobody', 'amount': 10},
+        {'username': 'batchbob', 'amount': 7.5},
+        {'username': 'batchann', 'amount': 1},
+    ]}
+    response = client.post('/api/customers/wallet/charge/batch', json=batch, headers={'Idempotency-Key': 'night-1'})
+    assert response.status_code == 200, "A batch should be applied even with unknown usernames."
+    result = response.get_json()
+    assert (result['applied'], result['failed']) == (3, 1), "Only the unknown username should fail."
+    assert result['results'][1]['status'] == 'Customer not found', "The unknown line should be reported."
+    assert [line.get('balance_after') for line in result['results']] == [25.0, None, 7.5, 26.0], \
+        "Repeated usernames should add up in order."
+    replay = client.post('/api/customers/wallet/charge/batch', json=batch, headers={'Idempotency-Key': 'night-1'})
+    assert replay.headers.get('Idempotent-Replayed') == 'true', "A retried batch should be replayed."
+
+    response = client.post('/api/customers/wallet/deduct/batch', json={'items': [{'username': 'batchbob', 'amount': 2.5}]})
+    assert response.get_json()['results'][0]['balance_after'] == 5.0, "A batch deduction should lower the balance."
+    assert client.post('/api/customers/wallet/charge/batch', json={'items': [{'username': 'batchbob'}]}).status_code == 400, \
+        "A line without an amount should reject the batch."
+
+    assert service1.get_customer_by_username('batchann')['wallet_balance'] == 26.0, "Replays should not charge again."
+    assert service1.reconcile_wallets()['mismatches'] == [], "Batch changes should be recorded in the ledger."
+
+
+def test_wallet_deductions_cannot_overdraw(client):
+    """
+    Test that single and batch deductions larger than the balance are refused.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    import service1
+    client.post('/api/customers/add', json={
+        'full_name': 'Thrifty Customer', 'username': 'thrifty', 'password': 'password123',
+        'age': 30, 'address': '3 Penny Lane', 'gender': 'Female', 'marital_status': 'Single'
+    })
+    client.post('/api/customers/wallet/charge', json={'username': 'thrifty', 'amount': 10})
+
+    response = client.post('/api/customers/wallet/deduct', json={'username': 'thrifty', 'amount': 50})
+    assert response.status_code == 400, "Deducting more than the balance should be rejected."
+    assert response.get_json()['status'] == 'Insufficient funds', "The rejection should name the reason."
+
+    batch = {'items': [
+        {'username': 'thrifty', 'amount': 6},
+        {'username': 'thrifty', 'amount': 6},
+        {'username': 'thrifty', 'amount': 4},
+    ]}
+    result = client.post('/api/customers/wallet/deduct/batch', json=batch).get_json()
+    assert (result['applied'], result['failed']) == (2, 1), "Only the line that would overdraw should fail."
+    assert [line['status'] for line in result['results']][1] == 'Insufficient funds', \
+        "The overdrawing line should be reported."
+    assert [line.get('balance_after') for line in result['results']] == [4.0, None, 0.0], \
+        "A skipped line should not count towards the running balance."
+
+    assert service1.get_wallet('thrifty')['wallet_balance'] == 0.0, "The wallet should never go negative."
+    assert service1.reconcile_wallets()['mismatches'] == [], "Refused deductions should leave the ledger consistent."
+
+
+def test_import_customers(client):
+    """
+    Test the bulk customer import with JSON, NDJSON and CSV bodies.
+
+    This test imports customers in the three formats, including an invalid row, a username
+    that already exists and a username repeated within the import, and verifies that the
+    other rows are inserted and the rejected ones are reported by index.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    import service1
+    fields = {'password': 'password123', 'age': 28, 'address': '5 Bulk Rd', 'gender': 'Male',
+              'marital_status': 'Single'}
+    response = client.post('/api/customers/import', json=[
+        dict(fields, full_name='Ian Import', username='ianimport'),
+        dict(fields, full_name='No Age', username='noage', age='old'),
+        dict(fields, full_name='Ian Again', username='ianimport'),
+    ])
+    assert response.status_code == 200, "A JSON array import should succeed."
+    result = response.get_json()
+    assert (result['received'], result['inserted']) == (3, 1), "Only the first valid row should be inserted."
+    assert [(r['index'], r['error']) for r in result['rejected']] == [(1, 'Invalid age'), (2, 'Username already taken')], \
+        "Invalid and duplicate rows should be reported in order."
+
+    ndjson = "\n".join(service1.json.dumps(dict(fields, full_name=f'Nd {n}', username=f'nd{n}')) for n in range(3))
+    response = client.post('/api/customers/import', data=ndjson, content_type='application/x-ndjson')
+    assert response.get_json()['inserted'] == 3, "Every NDJSON line should be inserted."
+
+    csv_body = ("full_name,username,password,age,address,gender,marital_status\n"
+                "Cara Csv,caracsv,password123,41,7 Comma St,Female,Married\n"
+                "Nd Zero,nd0,password123,22,8 Comma St,Male,Single\n")
+    response = client.post('/api/customers/import', data=csv_body, content_type='text/csv')
+    result = response.get_json()
+    assert result['inserted'] == 1, "The new CSV row should be inserted."
+    assert result['rejected'][0]['username'] == 'nd0', "The CSV row of an existing customer should be rejected."
+    assert service1.get_customer_by_username('caracsv')['age'] == 41, "CSV ages should be stored as integers."
+
+    assert client.post('/api/customers/import', data='{"not": "a list"}', content_type='application/json').status_code == 400, \
+        "A JSON body that is not an array should be rejected."
@@ -0,0 +1,48 @@
+#!/usr/bin/python
+"""
+Periodic wallet jobs for the Customer Management API.
+
+This script is meant to be run from cron next to the service. `snapshot` records the
+balance of every wallet that changed since the previous run, so later reconciliations
+only add up the ledger entries after the newest snapshot, and refreshes the balance
+cached on those customer rows. `reconcile` checks every
+wallet balance and snapshot against the ledger and exits with status 1 if any of them
+disagree, so the scheduler can alert on it.
+
+Usage:
+    python wallet_jobs.py snapshot
+    python wallet_jobs.py reconcile
+    python wallet_jobs.py snapshot reconcile
+"""
+
+import argparse
+import sys
+
+import service1
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("jobs", nargs="+", choices=["snapshot", "reconcile"])
+    args = parser.parse_args()
+
+    status = 0
+    for job in args.jobs:
+        if job == "snapshot":
+            taken = service1.take_wallet_snapshots()
+            if taken is None:
+                status = 1
+            else:
+                print(f"Took {taken} wallet snapshots")
+        else:
+            report = service1.reconcile_wallets()
+            if report is None:
+                status = 1
+                continue
+            for mismatch in report["mismatches"]:
+                print(f"Wallet of {mismatch['username']} failed the {mismatch['check']} check: "
+                      f"balance {mismatch['wallet_balance']}, ledger {mismatch['expected_balance']}")
+            print(f"Reconciled {report['checked']} wallets, {len(report['mismatches'])} mismatches")
+            if report["mismatches"]:
+                status = 1
+    service1.db_pool.close_all()
+    sys.exit(status)
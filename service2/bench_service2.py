@@ -0,0 +1,122 @@
+#!/usr/bin/python3
+"""
+Concurrency benchmark for stock deduction in the Inventory Management API.
+
+This script compares the original two-step deduction (SELECT the stock, compare in
+Python, then UPDATE) with the single conditional UPDATE used by `deduct_good`. Both run
+against a scratch database through the service's pooled connections, with N threads
+deducting one unit at a time from the same good until the stock is gone. For each
+variant it reports the deductions per second, how many deductions succeeded, how many
+failed with an error, and the final stock count, so oversell shows up as more successes
+than the initial stock.
+
+Usage:
+    python bench_service2.py [--threads 16] [--stock 4000] [--attempts 4000]
+
+Pass a --stock lower than --attempts to make the threads race for the last units.
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import service2
+from common.db_pool import ConnectionPool
+
+
+def legacy_deduct_good(good_id, quantity):
+    """
+    The original read-then-write deduction, kept here as the benchmark baseline.
+
+    Args:
+        good_id (int): The unique ID of the good.
+        quantity (int): The quantity to deduct.
+
+    Returns:
+        dict: A message indicating the result of the deduction operation.
+    """
+    message = {}
+    try:
+        conn = service2.connect_to_db()
+        cur = conn.cursor()
+        cur.execute("SELECT stock_count FROM goods WHERE good_id = ?", (good_id,))
+        row = cur.fetchone()
+        if row:
+            if row[0] >= quantity:
+                cur.execute("UPDATE goods SET stock_count = stock_count - ? WHERE good_id = ?",
+                            (quantity, good_id))
+                conn.commit()
+                message["status"] = "Stock deducted successfully."
+            else:
+                message["status"] = "Insufficient stock to deduct."
+        else:
+            message["status"] = "Good not found."
+    except Exception as e:
+        conn.rollback()
+        message["status"] = f"Error deducting stock: {e}"
+    finally:
+        conn.close()
+    return message
+
+
+def run(deduct, threads, stock, attempts):
+    """
+    Runs one benchmark variant on a fresh scratch database.
+
+    Args:
+        deduct (function): The deduction function to benchmark.
+        threads (int): Number of concurrent threads.
+        stock (int): Initial stock count of the good.
+        attempts (int): Total number of deductions attempted across all threads.
+
+    Returns:
+        dict: Throughput, outcome counts and the final stock count.
+    """
+    directory = tempfile.mkdtemp()
+    service2.db_pool = ConnectionPool.from_profile(os.path.join(directory, 'bench.db'), 'service2', size=threads)
+    service2.create_db_table()
+    good_id = service2.add_good({'name': 'Bench', 'category': 'food', 'price': 1.0, 'stock_count': stock})['good_id']
+
+    outcomes = {"ok": 0, "refused": 0, "error": 0}
+    lock = threading.Lock()
+    per_thread = attempts // threads
+
+    def worker():
+        for _ in range(per_thread):
+            status = deduct(good_id, 1)["status"]
+            key = "ok" if status == "Stock deducted successfully." else (
+                "refused" if status == "Insufficient stock to deduct." else "error")
+            with lock:
+                outcomes[key] += 1
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    outcomes["final_stock"] = service2.get_good_by_id(good_id)["stock_count"]
+    outcomes["per_second"] = (per_thread * threads) / elapsed
+    service2.db_pool.close_all()
+    shutil.rmtree(directory)
+    return outcomes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--stock", type=int, default=4000)
+    parser.add_argument("--attempts", type=int, default=4000)
+    args = parser.parse_args()
+
+    for label, deduct in (("select+update", legacy_deduct_good), ("conditional update", service2.deduct_good)):
+        result = run(deduct, args.threads, args.stock, args.attempts)
+        oversold = max(0, result["ok"] - args.stock)
+        print(f"{label:>20}: {result['per_second']:8.0f} deductions/s, ok={result['ok']} "
+              f"refused={result['refused']} error={result['error']} "
+              f"final_stock={result['final_stock']} oversold={oversold}")
@@ -16,22 +16,110 @@ Dependencies:
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import sqlite3
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.cache import LRUCache
+from common.db_pool import ConnectionPool
+from common.idempotency import IdempotencyConflict, IdempotencyStore
+from common.migrations import Migration, MigrationRunner, explain_query_plans
+from common.storage import get_env_setting
+from common.streaming import ndjson_response, wants_ndjson
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
 DATABASE = 'inventory_database.db'
 
+# Responses of successful stock deductions, replayed when a client retries with the same key
+idempotency_store = IdempotencyStore(ttl=int(get_env_setting('service2', 'IDEMPOTENCY_TTL') or 86400))
+
+# Upper bound on the number of lines accepted by a single batch deduction
+MAX_BATCH_LINES = 500
+
+# Categories accepted by the goods table
+CATEGORIES = ['food', 'clothes', 'accessories', 'electronics']
+
+# Page sizes and sort orders of the filtered catalog listing; every order ends with
+# good_id so the (sort value, good_id) cursor is unique
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+CATALOG_SORTS = {
+    'id': ("goods.good_id ASC", "goods.good_id > ?"),
+    'price_asc': ("goods.price ASC, goods.good_id ASC", "(goods.price, goods.good_id) > (?, ?)"),
+    'price_desc': ("goods.price DESC, goods.good_id DESC", "(goods.price, goods.good_id) < (?, ?)"),
+}
+
+# Name searches match substrings through the 'goods_trigrams' index where SQLite ships the
+# FTS5 trigram tokenizer (3.34+); older builds fall back to word prefixes on 'goods_fts'
+TRIGRAM_SEARCH = sqlite3.sqlite_version_info >= (3, 34, 0)
+NAME_INDEX = 'goods_trigrams' if TRIGRAM_SEARCH else 'goods_fts'
+
+# Schema changes applied by create_db_table, in version order; never edit an applied entry
+MIGRATIONS = [
+    # The rowid (good_id) is implicitly the last column of every index, which the
+    # (price, good_id) keyset cursor relies on
+    Migration(1, "Index goods by category and price, and by price", [
+        "CREATE INDEX IF NOT EXISTS idx_goods_category_price ON goods (category, price)",
+        "CREATE INDEX IF NOT EXISTS idx_goods_price ON goods (price)",
+    ]),
+    Migration(2, "Full-text index of good names", lambda conn: create_goods_search_index(conn)),
+    Migration(3, "Sequence-numbered change log of goods", lambda conn: create_goods_change_log(conn)),
+    Migration(4, "Trigram index of good names", lambda conn: create_goods_trigram_index(conn)),
+    Migration(5, "Create the idempotency key table", idempotency_store.create_table),
+]
+migration_runner = MigrationRunner(MIGRATIONS)
+
+# Page sizes of the goods change feed
+DEFAULT_CHANGES_PAGE_SIZE = 500
+MAX_CHANGES_PAGE_SIZE = 5000
+
+# Hot queries whose plans are reported at startup, with sample parameters
+HOT_QUERIES = {
+    "get_good_by_id": ("SELECT * FROM goods WHERE good_id = ?", (1,)),
+    "catalog_by_category": ("SELECT * FROM goods WHERE category = ? AND price BETWEEN ? AND ? "
+                            "ORDER BY price, good_id LIMIT ?", ('food', 0.0, 10.0, 50)),
+    "catalog_by_price": ("SELECT * FROM goods WHERE price >= ? ORDER BY price DESC, good_id DESC LIMIT ?", (0.0, 50)),
+    "catalog_by_name": (f"SELECT goods.* FROM {NAME_INDEX} JOIN goods ON goods.good_id = {NAME_INDEX}.rowid "
+                        f"WHERE {NAME_INDEX} MATCH ? ORDER BY goods.good_id LIMIT ?", ('"mug"', 50)),
+    "goods_changes": ("SELECT * FROM goods_changes WHERE seq > ? ORDER BY seq LIMIT ?", (0, 500)),
+}
+
+# Connections are borrowed from a shared pool configured by the service's storage profile
+db_pool = ConnectionPool.from_profile(DATABASE, 'service2', size=8)
+db_pool.init_app(app)
+
+# Read-through cache of get_good_by_id, invalidated by every write to a good
+goods_cache = LRUCache(maxsize=int(get_env_setting('service2', 'GOODS_CACHE_SIZE') or 4096),
+                       ttl=float(get_env_setting('service2', 'GOODS_CACHE_TTL') or 30))
+
 
 def connect_to_db():
     """
-    Establishes a connection to the SQLite database.
+    Borrows a connection to the SQLite database from the service's connection pool.
+
+    Inside a request the same connection is returned to every caller, so chained calls
+    such as `add_good` followed by `get_good_by_id` share one transaction.
 
     Returns:
-        sqlite3.Connection: A connection object to the specified SQLite database.
+        PooledConnection: A pooled connection to the specified SQLite database.
+    """
+    return db_pool.connect()
+
+
+def invalidate_good(good_id):
+    """
+    Drops a good from the read-through cache after it was written.
+
+    The entry is dropped right away, so the writer reads its own change, and again once
+    the write is committed, so a concurrent reader cannot cache the pre-commit row.
+
+    Args:
+        good_id (int): The unique ID of the written good.
     """
-    conn = sqlite3.connect(DATABASE)
-    return conn
+    goods_cache.invalidate(good_id)
+    db_pool.after_commit(lambda: goods_cache.invalidate(good_id))
 
 
 def create_db_table():
@@ -40,6 +128,7 @@ def create_db_table():
 
     The table includes fields for good ID, name, category, price, description, and stock count.
     Constraints are applied to ensure data integrity, such as valid categories and non-negative stock counts.
+    The pending schema migrations are applied afterwards.
 
     Returns:
         None
@@ -62,6 +151,165 @@ def create_db_table():
         print(f"Error creating goods table: {e}")
     finally:
         conn.close()
+    migrate_db()
+
+
+def create_goods_search_index(conn):
+    """
+    Creates the 'goods_fts' FTS5 index over good names, fills it and adds the triggers
+    that keep it in sync with the 'goods' table.
+
+    Prefix indexes for 2 and 3 characters make short name prefixes as cheap as whole words.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the inventory database.
+    """
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS goods_fts USING fts5(
+            name, content='goods', content_rowid='good_id', prefix='2 3'
+        );
+    ''')
+    conn.execute("INSERT INTO goods_fts (goods_fts) VALUES ('rebuild')")
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS goods_fts_insert AFTER INSERT ON goods BEGIN
+            INSERT INTO goods_fts (rowid, name) VALUES (NEW.good_id, NEW.name);
+        END;
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS goods_fts_update AFTER UPDATE OF name ON goods BEGIN
+            INSERT INTO goods_fts (goods_fts, rowid, name) VALUES ('delete', OLD.good_id, OLD.name);
+            INSERT INTO goods_fts (rowid, name) VALUES (NEW.good_id, NEW.name);
+        END;
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS goods_fts_delete AFTER DELETE ON goods BEGIN
+            INSERT INTO goods_fts (goods_fts, rowid, name) VALUES ('delete', OLD.good_id, OLD.name);
+        END;
+    ''')
+
+
+def create_goods_trigram_index(conn):
+    """
+    Creates the 'goods_trigrams' FTS5 index over good names, fills it and adds the triggers
+    that keep it in sync with the 'goods' table.
+
+    The trigram tokenizer indexes every three-character run of a name, so a search term of
+    three characters or more matches anywhere in the name, case-insensitively. SQLite builds
+    older than 3.34 lack the tokenizer; the index is then skipped and name searches keep
+    matching word prefixes only.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the inventory database.
+    """
+    if not TRIGRAM_SEARCH:
+        print(f"SQLite {sqlite3.sqlite_version} has no trigram tokenizer; name search matches word prefixes only")
+        return
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS goods_trigrams USING fts5(
+            name, content='goods', content_rowid='good_id', tokenize='trigram'
+        );
+    ''')
+    conn.execute("INSERT INTO goods_trigrams (goods_trigrams) VALUES ('rebuild')")
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS goods_trigrams_insert AFTER INSERT ON goods BEGIN
+            INSERT INTO goods_trigrams (rowid, name) VALUES (NEW.good_id, NEW.name);
+        END;
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS goods_trigrams_update AFTER UPDATE OF name ON goods BEGIN
+            INSERT INTO goods_trigrams (goods_trigrams, rowid, name) VALUES ('delete', OLD.good_id, OLD.name);
+            INSERT INTO goods_trigrams (rowid, name) VALUES (NEW.good_id, NEW.name);
+        END;
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS goods_trigrams_delete AFTER DELETE ON goods BEGIN
+            INSERT INTO goods_trigrams (goods_trigrams, rowid, name) VALUES ('delete', OLD.good_id, OLD.name);
+        END;
+    ''')
+
+
+def create_goods_change_log(conn):
+    """
+    Creates the 'goods_changes' log, seeds it with the existing goods and adds the triggers
+    that append every change of a good to it.
+
+    Each entry carries the state of the good after the change, so a consumer only has to
+    apply the entries after the last sequence number it saw, in order, to mirror the goods.
+    The triggers append in the same transaction as the write, whichever function made it
+    (`add_good`, `update_good`, `deduct_good` or `deduct_goods`), so the log and the goods
+    table never disagree. AUTOINCREMENT keeps sequence numbers from being reused after
+    `compact_goods_changes` removed entries.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the inventory database.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS goods_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            good_id INTEGER NOT NULL,
+            operation TEXT CHECK( operation IN ('upsert', 'delete') ) NOT NULL,
+            name TEXT,
+            category TEXT,
+            price REAL,
+            stock_count INTEGER,
+            changed_at TEXT NOT NULL
+        );
+    ''')
+    conn.execute('''
+        INSERT INTO goods_changes (good_id, operation, name, category, price, stock_count, changed_at)
+        SELECT good_id, 'upsert', name, category, price, stock_count, datetime('now') FROM goods ORDER BY good_id
+    ''')
+    upsert = '''
+        INSERT INTO goods_changes (good_id, operation, name, category, price, stock_count, changed_at)
+        VALUES (NEW.good_id, 'upsert', NEW.name, NEW.category, NEW.price, NEW.stock_count, datetime('now'));
+    '''
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS goods_changes_insert AFTER INSERT ON goods BEGIN
+            {upsert}
+        END;
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS goods_changes_update
+        AFTER UPDATE OF name, category, price, stock_count ON goods BEGIN
+            {upsert}
+        END;
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS goods_changes_delete AFTER DELETE ON goods BEGIN
+            INSERT INTO goods_changes (good_id, operation, changed_at) VALUES (OLD.good_id, 'delete', datetime('now'));
+        END;
+    ''')
+
+
+def migrate_db():
+    """
+    Brings the database schema up to date by applying the pending entries of `MIGRATIONS`.
+
+    Returns:
+        int: The schema version after migrating, or None if a migration failed.
+    """
+    try:
+        conn = connect_to_db()
+        return migration_runner.migrate(conn)
+    except sqlite3.Error as e:
+        print(f"Error migrating the inventory database: {e}")
+        return None
+    finally:
+        conn.close()
+
+
+def report_query_plans():
+    """
+    Prints the query plan of every entry of `HOT_QUERIES`, marking full table scans.
+
+    Returns:
+        dict: Maps each query name to its plan and whether it scans the whole table.
+    """
+    conn = connect_to_db()
+    try:
+        return explain_query_plans(conn, HOT_QUERIES)
+    finally:
+        conn.close()
 
 
 def add_good(good):
@@ -88,6 +336,7 @@ def add_good(good):
             VALUES (?, ?, ?, ?, ?)
         """, (good['name'], good['category'], good['price'], good.get('description', ''), good['stock_count']))
         conn.commit()
+        invalidate_good(cur.lastrowid)
         new_good = get_good_by_id(cur.lastrowid)
     except sqlite3.IntegrityError as e:
         conn.rollback()
@@ -100,44 +349,134 @@ def add_good(good):
     return new_good
 
 
-def deduct_good(good_id, quantity):
+def deduct_good(good_id, quantity, idempotency_key=None):
     """
     Deducts a specified quantity from a good's stock count.
 
+    The stock check and the deduction are a single conditional UPDATE, so concurrent
+    deductions cannot oversell a good. The existence of the good is only looked up
+    when the UPDATE matched no row, to tell a missing good from insufficient stock.
+
+    When an idempotency key is given and a deduction with that key already succeeded,
+    the stored result is returned without touching the stock again.
+
     Args:
         good_id (int): The unique ID of the good.
         quantity (int): The quantity to deduct. Must be a positive integer.
+        idempotency_key (str, optional): Client-chosen key identifying this deduction across retries.
 
     Returns:
-        dict: A message indicating the result of the deduction operation.
+        dict: A message indicating the result of the deduction operation. On success it
+            also holds the 'seq' of the change feed entry carrying the new stock; a
+            replayed result carries 'replayed': True.
     """
     message = {}
     try:
         conn = connect_to_db()
         cur = conn.cursor()
-        # Check current stock
-        cur.execute("SELECT stock_count FROM goods WHERE good_id = ?", (good_id,))
-        row = cur.fetchone()
-        if row:
-            current_stock = row[0]
-            if current_stock >= quantity:
+        if idempotency_key:
+            # Take the write lock first, so the key lookup stays valid until the deduction
+            if not conn.in_transaction:
+                cur.execute("BEGIN IMMEDIATE")
+            fingerprint = idempotency_store.fingerprint(good_id, quantity)
+            stored = idempotency_store.lookup(cur, 'deduct_good', idempotency_key, fingerprint)
+            if stored is not None:
+                conn.rollback()
+                stored["replayed"] = True
+                return stored
+        cur.execute("""
+            UPDATE goods
+            SET stock_count = stock_count - ?
+            WHERE good_id = ? AND stock_count >= ?
+        """, (quantity, good_id, quantity))
+        if cur.rowcount == 1:
+            message["status"] = "Stock deducted successfully."
+            # The change log trigger appended the new stock in this transaction
+            cur.execute("SELECT MAX(seq) FROM goods_changes WHERE good_id = ?", (good_id,))
+            message["seq"] = cur.fetchone()[0]
+            if idempotency_key:
+                idempotency_store.save(cur, 'deduct_good', idempotency_key, fingerprint, message)
+            conn.commit()
+            invalidate_good(good_id)
+        else:
+            conn.rollback()
+            cur.execute("SELECT 1 FROM goods WHERE good_id = ?", (good_id,))
+            if cur.fetchone():
+                message["status"] = "Insufficient stock to deduct."
+            else:
+                message["status"] = "Good not found."
+    except IdempotencyConflict as e:
+        conn.rollback()
+        message["status"] = str(e)
+        message["conflict"] = True
+    except Exception as e:
+        conn.rollback()
+        message["status"] = f"Error deducting stock: {e}"
+    finally:
+        conn.close()
+    return message
+
+
+def deduct_goods(items):
+    """
+    Deducts stock for several goods at once, all-or-nothing, in a single transaction.
+
+    All lines are applied with one `executemany` of the conditional UPDATE used by
+    `deduct_good`. If every line matched a row the transaction is committed; otherwise
+    it is rolled back and the lines are replayed one by one in a throwaway transaction
+    to report which of them failed. Lines for the same good are applied in order, so
+    their quantities add up.
+
+    Args:
+        items (list): A list of (good_id, quantity) pairs. Quantities must be positive integers.
+
+    Returns:
+        dict: A dictionary with:
+            - 'status' (str): The overall result of the batch.
+            - 'results' (list): One dictionary per line with 'good_id', 'quantity' and 'status'.
+    """
+    result = {"results": []}
+    try:
+        conn = connect_to_db()
+        cur = conn.cursor()
+        cur.executemany("""
+            UPDATE goods
+            SET stock_count = stock_count - ?
+            WHERE good_id = ? AND stock_count >= ?
+        """, [(quantity, good_id, quantity) for good_id, quantity in items])
+        if cur.rowcount == len(items):
+            conn.commit()
+            for good_id in {good_id for good_id, _ in items}:
+                invalidate_good(good_id)
+            result["status"] = "Stock deducted successfully."
+            line_status = ["Stock deducted successfully."] * len(items)
+        else:
+            conn.rollback()
+            line_status = []
+            for good_id, quantity in items:
                 cur.execute("""
                     UPDATE goods
                     SET stock_count = stock_count - ?
-                    WHERE good_id = ?
-                """, (quantity, good_id))
-                conn.commit()
-                message["status"] = "Stock deducted successfully."
+                    WHERE good_id = ? AND stock_count >= ?
+                """, (quantity, good_id, quantity))
+                if cur.rowcount == 1:
+                    line_status.append("Not deducted.")
+                    continue
+                cur.execute("SELECT 1 FROM goods WHERE good_id = ?", (good_id,))
+                line_status.append("Insufficient stock to deduct." if cur.fetchone() else "Good not found.")
+            conn.rollback()
+            if "Good not found." in line_status:
+                result["status"] = "Good not found."
             else:
-                message["status"] = "Insufficient stock to deduct."
-        else:
-            message["status"] = "Good not found."
+                result["status"] = "Insufficient stock to deduct."
+        for (good_id, quantity), status in zip(items, line_status):
+            result["results"].append({"good_id": good_id, "quantity": quantity, "status": status})
     except Exception as e:
         conn.rollback()
-        message["status"] = f"Error deducting stock: {e}"
+        result = {"status": f"Error deducting stock: {e}", "results": []}
     finally:
         conn.close()
-    return message
+    return result
 
 
 def update_good(good_id, updated_fields):
@@ -174,6 +513,7 @@ def update_good(good_id, updated_fields):
         query = f"UPDATE goods SET {set_clause} WHERE good_id = ?"
         cur.execute(query, tuple(values))
         conn.commit()
+        invalidate_good(good_id)
         updated_good = get_good_by_id(good_id)
     except Exception as e:
         conn.rollback()
@@ -183,6 +523,68 @@ def update_good(good_id, updated_fields):
     return updated_good
 
 
+def get_goods_changes(after_seq=0, limit=DEFAULT_CHANGES_PAGE_SIZE):
+    """
+    Retrieves the entries of the goods change log after a sequence number.
+
+    Args:
+        after_seq (int): Sequence number of the last entry the consumer applied; 0 for all.
+        limit (int): Maximum number of entries to return.
+
+    Returns:
+        dict: A dictionary with the 'changes' in sequence order, the 'last_seq' to pass
+            as `after_seq` next time, and whether more entries are waiting ('has_more').
+            Returns None if an error occurs.
+    """
+    try:
+        conn = connect_to_db()
+        conn.row_factory = sqlite3.Row
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM goods_changes WHERE seq > ? ORDER BY seq LIMIT ?", (after_seq, limit + 1))
+        changes = [dict(row) for row in cur.fetchall()]
+    except sqlite3.Error as e:
+        print(f"Error fetching goods changes: {e}")
+        return None
+    finally:
+        conn.close()
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    return {
+        "changes": changes,
+        "last_seq": changes[-1]["seq"] if changes else after_seq,
+        "has_more": has_more,
+    }
+
+
+def compact_goods_changes():
+    """
+    Drops every entry of the goods change log superseded by a later entry for the same good.
+
+    Entries carry the whole state of the good, so a consumer reading the compacted log
+    from any sequence number still ends up with the same goods, only without the
+    intermediate states it skipped.
+
+    Returns:
+        int: The number of entries removed, or None if an error occurs.
+    """
+    try:
+        conn = connect_to_db()
+        cur = conn.cursor()
+        cur.execute("""
+            DELETE FROM goods_changes
+            WHERE seq NOT IN (SELECT MAX(seq) FROM goods_changes GROUP BY good_id)
+        """)
+        removed = cur.rowcount
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Error compacting goods changes: {e}")
+        return None
+    finally:
+        conn.close()
+    return removed
+
+
 def get_all_goods():
     """
     Retrieves all goods from the 'goods' table.
@@ -206,9 +608,156 @@ def get_all_goods():
     return goods
 
 
+def split_name_search(text):
+    """
+    Splits free text into the words of a name search.
+
+    Quotes are dropped and words without a letter or digit are ignored: they cannot match
+    a name token and would otherwise leave an empty FTS5 expression.
+
+    Args:
+        text (str): The words typed by the user.
+
+    Returns:
+        list: The searchable words, empty if there is nothing to search for.
+    """
+    words = [word.replace('"', '') for word in text.split()]
+    return [word for word in words if any(char.isalnum() for char in word)]
+
+
+def build_name_query(words, prefix=True):
+    """
+    Turns search words into an FTS5 query matching names that contain every word.
+
+    Every word is quoted, so punctuation is searched literally and cannot raise an FTS
+    syntax error.
+
+    Args:
+        words (list): Words returned by split_name_search.
+        prefix (bool): Whether each word matches the start of a word ('goods_fts') rather
+            than a substring ('goods_trigrams').
+
+    Returns:
+        str: The FTS5 MATCH expression.
+    """
+    suffix = "*" if prefix else ""
+    return " ".join(f'"{word}"{suffix}' for word in words)
+
+
+def build_name_filter(text):
+    """
+    Builds the tables, predicates and parameters of a name search.
+
+    With the trigram index, every word must appear anywhere in the name, ignoring case:
+    words of three characters or more are looked up in 'goods_trigrams', and shorter ones,
+    which have no trigram, are checked with LIKE on the goods that lookup returns (on all
+    goods if every word is short). Without it, every word must start a word of the name.
+
+    Args:
+        text (str): The words typed by the user.
+
+    Returns:
+        tuple: The FROM clause, the list of predicates and the list of their parameters.
+
+    Raises:
+        ValueError: If the text holds no searchable word.
+    """
+    words = split_name_search(text)
+    if not words:
+        raise ValueError("Nothing to search for in the name")
+    if not TRIGRAM_SEARCH:
+        return ("goods_fts JOIN goods ON goods.good_id = goods_fts.rowid",
+                ["goods_fts MATCH ?"], [build_name_query(words)])
+
+    tables = "goods"
+    conditions = []
+    params = []
+    indexed = [word for word in words if len(word) >= 3]
+    if indexed:
+        tables = "goods_trigrams JOIN goods ON goods.good_id = goods_trigrams.rowid"
+        conditions.append("goods_trigrams MATCH ?")
+        params.append(build_name_query(indexed, prefix=False))
+    for word in words:
+        if len(word) < 3:
+            escaped = word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            conditions.append("goods.name LIKE ? ESCAPE '\\'")
+            params.append(f"%{escaped}%")
+    return tables, conditions, params
+
+
+def search_goods(filters, sort='id', cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Retrieves one page of goods matching the catalog filters, using keyset pagination.
+
+    Every filter is a SQL predicate: category and price ranges are served by the
+    (category, price) and (price) indexes and name searches by the name index, so
+    only the requested page leaves the database.
+
+    Args:
+        filters (dict): Optional filters with keys:
+            - 'category' (str): Exact category.
+            - 'min_price' (float), 'max_price' (float): Inclusive price bounds.
+            - 'in_stock' (bool): Only goods with a positive stock count.
+            - 'name' (str): Words the name must contain, as substrings with the trigram
+              index and as word prefixes without it (see build_name_filter).
+        sort (str): A key of CATALOG_SORTS.
+        cursor (tuple, optional): The (price, good_id) of the last good already seen.
+        limit (int): Maximum number of goods to return.
+
+    Returns:
+        dict: A dictionary with 'goods' (list) and 'next_cursor' (str, None on the last page).
+
+    Raises:
+        ValueError: If the name filter holds no searchable word.
+    """
+    order_by, after = CATALOG_SORTS[sort]
+    tables = "goods"
+    conditions = []
+    params = []
+    if filters.get('name'):
+        tables, conditions, params = build_name_filter(filters['name'])
+    if filters.get('category'):
+        conditions.append("goods.category = ?")
+        params.append(filters['category'])
+    if filters.get('min_price') is not None:
+        conditions.append("goods.price >= ?")
+        params.append(filters['min_price'])
+    if filters.get('max_price') is not None:
+        conditions.append("goods.price <= ?")
+        params.append(filters['max_price'])
+    if filters.get('in_stock'):
+        conditions.append("goods.stock_count > 0")
+    if cursor is not None:
+        conditions.append(after)
+        params.extend([cursor[1]] if sort == 'id' else list(cursor))
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    params.append(limit + 1)
+
+    page = {"goods": [], "next_cursor": None}
+    try:
+        conn = connect_to_db()
+        conn.row_factory = sqlite3.Row
+        cur = conn.cursor()
+        # Fetch one extra row to know whether another page follows
+        cur.execute(f"SELECT goods.* FROM {tables} {where} ORDER BY {order_by} LIMIT ?", params)
+        rows = cur.fetchall()
+        page["goods"] = [dict(row) for row in rows[:limit]]
+        if len(rows) > limit:
+            last = page["goods"][-1]
+            page["next_cursor"] = f"{last['price']!r}:{last['good_id']}"
+    except Exception as e:
+        print(f"Error searching goods: {e}")
+    finally:
+        conn.close()
+    return page
+
+
 def get_good_by_id(good_id):
     """
-    Retrieves a single good by its ID.
+    Retrieves a single good by its ID, through the read-through goods cache.
+
+    A row read inside an open write transaction is not cached, since other connections
+    cannot see it yet.
 
     Args:
         good_id (int): The unique ID of the good.
@@ -216,6 +765,10 @@ def get_good_by_id(good_id):
     Returns:
         dict: A dictionary representing the good if found, otherwise an empty dictionary.
     """
+    cached = goods_cache.get(good_id)
+    if cached is not None:
+        return dict(cached)
+    generation = goods_cache.generation()
     good = {}
     try:
         conn = connect_to_db()
@@ -225,6 +778,8 @@ def get_good_by_id(good_id):
         row = cur.fetchone()
         if row:
             good = dict(row)
+            if not conn.in_transaction:
+                goods_cache.set(good_id, dict(good), generation)
     except Exception as e:
         print(f"Error fetching good by ID: {e}")
     finally:
@@ -235,7 +790,11 @@ def get_good_by_id(good_id):
 @app.route('/api/goods', methods=['GET'])
 def api_get_goods():
     """
-    API Endpoint to retrieve all goods.
+    API Endpoint to retrieve goods, either the whole catalog or a filtered page.
+
+    Without query parameters all goods are returned as a list. Passing any of the
+    filter or pagination parameters returns one page of matching goods, filtered and
+    sorted in SQL, with the cursor of the next page.
 
     Method:
         GET
@@ -243,14 +802,113 @@ def api_get_goods():
     URL:
         /api/goods
 
+    Query Parameters:
+        format (str, optional): 'ndjson' to stream the goods as newline-delimited JSON,
+            one good per line, instead of building the whole list in memory.
+        category (str, optional): One of CATEGORIES.
+        min_price (float, optional): Lowest price, inclusive.
+        max_price (float, optional): Highest price, inclusive.
+        in_stock (bool, optional): 'true' to return only goods with stock left.
+        name (str, optional): Words the name must contain, anywhere and ignoring case.
+            On SQLite builds without the trigram tokenizer each word must start a word.
+        sort (str, optional): 'id' (default), 'price_asc' or 'price_desc'.
+        cursor (str, optional): The 'next_cursor' of the previous page.
+        limit (int, optional): Page size, between 1 and MAX_PAGE_SIZE. Default DEFAULT_PAGE_SIZE.
+
     Success Response:
         Code: 200
-        Content: List of goods dictionaries in JSON format.
+        Content: List of goods dictionaries in JSON format, an 'application/x-ndjson' stream,
+            or, when filtering, an object with 'goods' and 'next_cursor' (null on the last page).
+
+    Error Response:
+        Code: 400
+        Content: Error message indicating an invalid query parameter, or a name with
+            nothing to search for.
 
     Example:
         GET /api/goods
+        GET /api/goods?format=ndjson
+        GET /api/goods?category=food&max_price=5&in_stock=true&sort=price_asc
+        GET /api/goods?name=coff&limit=20
+        GET /api/goods?name=ug
+    """
+    if wants_ndjson(request):
+        return ndjson_response(connect_to_db, "SELECT * FROM goods ORDER BY good_id")
+    catalog_params = ('category', 'min_price', 'max_price', 'in_stock', 'name', 'sort', 'cursor', 'limit')
+    if not any(key in request.args for key in catalog_params):
+        return jsonify(get_all_goods()), 200
+
+    filters = {
+        'category': request.args.get('category'),
+        'in_stock': request.args.get('in_stock', '').lower() in ('1', 'true', 'yes'),
+        'name': request.args.get('name', '').strip(),
+    }
+    if filters['category'] and filters['category'] not in CATEGORIES:
+        return jsonify({"error": f"Invalid category: must be one of {', '.join(CATEGORIES)}"}), 400
+    if filters['name'] and not split_name_search(filters['name']):
+        return jsonify({"error": "Invalid name: nothing to search for"}), 400
+    sort = request.args.get('sort', 'id')
+    if sort not in CATALOG_SORTS:
+        return jsonify({"error": f"Invalid sort: must be one of {', '.join(CATALOG_SORTS)}"}), 400
+    try:
+        for key in ('min_price', 'max_price'):
+            filters[key] = float(request.args[key]) if key in request.args else None
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+        cursor = None
+        if request.args.get('cursor'):
+            price, good_id = request.args['cursor'].split(':')
+            cursor = (float(price), int(good_id))
+    except ValueError:
+        return jsonify({"error": "Invalid price, cursor or limit"}), 400
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        return jsonify({"error": f"Invalid limit: must be between 1 and {MAX_PAGE_SIZE}"}), 400
+
+    return jsonify(search_goods(filters, sort, cursor, limit)), 200
+
+
+@app.route('/api/goods/changes', methods=['GET'])
+def api_get_goods_changes():
     """
-    return jsonify(get_all_goods()), 200
+    API Endpoint to read the change log of goods, for services keeping a local replica.
+
+    Every entry holds the state of one good after a change ('upsert') or its removal
+    ('delete'). Consumers apply the entries in sequence order and pass the returned
+    'last_seq' back as 'after_seq' to get the next ones.
+
+    Method:
+        GET
+
+    URL:
+        /api/goods/changes
+
+    Query Parameters:
+        after_seq (int, optional): Sequence number of the last applied entry. Default 0.
+        limit (int, optional): Page size, between 1 and MAX_CHANGES_PAGE_SIZE.
+            Default DEFAULT_CHANGES_PAGE_SIZE.
+
+    Success Response:
+        Code: 200
+        Content: Object with the 'changes', the 'last_seq' and 'has_more'.
+
+    Error Response:
+        Code: 400
+        Content: Error message indicating an invalid after_seq or limit.
+        Code: 500
+        Content: Error message indicating server-side failure.
+
+    Example:
+        GET /api/goods/changes?after_seq=1200&limit=500
+    """
+    after_seq = request.args.get('after_seq', 0, type=int)
+    limit = request.args.get('limit', DEFAULT_CHANGES_PAGE_SIZE, type=int)
+    if after_seq is None or after_seq < 0:
+        return jsonify({"error": "Invalid after_seq"}), 400
+    if limit is None or not 1 <= limit <= MAX_CHANGES_PAGE_SIZE:
+        return jsonify({"error": f"Invalid limit: must be between 1 and {MAX_CHANGES_PAGE_SIZE}"}), 400
+    changes = get_goods_changes(after_seq, limit)
+    if changes is None:
+        return jsonify({"error": "Cannot read goods changes"}), 500
+    return jsonify(changes), 200
 
 
 @app.route('/api/goods/<int:good_id>', methods=['GET'])
@@ -285,6 +943,27 @@ def api_get_good(good_id):
         return jsonify({"error": "Good not found"}), 404
 
 
+@app.route('/api/cache/stats', methods=['GET'])
+def api_cache_stats():
+    """
+    API Endpoint to retrieve the counters of the goods cache, for sizing it.
+
+    Method:
+        GET
+
+    URL:
+        /api/cache/stats
+
+    Success Response:
+        Code: 200
+        Content: Size, configuration, hit/miss/eviction/expiry/invalidation counters and hit ratio.
+
+    Example:
+        GET /api/cache/stats
+    """
+    return jsonify(goods_cache.stats()), 200
+
+
 @app.route('/api/goods/add', methods=['POST'])
 def api_add_good():
     """
@@ -367,19 +1046,27 @@ def api_deduct_good(good_id):
     URL Parameters:
         good_id (int): The unique ID of the good.
 
+    Request Headers:
+        Idempotency-Key (str, optional): Client-chosen key for safe retries. Replaying a
+            key whose deduction succeeded returns the stored response, marked with an
+            'Idempotent-Replayed: true' header, and does not deduct again.
+
     Request Body:
         JSON object containing:
             - 'quantity' (int): The quantity to deduct. Must be a positive integer.
 
     Success Responses:
         Code: 200
-            - Stock deducted successfully.
+            - Stock deducted successfully, with the 'seq' of the change feed entry
+              carrying the new stock.
         Code: 400
             - Missing 'quantity' field.
             - Invalid 'quantity' value.
             - Insufficient stock to deduct.
         Code: 404
             - Good not found.
+        Code: 422
+            - The Idempotency-Key was used for a different deduction.
 
     Error Response:
         Code: 500
@@ -399,7 +1086,83 @@ def api_deduct_good(good_id):
         if not isinstance(quantity, int) or quantity <= 0:
             return jsonify({"error": "Invalid quantity"}), 400
 
-        result = deduct_good(good_id, quantity)
+        result = deduct_good(good_id, quantity, request.headers.get('Idempotency-Key'))
+        headers = {"Idempotent-Replayed": "true"} if result.pop("replayed", False) else {}
+        if result["status"] == "Stock deducted successfully.":
+            return jsonify(result), 200, headers
+        elif result["status"] == "Insufficient stock to deduct.":
+            return jsonify(result), 400, headers
+        elif result["status"] == "Good not found.":
+            return jsonify(result), 404, headers
+        elif result.pop("conflict", False):
+            return jsonify(result), 422, headers
+        else:
+            return jsonify(result), 500, headers
+    except Exception as e:
+        return jsonify({"error": f"Invalid request: {e}"}), 400
+
+
+@app.route('/api/goods/deduct/batch', methods=['PUT'])
+def api_deduct_goods():
+    """
+    API Endpoint to deduct stock for several goods in one all-or-nothing transaction.
+
+    Method:
+        PUT
+
+    URL:
+        /api/goods/deduct/batch
+
+    Request Body:
+        JSON object containing:
+            - 'items' (list): Lines to deduct, each an object with:
+                - 'good_id' (int): The unique ID of the good.
+                - 'quantity' (int): The quantity to deduct. Must be a positive integer.
+
+    Success Responses:
+        Code: 200
+            - Stock deducted successfully for every line.
+        Code: 400
+            - Missing or empty 'items' field, or more than MAX_BATCH_LINES lines.
+            - Invalid 'good_id' or 'quantity' value in a line.
+            - Insufficient stock for at least one line; nothing is deducted.
+        Code: 404
+            - At least one good was not found; nothing is deducted.
+
+    Error Response:
+        Code: 500
+            - Server error during deduction.
+
+    Content:
+        The overall 'status' and a 'results' list with the status of every line.
+
+    Example:
+        PUT /api/goods/deduct/batch
+        {
+            "items": [
+                {"good_id": 1, "quantity": 2},
+                {"good_id": 7, "quantity": 1}
+            ]
+        }
+    """
+    try:
+        data = request.get_json()
+        if not isinstance(data.get('items'), list) or not data['items']:
+            return jsonify({"error": "Missing field: items"}), 400
+        if len(data['items']) > MAX_BATCH_LINES:
+            return jsonify({"error": f"Too many items: at most {MAX_BATCH_LINES} per batch"}), 400
+
+        items = []
+        for index, item in enumerate(data['items']):
+            good_id = item.get('good_id')
+            quantity = item.get('quantity')
+            if not isinstance(good_id, int):
+                return jsonify({"error": f"Invalid good_id in item {index}"}), 400
+            if not isinstance(quantity, int) or quantity <= 0:
+                return jsonify({"error": f"Invalid quantity in item {index}"}), 400
+            items.append((good_id, quantity))
+
+        result = deduct_goods(items)
         if result["status"] == "Stock deducted successfully.":
             return jsonify(result), 200
         elif result["status"] == "Insufficient stock to deduct.":
@@ -483,4 +1246,7 @@ def api_update_good(good_id):
 
 if __name__ == "__main__":
     create_db_table()
+    compact_goods_changes()
+    db_pool.report()
+    report_query_plans()
     app.run(debug=True, port=5001)
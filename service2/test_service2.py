@@ -22,8 +22,8 @@ def client():
     """
     Pytest fixture to set up a test client and initialize a test database.
 
-    This fixture configures the Flask application for testing, overrides the database connection
-    to use a test-specific database, creates the necessary database tables, and provides a test client
+    This fixture configures the Flask application for testing, points the service's connection
+    pool at a test-specific database, creates the necessary database tables, and provides a test client
     for making API requests. After the tests are completed, it cleans up by removing the test database file.
 
     Yields:
@@ -33,29 +33,27 @@ def client():
     app.config['TESTING'] = True
     app.config['DATABASE'] = 'test_inventory_database.db'
 
-    def connect_to_db_override():
-        """
-        Overrides the default database connection to use the test database.
-
-        Returns:
-            sqlite3.Connection: A connection object to the test SQLite database.
-        """
-        conn = sqlite3.connect(app.config['DATABASE'])
-        return conn
-
-    # Override the connect_to_db function in service2 with the test database connection
+    # Point the service's own connection pool at the test database, so every test goes
+    # through the request scope bound to the app: deferred commits, rollbacks, after_commit
     import service2
-    service2.connect_to_db = connect_to_db_override
+    service2.db_pool.use_database(app.config['DATABASE'])
 
-    # Create the necessary database tables in the test database
+    # Start every test with an empty goods cache, since each test gets a fresh database
+    service2.goods_cache.clear()
+
+    # Create the necessary database tables in the test database and apply the migrations
     create_tables_for_test()
+    service2.migrate_db()
 
     # Provide the test client to the tests
     with app.test_client() as client:
         yield client
 
-    # Clean up by removing the test database file after tests are done
-    os.remove(app.config['DATABASE'])
+    # Clean up by closing the pooled connections and removing the test database files
+    service2.db_pool.use_database(service2.DATABASE)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(app.config['DATABASE'] + suffix):
+            os.remove(app.config['DATABASE'] + suffix)
 
 
 def create_tables_for_test():
@@ -228,3 +226,324 @@ def test_deduct_good(client):
     assert get_response.status_code == 200, "Expected status code 200 for successful retrieval of the good."
     good_data = get_response.get_json()
     assert good_data['stock_count'] == 3, "Good stock count should be reduced to 3."
+
+
+def test_deduct_good_status_codes(client):
+    """
+    Test that the deduction endpoint keeps its 400 and 404 semantics.
+
+    This test deducts more than the available stock of a good and deducts from a good that
+    does not exist, and verifies that the stock count is left untouched.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    new_good = {
+        'name': 'Camera',
+        'category': 'electronics',
+        'price': 549.99,
+        'description': 'Mirrorless camera',
+        'stock_count': 1
+    }
+    add_response = client.post('/api/goods/add', json=new_good)
+    good_id = add_response.get_json().get('good_id')
+
+    response = client.put(f'/api/goods/deduct/{good_id}', json={'quantity': 2})
+    assert response.status_code == 400, "Expected status code 400 for insufficient stock."
+    assert response.get_json()['status'] == 'Insufficient stock to deduct.', "Deduction should be refused."
+
+    response = client.put('/api/goods/deduct/99999', json={'quantity': 1})
+    assert response.status_code == 404, "Expected status code 404 for a missing good."
+
+    good_data = client.get(f'/api/goods/{good_id}').get_json()
+    assert good_data['stock_count'] == 1, "A refused deduction should not change the stock count."
+
+
+def test_deduct_good_idempotency_key(client):
+    """
+    Test that a deduction retried with the same Idempotency-Key is applied once and names its feed change.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    good_id = client.post('/api/goods/add', json={
+        'name': 'Lantern', 'category': 'accessories', 'price': 15.0, 'stock_count': 6
+    }).get_json()['good_id']
+
+    headers = {'Idempotency-Key': 'reservation-1'}
+    first = client.put(f'/api/goods/deduct/{good_id}', json={'quantity': 2}, headers=headers)
+    assert first.status_code == 200, "The first deduction should succeed."
+    replay = client.put(f'/api/goods/deduct/{good_id}', json={'quantity': 2}, headers=headers)
+    assert replay.headers.get('Idempotent-Replayed') == 'true', "A retried deduction should be replayed."
+    assert replay.get_json()['seq'] == first.get_json()['seq'], "A replay should name the same feed change."
+    conflict = client.put(f'/api/goods/deduct/{good_id}', json={'quantity': 3}, headers=headers)
+    assert conflict.status_code == 422, "Reusing a key for another deduction should be rejected."
+
+    changes = client.get('/api/goods/changes').get_json()['changes']
+    change = [entry for entry in changes if entry['seq'] == first.get_json()['seq']][0]
+    assert change['stock_count'] == 4, "The named feed change should carry the new stock."
+    assert client.get(f'/api/goods/{good_id}').get_json()['stock_count'] == 4, "The replay should not deduct again."
+
+
+def test_concurrent_deductions_do_not_oversell(client):
+    """
+    Test that concurrent deductions never sell more than the available stock.
+
+    This test starts more threads than there are units in stock, each deducting one unit,
+    and verifies that exactly the stock count succeeds and the stock ends at zero.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    import threading
+    import service2
+
+    good = service2.add_good({
+        'name': 'Console',
+        'category': 'electronics',
+        'price': 399.99,
+        'stock_count': 10
+    })
+    results = []
+
+    def buyer():
+        results.append(service2.deduct_good(good['good_id'], 1)["status"])
+
+    threads = [threading.Thread(target=buyer) for _ in range(25)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results.count("Stock deducted successfully.") == 10, "Exactly the available stock should be sold."
+    assert results.count("Insufficient stock to deduct.") == 15, "The remaining buyers should be refused."
+    assert service2.get_good_by_id(good['good_id'])['stock_count'] == 0, "Stock should end at zero."
+
+
+def test_deduct_goods_batch(client):
+    """
+    Test the API endpoint for deducting stock from several goods in one request.
+
+    This test adds two goods, deducts from both via a PUT request to the
+    `/api/goods/deduct/batch` endpoint, and verifies the per-line results and stock counts.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    first = client.post('/api/goods/add', json={
+        'name': 'Shirt', 'category': 'clothes', 'price': 19.99, 'stock_count': 5
+    }).get_json()
+    second = client.post('/api/goods/add', json={
+        'name': 'Scarf', 'category': 'accessories', 'price': 9.99, 'stock_count': 3
+    }).get_json()
+
+    batch = {'items': [
+        {'good_id': first['good_id'], 'quantity': 2},
+        {'good_id': second['good_id'], 'quantity': 3}
+    ]}
+    response = client.put('/api/goods/deduct/batch', json=batch)
+    assert response.status_code == 200, "Expected status code 200 for a successful batch deduction."
+    data = response.get_json()
+    assert [line['status'] for line in data['results']] == ['Stock deducted successfully.'] * 2, \
+        "Every line should be reported as deducted."
+    assert client.get(f"/api/goods/{first['good_id']}").get_json()['stock_count'] == 3, "Shirt stock should be 3."
+    assert client.get(f"/api/goods/{second['good_id']}").get_json()['stock_count'] == 0, "Scarf stock should be 0."
+
+
+def test_deduct_goods_batch_is_all_or_nothing(client):
+    """
+    Test that a batch with one failing line deducts nothing and reports the failing line.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    good = client.post('/api/goods/add', json={
+        'name': 'Apple', 'category': 'food', 'price': 0.5, 'stock_count': 4
+    }).get_json()
+
+    batch = {'items': [
+        {'good_id': good['good_id'], 'quantity': 3},
+        {'good_id': good['good_id'], 'quantity': 2}
+    ]}
+    response = client.put('/api/goods/deduct/batch', json=batch)
+    assert response.status_code == 400, "Expected status code 400 when a line lacks stock."
+    statuses = [line['status'] for line in response.get_json()['results']]
+    assert statuses == ['Not deducted.', 'Insufficient stock to deduct.'], "The second line should be the one failing."
+    assert client.get(f"/api/goods/{good['good_id']}").get_json()['stock_count'] == 4, "No stock should be deducted."
+
+    response = client.put('/api/goods/deduct/batch', json={'items': [{'good_id': 99999, 'quantity': 1}]})
+    assert response.status_code == 404, "Expected status code 404 when a good does not exist."
+
+    response = client.put('/api/goods/deduct/batch', json={'items': [{'good_id': good['good_id'], 'quantity': 0}]})
+    assert response.status_code == 400, "Expected status code 400 for an invalid quantity."
+
+
+def test_get_goods_ndjson(client):
+    """
+    Test the NDJSON streaming mode of the goods listing.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    import json
+
+    for name in ('Bread', 'Milk'):
+        client.post('/api/goods/add', json={'name': name, 'category': 'food', 'price': 1.5, 'stock_count': 10})
+
+    response = client.get('/api/goods?format=ndjson')
+    assert response.status_code == 200, "Expected status code 200 for the NDJSON stream."
+    assert response.mimetype == 'application/x-ndjson', "The stream should be served as NDJSON."
+    goods = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [good['name'] for good in goods] == ['Bread', 'Milk'], "Every good should be streamed in ID order."
+
+
+def test_good_cache_is_invalidated_by_writes(client):
+    """
+    Test that good lookups are cached and that updates and deductions invalidate them.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    import service2
+
+    good_id = client.post('/api/goods/add', json={
+        'name': 'Watch', 'category': 'accessories', 'price': 120.0, 'stock_count': 4
+    }).get_json()['good_id']
+
+    client.get(f'/api/goods/{good_id}')
+    hits = service2.goods_cache.stats()['hits']
+    client.get(f'/api/goods/{good_id}')
+    assert service2.goods_cache.stats()['hits'] == hits + 1, "A repeated lookup should be served from the cache."
+
+    client.put(f'/api/goods/update/{good_id}', json={'price': 99.0})
+    assert client.get(f'/api/goods/{good_id}').get_json()['price'] == 99.0, "An update should invalidate the cache."
+
+    client.put(f'/api/goods/deduct/{good_id}', json={'quantity': 3})
+    assert client.get(f'/api/goods/{good_id}').get_json()['stock_count'] == 1, "A deduction should invalidate the cache."
+
+    stats = client.get('/api/cache/stats').get_json()
+    assert stats['invalidations'] >= 3, "Every write should be counted as an invalidation."
+
+
+def test_cache_invalidation_waits_for_the_request_commit(client):
+    """
+    Test that a write inside a request scope drops the cached good again once the scope commits.
+
+    A reader that caches the good between the write and the deferred commit stores the old
+    row; the `after_commit` invalidation must drop it when the scope ends.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    import service2
+    good_id = service2.add_good({'name': 'Kettle', 'category': 'electronics', 'price': 30.0, 'stock_count': 2})['good_id']
+
+    with service2.db_pool.scope():
+        service2.update_good(good_id, {'price': 25.0})
+        # A concurrent reader still sees the committed row and caches it
+        service2.goods_cache.set(good_id, {'good_id': good_id, 'price': 30.0}, service2.goods_cache.generation())
+        assert service2.goods_cache.get(good_id) is not None, "The stale row is cached before the commit."
+    assert service2.goods_cache.get(good_id) is None, "The commit should drop the stale cached row."
+    assert client.get(f'/api/goods/{good_id}').get_json()['price'] == 25.0, "The committed price should be read."
+
+
+def test_catalog_filters_and_pagination(client):
+    """
+    Test that catalog filters, name search, sorting and cursors are applied in SQL.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    import service2
+    goods = [('Coffee Beans', 'food', 12.0, 5), ('Coffee Mug', 'accessories', 8.0, 0),
+             ('Green Tea', 'food', 4.5, 10), ('Black Tea', 'food', 4.5, 3), ('Rain Coat', 'clothes', 60.0, 2)]
+    for name, category, price, stock in goods:
+        service2.add_good({'name': name, 'category': category, 'price': price, 'stock_count': stock})
+
+    data = client.get('/api/goods?category=food&max_price=10&sort=price_asc').get_json()
+    assert [g['name'] for g in data['goods']] == ['Green Tea', 'Black Tea'], "Cheap food sorted by price, then ID."
+
+    data = client.get('/api/goods?name=coff&in_stock=true').get_json()
+    assert [g['name'] for g in data['goods']] == ['Coffee Beans'], "A name prefix with stock filter should match."
+
+    names, cursor = [], ''
+    while True:
+        data = client.get(f'/api/goods?sort=price_desc&limit=2&cursor={cursor}').get_json()
+        names.extend(g['name'] for g in data['goods'])
+        if data['next_cursor'] is None:
+            break
+        cursor = data['next_cursor']
+    assert names == ['Rain Coat', 'Coffee Beans', 'Coffee Mug', 'Black Tea', 'Green Tea'], \
+        "Paging by descending price should return every good once, ties by descending ID."
+
+    plans = service2.report_query_plans()
+    assert not any(plan['full_scan'] for plan in plans.values()), "Catalog queries should use indexes."
+    assert client.get('/api/goods?category=toys').status_code == 400, "An unknown category is a 400."
+    assert client.get('/api/goods?min_price=cheap').status_code == 400, "A bad price is a 400."
+
+
+def test_name_search_matches_substrings(client):
+    """
+    Test that name search finds words anywhere in a name and rejects names with nothing to search.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    import service2
+    for name in ('Coffee Mug', 'Mugwort Tea', 'Rain Coat', '100% Cotton Shirt'):
+        service2.add_good({'name': name, 'category': 'food', 'price': 5.0, 'stock_count': 1})
+
+    def search(text):
+        return [g['name'] for g in client.get('/api/goods', query_string={'name': text}).get_json()['goods']]
+
+    assert search('coff') == ['Coffee Mug'], "A word prefix should still match."
+    if service2.TRIGRAM_SEARCH:
+        assert search('ug') == ['Coffee Mug', 'Mugwort Tea'], "A short substring should match inside a word."
+        assert search('WORT') == ['Mugwort Tea'], "A substring should match ignoring case."
+        assert search('oat rain') == ['Rain Coat'], "Every word should match somewhere in the name."
+        assert search('0%') == ['100% Cotton Shirt'], "LIKE wildcards should be searched literally."
+
+    for text in ('""""', '!!!', '" - "'):
+        response = client.get('/api/goods', query_string={'name': text})
+        assert response.status_code == 400, f"A name with nothing to search for ({text}) should be a 400."
+
+    plans = service2.report_query_plans()
+    assert not plans['catalog_by_name']['full_scan'], "Name search should use the name index."
+
+
+def test_goods_change_feed(client):
+    """
+    Test that every write to a good is published, in order, on the goods change feed.
+
+    This test adds, updates and deducts goods through the API, pages through the
+    `/api/goods/changes` feed and checks that compaction keeps the latest state of each good.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    import service2
+    lamp = client.post('/api/goods/add', json={
+        'name': 'Lamp', 'category': 'electronics', 'price': 30.0, 'stock_count': 4
+    }).get_json()
+    rug = client.post('/api/goods/add', json={
+        'name': 'Rug', 'category': 'accessories', 'price': 60.0, 'stock_count': 2
+    }).get_json()
+    client.put(f"/api/goods/update/{lamp['good_id']}", json={'price': 25.0})
+    client.put(f"/api/goods/deduct/{lamp['good_id']}", json={'quantity': 1})
+    client.put('/api/goods/deduct/batch', json={'items': [{'good_id': rug['good_id'], 'quantity': 5}]})
+
+    first = client.get('/api/goods/changes?limit=3').get_json()
+    assert first['has_more'], "A partial page should say more changes are waiting."
+    rest = client.get(f"/api/goods/changes?after_seq={first['last_seq']}").get_json()
+    changes = first['changes'] + rest['changes']
+    assert [change['seq'] for change in changes] == sorted(change['seq'] for change in changes), "Changes are ordered."
+    assert [(c['name'], c['price'], c['stock_count']) for c in changes] == [
+        ('Lamp', 30.0, 4), ('Rug', 60.0, 2), ('Lamp', 25.0, 4), ('Lamp', 25.0, 3)
+    ], "Each write should publish the new state; the refused batch should publish nothing."
+    assert not rest['has_more'], "The last page should say the feed is caught up."
+
+    assert service2.compact_goods_changes() == 2, "Superseded Lamp entries should be dropped."
+    compacted = client.get('/api/goods/changes').get_json()['changes']
+    assert [(c['name'], c['stock_count']) for c in compacted] == [('Rug', 2), ('Lamp', 3)], \
+        "Compaction should keep the latest state of every good."
+    assert client.get('/api/goods/changes?limit=0').status_code == 400, "An invalid limit should be rejected."
@@ -0,0 +1,170 @@
+#!/usr/bin/python
+"""
+Concurrency benchmark for the sale pipeline in the Sales Management API.
+
+This script compares the original `make_sale` (two SELECTs checked in Python, then three
+unguarded writes) with the guarded single-transaction version. Both run against a
+scratch database through the service's pooled connections, with N threads buying one
+good each until the wallets or the stock run out. For each variant it reports sales per
+second, how many sales succeeded, were refused or failed with an error, and whether any
+wallet or stock count went negative.
+
+Usage:
+    python bench_service3.py [--threads 16] [--customers 4] [--stock 2000] [--attempts 4000]
+
+Pass a --stock lower than --attempts to make the threads race for the last units.
+"""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+import service3
+from common.db_pool import ConnectionPool
+
+
+def legacy_make_sale(customer_username, good_name):
+    """
+    The original read-then-write sale, kept here as the benchmark baseline.
+
+    Args:
+        customer_username (str): The username of the customer making the purchase.
+        good_name (str): The name of the good being purchased.
+
+    Returns:
+        dict: A message indicating the result of the sale operation.
+    """
+    sale_result = {}
+    try:
+        conn = service3.connect_to_db()
+        conn.row_factory = sqlite3.Row
+        cur = conn.cursor()
+        cur.execute("SELECT wallet_balance FROM customers WHERE username = ?", (customer_username,))
+        wallet_row = cur.fetchone()
+        if not wallet_row:
+            sale_result["status"] = "Customer not found."
+            return sale_result
+        cur.execute("SELECT price_per_item, count_in_stock FROM goods WHERE name = ?", (good_name,))
+        good_row = cur.fetchone()
+        if not good_row:
+            sale_result["status"] = "Good not found."
+            return sale_result
+        price = good_row["price_per_item"]
+        if wallet_row["wallet_balance"] >= price and good_row["count_in_stock"] > 0:
+            cur.execute("UPDATE customers SET wallet_balance = wallet_balance - ? WHERE username = ?",
+                        (price, customer_username))
+            cur.execute("UPDATE goods SET count_in_stock = count_in_stock - 1 WHERE name = ?", (good_name,))
+            cur.execute("""
+                INSERT INTO sales (customer_username, good_name, sale_date, sale_amount)
+                VALUES (?, ?, datetime('now'), ?)
+            """, (customer_username, good_name, price))
+            conn.commit()
+            sale_result["status"] = "Sale successful"
+        else:
+            sale_result["status"] = "Insufficient funds or item not available for sale"
+    except sqlite3.Error as e:
+        conn.rollback()
+        sale_result["status"] = f"Sale failed: {e}"
+    finally:
+        conn.close()
+    return sale_result
+
+
+def create_bench_tables(database, customers, stock):
+    """
+    Creates the customers, goods and sales tables of a scratch database and seeds them.
+
+    The wallets together can afford exactly the stock, so the wallets and the stock run
+    out at the same time when all threads buy.
+
+    Args:
+        database (str): Path of the scratch database.
+        customers (int): Number of customers to create.
+        stock (int): Initial stock count of the single good.
+    """
+    conn = sqlite3.connect(database)
+    conn.execute("CREATE TABLE customers (username TEXT PRIMARY KEY, wallet_balance REAL DEFAULT 0)")
+    conn.execute("CREATE TABLE goods (name TEXT PRIMARY KEY, price_per_item REAL NOT NULL, count_in_stock INTEGER NOT NULL)")
+    conn.execute("""
+        CREATE TABLE sales (
+            sale_id INTEGER PRIMARY KEY NOT NULL,
+            customer_username TEXT NOT NULL,
+            good_name TEXT NOT NULL,
+            sale_date TEXT NOT NULL,
+            sale_amount REAL NOT NULL
+        )
+    """)
+    conn.executemany("INSERT INTO customers (username, wallet_balance) VALUES (?, ?)",
+                     [(f"customer{i}", float(max(1, stock // customers))) for i in range(customers)])
+    conn.execute("INSERT INTO goods (name, price_per_item, count_in_stock) VALUES ('Bench', 1.0, ?)", (stock,))
+    conn.commit()
+    conn.close()
+
+
+def run(sell, threads, customers, stock, attempts):
+    """
+    Runs one benchmark variant on a fresh scratch database.
+
+    Args:
+        sell (function): The sale function to benchmark.
+        threads (int): Number of concurrent threads.
+        customers (int): Number of customers the threads buy for, round robin.
+        stock (int): Initial stock count of the good.
+        attempts (int): Total number of sales attempted across all threads.
+
+    Returns:
+        dict: Throughput, outcome counts and the lowest wallet and stock values seen.
+    """
+    directory = tempfile.mkdtemp()
+    database = os.path.join(directory, 'bench.db')
+    create_bench_tables(database, customers, stock)
+    service3.db_pool = ConnectionPool.from_profile(database, 'service3', size=threads)
+
+    outcomes = {"ok": 0, "refused": 0, "error": 0}
+    lock = threading.Lock()
+    per_thread = attempts // threads
+
+    def worker(offset):
+        for i in range(per_thread):
+            status = sell(f"customer{(offset + i) % customers}", 'Bench')["status"]
+            key = "ok" if status == "Sale successful" else (
+                "refused" if status == "Insufficient funds or item not available for sale" else "error")
+            with lock:
+                outcomes[key] += 1
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    conn = sqlite3.connect(database)
+    outcomes["min_wallet"] = conn.execute("SELECT MIN(wallet_balance) FROM customers").fetchone()[0]
+    outcomes["final_stock"] = conn.execute("SELECT count_in_stock FROM goods").fetchone()[0]
+    outcomes["sales_rows"] = conn.execute("SELECT COUNT(*) FROM sales").fetchone()[0]
+    conn.close()
+    outcomes["per_second"] = (per_thread * threads) / elapsed
+    service3.db_pool.close_all()
+    shutil.rmtree(directory)
+    return outcomes
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--customers", type=int, default=4)
+    parser.add_argument("--stock", type=int, default=2000)
+    parser.add_argument("--attempts", type=int, default=4000)
+    args = parser.parse_args()
+
+    for label, sell in (("select+write", legacy_make_sale), ("guarded transaction", service3.make_sale)):
+        result = run(sell, args.threads, args.customers, args.stock, args.attempts)
+        print(f"{label:>20}: {result['per_second']:8.0f} sales/s, ok={result['ok']} "
+              f"refused={result['refused']} error={result['error']} sales_rows={result['sales_rows']} "
+              f"final_stock={result['final_stock']} min_wallet={result['min_wallet']}")
@@ -0,0 +1,46 @@
+#!/usr/bin/python
+"""
+Sales archival job for the Sales Management API.
+
+This script is meant to be run from cron next to the service, e.g. once a month. It moves
+every closed month of sales older than the hot window out of the 'sales' table into one
+read-only archive file per month, so the live table, its indexes and the database backups
+only carry recent history. `get_customer_sales` still returns the full history by
+attaching the archives it needs.
+
+Usage:
+    python sales_archive.py
+    python sales_archive.py --hot-months 6 --vacuum
+"""
+
+import argparse
+import sqlite3
+import sys
+
+import service3
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--hot-months", type=int, default=service3.SALES_HOT_MONTHS,
+                        help="number of most recent months kept in the live table")
+    parser.add_argument("--vacuum", action="store_true",
+                        help="compact the sales database after archiving to return the freed space")
+    args = parser.parse_args()
+
+    status = 0
+    archived = service3.archive_cold_sales(args.hot_months)
+    if archived is None:
+        status = 1
+    else:
+        print(f"Archived {len(archived)} months of sales")
+        if archived and args.vacuum:
+            conn = service3.connect_to_db()
+            try:
+                conn.execute("VACUUM")
+            except sqlite3.Error as e:
+                print(f"Error compacting the sales database: {e}")
+                status = 1
+            finally:
+                conn.close()
+    service3.db_pool.close_all()
+    sys.exit(status)
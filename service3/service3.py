@@ -13,38 +13,154 @@ Dependencies:
 """
 
 import sqlite3
-from flask import Flask, request, jsonify
+import json
+import os
+import sys
+import threading
+from contextlib import closing
+from datetime import datetime, timezone
+from urllib.request import pathname2url
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.cache import LRUCache
+from common.db_pool import ConnectionPool
+from common.http_client import ServiceClient, ServiceUnavailable, dependency_latency
+from common.idempotency import IdempotencyConflict, IdempotencyStore
+from common.migrations import (Migration, MigrationRunner, add_column_if_missing, create_index_if_missing,
+                               explain_query_plans, table_exists)
+from common.storage import get_env_setting
+from common.streaming import NDJSON_MIMETYPE, iter_cursor_ndjson, wants_ndjson
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
 
+DATABASE = 'sales_database.db'
+
+# Responses of successful sales, replayed when a client retries with the same Idempotency-Key
+idempotency_store = IdempotencyStore(ttl=int(get_env_setting('service3', 'IDEMPOTENCY_TTL') or 86400))
+
+# Read-through cache of get_good_details, invalidated when a sale changes a good's stock
+goods_cache = LRUCache(maxsize=int(get_env_setting('service3', 'GOODS_CACHE_SIZE') or 4096),
+                       ttl=float(get_env_setting('service3', 'GOODS_CACHE_TTL') or 30))
+
+# Upper bound on the number of distinct goods accepted by a single checkout
+MAX_CHECKOUT_LINES = 500
+
+# Schema changes applied by create_db_table, in version order; never edit an applied entry
+MIGRATIONS = [
+    Migration(1, "Index sales by customer_username", [
+        "CREATE INDEX IF NOT EXISTS idx_sales_customer_username ON sales (customer_username)",
+    ]),
+    Migration(2, "Index goods by name unless it is already the key",
+              lambda conn: create_index_if_missing(conn, 'idx_goods_name', 'goods', ['name'])),
+    Migration(3, "Roll sales up by day, good and customer", lambda conn: create_sales_rollups(conn)),
+    Migration(4, "Catalog the monthly sales archives", [
+        '''
+        CREATE TABLE IF NOT EXISTS sales_archives (
+            month TEXT PRIMARY KEY NOT NULL,
+            archive_file TEXT NOT NULL,
+            sale_count INTEGER NOT NULL,
+            archived_at TEXT NOT NULL
+        )
+        ''',
+    ]),
+    Migration(5, "Store sale times as integer epoch milliseconds indexed per customer",
+              lambda conn: add_sale_timestamps(conn)),
+    Migration(6, "Track the goods replica fed by the inventory change feed", lambda conn: create_goods_replica(conn)),
+    Migration(7, "Count the units sold here apart from the replicated stock",
+              lambda conn: add_column_if_missing(conn, 'goods', 'reserved_count', 'INTEGER NOT NULL DEFAULT 0')),
+    Migration(8, "Drop the text sale dates, derived from sale_ts from now on", lambda conn: drop_sale_dates(conn)),
+    Migration(9, "Track the units sold here until the inventory feed reflects them",
+              lambda conn: create_stock_reservations(conn)),
+]
+
+# Sales only store their time as 'sale_ts' epoch milliseconds; the 'YYYY-MM-DD HH:MM:SS'
+# UTC text of the responses, as SQLite's datetime('now') writes it, is derived from it
+SALE_DATE_SQL = "strftime('%Y-%m-%d %H:%M:%S', sale_ts / 1000, 'unixepoch')"
+SALE_COLUMNS = f"sale_id, customer_username, good_name, {SALE_DATE_SQL} AS sale_date, sale_ts, sale_amount"
+
+# The local 'goods' table is a replica of the inventory service's goods, refreshed from its
+# change feed every GOODS_REFRESH_INTERVAL seconds. GOOD_COLUMNS are the columns shown to
+# clients; the replica's bookkeeping columns stay internal
+GOOD_COLUMNS = "name, price_per_item, count_in_stock"
+GOODS_REFRESH_INTERVAL = float(get_env_setting('service3', 'GOODS_REFRESH_INTERVAL') or 5)
+GOODS_FEED_PAGE_SIZE = 500
+
+# Pooled keep-alive client of the inventory service, with timeouts, retries and a circuit breaker
+inventory_client = ServiceClient(
+    'inventory', get_env_setting('service3', 'INVENTORY_URL') or 'http://localhost:5001',
+    connect_timeout=float(get_env_setting('service3', 'INVENTORY_CONNECT_TIMEOUT') or 0.5),
+    read_timeout=float(get_env_setting('service3', 'INVENTORY_READ_TIMEOUT') or 2.0))
+
+# Closed months older than the SALES_HOT_MONTHS most recent ones are moved out of the
+# 'sales' table into one read-only archive file per month, kept in SALES_ARCHIVE_DIR.
+# The hot months share the live table; only the archives are split per month
+SALES_ARCHIVE_DIR = get_env_setting('service3', 'SALES_ARCHIVE_DIR') or 'sales_archive'
+SALES_HOT_MONTHS = int(get_env_setting('service3', 'SALES_HOT_MONTHS') or 3)
+
+# Page sizes of the reports read from the sales rollups
+DEFAULT_REPORT_SIZE = 100
+MAX_REPORT_SIZE = 1000
+migration_runner = MigrationRunner(MIGRATIONS)
+
+# Hot queries whose plans are reported at startup, with sample parameters
+HOT_QUERIES = {
+    "get_customer_sales": ("SELECT * FROM sales WHERE customer_username = ? AND sale_ts >= ? AND sale_ts < ? "
+                           "ORDER BY sale_ts, sale_id", ('username', 0, 1)),
+    "get_good_details": (f"SELECT {GOOD_COLUMNS} FROM goods WHERE name = ?", ('name',)),
+    "make_sale_wallet": ("SELECT wallet_balance FROM customers WHERE username = ?", ('username',)),
+}
+
+# Connections are borrowed from a shared pool configured by the service's storage profile
+db_pool = ConnectionPool.from_profile(DATABASE, 'service3', size=8)
+
 def connect_to_db():
     """
-    Establishes a connection to the SQLite database.
+    Borrows a connection to the SQLite database from the service's connection pool.
+
+    Inside a request the same connection is returned to every caller, so chained calls
+    share one connection and one transaction.
 
     Returns:
-        sqlite3.Connection: A connection object to the 'sales_database.db' SQLite database.
+        PooledConnection: A pooled connection to the 'sales_database.db' SQLite database.
+    """
+    return db_pool.connect()
+
+def invalidate_good(good_name):
+    """
+    Drops a good from the read-through cache after its row was written.
+
+    The entry is dropped right away and again once the write is committed, so a
+    concurrent reader cannot cache the pre-commit row.
+
+    Args:
+        good_name (str): The name of the written good.
     """
-    conn = sqlite3.connect('sales_database.db')
-    return conn
+    goods_cache.invalidate(good_name)
+    db_pool.after_commit(lambda: goods_cache.invalidate(good_name))
 
 def create_db_table():
     """
     Creates the 'sales' table in the SQLite database.
 
-    The table includes fields for sale ID, customer username, good name, sale date, and sale amount.
-    If the table already exists, an error message is printed.
+    The table includes fields for sale ID, customer username, good name, sale time (epoch
+    milliseconds), and sale amount.
+    If the table already exists, an error message is printed. The idempotency key table is
+    created alongside it if missing, and the pending schema migrations are applied.
 
     Returns:
         None
     """
     try:
         conn = connect_to_db()
-        
+        idempotency_store.create_table(conn)
+        conn.commit()
+
         conn.execute('''
             CREATE TABLE sales (
                 sale_id INTEGER PRIMARY KEY NOT NULL,
                 customer_username TEXT NOT NULL,
                 good_name TEXT NOT NULL,
-                sale_date TEXT NOT NULL,
+                sale_ts INTEGER NOT NULL,
                 sale_amount REAL NOT NULL
             );
         ''')
@@ -54,6 +170,721 @@ def create_db_table():
         print("Sales table creation failed - Maybe table already exists")
     finally:
         conn.close()
+    migrate_db()
+
+def migrate_db():
+    """
+    Brings the database schema up to date by applying the pending entries of `MIGRATIONS`.
+
+    Returns:
+        int: The schema version after migrating, or None if a migration failed.
+    """
+    try:
+        conn = connect_to_db()
+        return migration_runner.migrate(conn)
+    except sqlite3.Error as e:
+        print(f"Error migrating the sales database: {e}")
+        return None
+    finally:
+        conn.close()
+
+def report_query_plans():
+    """
+    Prints the query plan of every entry of `HOT_QUERIES`, marking full table scans.
+
+    Returns:
+        dict: Maps each query name to its plan and whether it scans the whole table.
+    """
+    conn = connect_to_db()
+    try:
+        return explain_query_plans(conn, HOT_QUERIES)
+    finally:
+        conn.close()
+
+def create_sales_rollups(conn):
+    """
+    Creates the sales rollup tables and fills them from the existing sales.
+
+    'sales_daily_revenue', 'sales_by_good' and 'sales_by_customer' hold running totals of
+    the 'sales' table per day, good and customer. `make_sale` and `checkout` add every new
+    sale to them in the sale's own transaction (see `record_sale_rollups`), so the
+    reports never scan the sales table.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the sales database.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sales_daily_revenue (
+            day TEXT PRIMARY KEY NOT NULL,
+            sale_count INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0
+        );
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sales_by_good (
+            good_name TEXT PRIMARY KEY NOT NULL,
+            units_sold INTEGER NOT NULL DEFAULT 0,
+            revenue REAL NOT NULL DEFAULT 0
+        );
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS sales_by_customer (
+            customer_username TEXT PRIMARY KEY NOT NULL,
+            sale_count INTEGER NOT NULL DEFAULT 0,
+            lifetime_spend REAL NOT NULL DEFAULT 0,
+            last_sale_date TEXT
+        );
+    ''')
+    if not table_exists(conn, 'sales'):
+        return
+    # Databases older than sale_ts still hold the text dates when this runs
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(sales)")]
+    sale_date = 'sale_date' if 'sale_date' in columns else SALE_DATE_SQL
+    conn.execute(f'''
+        INSERT OR REPLACE INTO sales_daily_revenue
+        SELECT date({sale_date}), COUNT(*), SUM(sale_amount) FROM sales GROUP BY date({sale_date})
+    ''')
+    conn.execute('''
+        INSERT OR REPLACE INTO sales_by_good
+        SELECT good_name, COUNT(*), SUM(sale_amount) FROM sales GROUP BY good_name
+    ''')
+    conn.execute(f'''
+        INSERT OR REPLACE INTO sales_by_customer
+        SELECT customer_username, COUNT(*), SUM(sale_amount), MAX({sale_date}) FROM sales GROUP BY customer_username
+    ''')
+
+def record_sale_rollups(cur, customer_username, sale_ts, lines):
+    """
+    Adds newly recorded sales to the rollup tables.
+
+    It must run in the transaction that inserted the sales rows, so the rollups and the
+    sales table are committed or rolled back together.
+
+    Args:
+        cur (sqlite3.Cursor): Cursor of the sale's transaction.
+        customer_username (str): The buying customer.
+        sale_ts (int): The sale time recorded on the sales rows, in epoch milliseconds.
+        lines (list): A list of (good_name, units, amount) tuples, where `amount` is the
+            total paid for the units.
+    """
+    units = sum(line[1] for line in lines)
+    total = sum(line[2] for line in lines)
+    sale_date = format_sale_date(sale_ts)
+    cur.execute("INSERT OR IGNORE INTO sales_daily_revenue (day) VALUES (?)", (sale_date[:10],))
+    cur.execute("UPDATE sales_daily_revenue SET sale_count = sale_count + ?, revenue = revenue + ? WHERE day = ?",
+                (units, total, sale_date[:10]))
+    cur.executemany("INSERT OR IGNORE INTO sales_by_good (good_name) VALUES (?)",
+                    [(good_name,) for good_name, _, _ in lines])
+    cur.executemany("UPDATE sales_by_good SET units_sold = units_sold + ?, revenue = revenue + ? WHERE good_name = ?",
+                    [(count, amount, good_name) for good_name, count, amount in lines])
+    cur.execute("INSERT OR IGNORE INTO sales_by_customer (customer_username) VALUES (?)", (customer_username,))
+    cur.execute("""
+        UPDATE sales_by_customer
+        SET sale_count = sale_count + ?, lifetime_spend = lifetime_spend + ?, last_sale_date = ?
+        WHERE customer_username = ?
+    """, (units, total, sale_date, customer_username))
+
+def sale_timestamp():
+    """
+    Returns:
+        int: The current time in epoch milliseconds, as stored in 'sale_ts'.
+    """
+    return int(datetime.now(timezone.utc).timestamp() * 1000)
+
+def format_sale_date(sale_ts):
+    """
+    Formats a sale time like `SALE_DATE_SQL` does.
+
+    Args:
+        sale_ts (int): The sale time in epoch milliseconds.
+
+    Returns:
+        str: The 'YYYY-MM-DD HH:MM:SS' UTC text of the time.
+    """
+    return datetime.fromtimestamp(sale_ts // 1000, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+def month_range(month):
+    """
+    Returns:
+        tuple: The (start, end) epoch milliseconds of a 'YYYY-MM' month in UTC, the end
+            being the start of the next month.
+    """
+    year, number = int(month[:4]), int(month[5:7])
+    start = datetime(year, number, 1, tzinfo=timezone.utc)
+    end = datetime(year + number // 12, number % 12 + 1, 1, tzinfo=timezone.utc)
+    return int(start.timestamp() * 1000), int(end.timestamp() * 1000)
+
+def add_sale_timestamps(conn):
+    """
+    Adds the integer 'sale_ts' column to the sales, fills it from 'sale_date' and indexes it
+    per customer.
+
+    'sale_ts' holds the sale time in epoch milliseconds, so date ranges compare integers
+    and a (customer_username, sale_ts) index serves them as range scans. It supersedes the
+    single-column customer index. The text 'sale_date' is dropped later, see
+    `drop_sale_dates`. The archives already cataloged are upgraded the same way, so every
+    source of the query router has the column.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the sales database.
+    """
+    add_sale_ts_column(conn)
+    for (archive_file,) in conn.execute("SELECT archive_file FROM sales_archives").fetchall():
+        path = os.path.join(SALES_ARCHIVE_DIR, archive_file)
+        if not os.path.exists(path):
+            continue
+        os.chmod(path, 0o644)
+        archive = sqlite3.connect(path)
+        try:
+            add_sale_ts_column(archive)
+            archive.commit()
+        finally:
+            archive.close()
+            os.chmod(path, 0o444)
+
+def add_sale_ts_column(conn):
+    """
+    Adds, fills and indexes the 'sale_ts' column of the 'sales' table of one database file.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the sales database or to an archive.
+    """
+    if not table_exists(conn, 'sales'):
+        return
+    add_column_if_missing(conn, 'sales', 'sale_ts', 'INTEGER')
+    if 'sale_date' in [row[1] for row in conn.execute("PRAGMA table_info(sales)")]:
+        conn.execute("""
+            UPDATE sales SET sale_ts = CAST(strftime('%s', sale_date) AS INTEGER) * 1000
+            WHERE sale_ts IS NULL
+        """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sales_customer_ts ON sales (customer_username, sale_ts)")
+    conn.execute("DROP INDEX IF EXISTS idx_sales_customer_username")
+
+def drop_sale_dates(conn):
+    """
+    Rebuilds the 'sales' table without its text 'sale_date' column.
+
+    Every row then stores its time once, as the 8-byte 'sale_ts' integer, and the text
+    date is derived with `SALE_DATE_SQL` where it is returned. SQLite cannot drop a
+    NOT NULL column in place on every supported version, so the rows are copied into a
+    new table. The read-only archives keep their text column, which is no longer read.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the sales database.
+    """
+    if not table_exists(conn, 'sales'):
+        return
+    if 'sale_date' not in [row[1] for row in conn.execute("PRAGMA table_info(sales)")]:
+        return
+    conn.execute('''
+        CREATE TABLE sales_rebuilt (
+            sale_id INTEGER PRIMARY KEY NOT NULL,
+            customer_username TEXT NOT NULL,
+            good_name TEXT NOT NULL,
+            sale_ts INTEGER NOT NULL,
+            sale_amount REAL NOT NULL
+        );
+    ''')
+    conn.execute("""
+        INSERT INTO sales_rebuilt (sale_id, customer_username, good_name, sale_ts, sale_amount)
+        SELECT sale_id, customer_username, good_name,
+               IFNULL(sale_ts, CAST(strftime('%s', sale_date) AS INTEGER) * 1000), sale_amount
+        FROM sales
+    """)
+    conn.execute("DROP TABLE sales")
+    conn.execute("ALTER TABLE sales_rebuilt RENAME TO sales")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_sales_customer_ts ON sales (customer_username, sale_ts)")
+
+def archive_uri(path):
+    """
+    Returns:
+        str: The 'file:' URI opening a sales archive read-only. SQLite then refuses every
+            write to it, whatever the file's permissions or the user running the service.
+    """
+    return f"file:{pathname2url(os.path.abspath(path))}?mode=ro"
+
+def iter_sales_sources(conn, start_month=None, end_month=None):
+    """
+    Routes a sales query to the archives and the live table holding the requested months.
+
+    Each archive file is attached read-only (see `archive_uri`) and only while the
+    caller reads it, so a query never holds more than one archive open. Iterate it inside
+    `contextlib.closing` so an archive is detached even if the caller stops early.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the sales database, opened with URI
+            filenames enabled and outside a transaction.
+        start_month (str, optional): First month needed, as 'YYYY-MM'. Defaults to the oldest.
+        end_month (str, optional): Last month needed, as 'YYYY-MM'. Defaults to the newest.
+
+    Yields:
+        str: The schema-qualified name of each sales table to query, oldest months first;
+            the live 'main.sales' table always comes last.
+
+    Raises:
+        sqlite3.OperationalError: If a cataloged archive file is missing, rather than
+            silently returning a partial history.
+    """
+    archives = conn.execute("""
+        SELECT archive_file FROM sales_archives WHERE month >= ? AND month <= ? ORDER BY month
+    """, (start_month or '', end_month or '9999-12')).fetchall()
+    for (archive_file,) in archives:
+        path = os.path.join(SALES_ARCHIVE_DIR, archive_file)
+        if not os.path.exists(path):
+            raise sqlite3.OperationalError(f"Sales archive missing: {path}")
+        conn.execute("ATTACH DATABASE ? AS sales_archive", (archive_uri(path),))
+        try:
+            yield "sales_archive.sales"
+        finally:
+            conn.execute("DETACH DATABASE sales_archive")
+    yield "main.sales"
+
+def archive_sales_month(month):
+    """
+    Moves the sales of one month out of the 'sales' table into a read-only archive file.
+
+    The rows are copied into a new database file in SALES_ARCHIVE_DIR, with its own
+    customer index, and deleted from 'sales' in the same transaction that catalogs the
+    archive in 'sales_archives'. The catalog is the source of truth: a file left behind by
+    an interrupted run is not cataloged, so it is never read and is replaced on the next run.
+
+    Args:
+        month (str): The month to archive, as 'YYYY-MM'.
+
+    Returns:
+        int: The number of sales archived, 0 if the month was already archived, or None if
+            an error occurs.
+    """
+    year, number = int(month[:4]), int(month[5:7])
+    start, end = month_range(month)
+    archive_file = f"sales_{year:04d}_{number:02d}.db"
+    path = os.path.join(SALES_ARCHIVE_DIR, archive_file)
+    archived = None
+    try:
+        conn = connect_to_db()
+        if conn.execute("SELECT 1 FROM sales_archives WHERE month = ?", (month,)).fetchone():
+            return 0
+        os.makedirs(SALES_ARCHIVE_DIR, exist_ok=True)
+        if os.path.exists(path):
+            os.chmod(path, 0o644)
+            os.remove(path)
+        columns = conn.execute("PRAGMA table_info(sales)").fetchall()
+        definitions = ", ".join(f"{column[1]} {column[2]}{' NOT NULL' if column[3] else ''}"
+                                f"{' PRIMARY KEY' if column[5] else ''}" for column in columns)
+        conn.execute("ATTACH DATABASE ? AS sales_archive_new", (path,))
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(f"CREATE TABLE sales_archive_new.sales ({definitions})")
+            cur = conn.execute("""
+                INSERT INTO sales_archive_new.sales SELECT * FROM main.sales WHERE sale_ts >= ? AND sale_ts < ?
+            """, (start, end))
+            archived = cur.rowcount
+            conn.execute("CREATE INDEX sales_archive_new.idx_sales_customer_ts ON sales (customer_username, sale_ts)")
+            conn.execute("""
+                INSERT INTO main.sales_archives (month, archive_file, sale_count, archived_at)
+                VALUES (?, ?, ?, datetime('now'))
+            """, (month, archive_file, archived))
+            conn.execute("DELETE FROM main.sales WHERE sale_ts >= ? AND sale_ts < ?", (start, end))
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+        finally:
+            conn.execute("DETACH DATABASE sales_archive_new")
+        os.chmod(path, 0o444)
+        print(f"Archived {archived} sales of {month} to {path}")
+    except (sqlite3.Error, OSError) as e:
+        print(f"Error archiving the sales of {month}: {e}")
+        archived = None
+    finally:
+        conn.close()
+    return archived
+
+def archive_cold_sales(hot_months=SALES_HOT_MONTHS, now=None):
+    """
+    Archives every month of sales older than the `hot_months` most recent ones.
+
+    The month of the newest sale is never archived, even when it is cold, so the live
+    table always keeps the highest sale_id and new sales never reuse an archived id.
+
+    Args:
+        hot_months (int): Number of most recent months, including the current one, kept
+            in the live table. Must be at least 1.
+        now (datetime, optional): The current time. Defaults to now, in UTC.
+
+    Returns:
+        list: The archived months, as 'YYYY-MM', or None if an error occurs.
+    """
+    now = now or datetime.now(timezone.utc)
+    first_hot = now.year * 12 + now.month - 1 - (max(hot_months, 1) - 1)
+    cutoff = month_range(f"{first_hot // 12:04d}-{first_hot % 12 + 1:02d}")[0]
+    month_sql = "strftime('%Y-%m', sale_ts / 1000, 'unixepoch')"
+    try:
+        conn = connect_to_db()
+        months = [row[0] for row in conn.execute(
+            f"SELECT DISTINCT {month_sql} FROM sales WHERE sale_ts < ? ORDER BY 1", (cutoff,))]
+        newest = conn.execute(f"SELECT {month_sql} FROM sales ORDER BY sale_id DESC LIMIT 1").fetchone()
+    except sqlite3.Error as e:
+        print(f"Error listing cold sales months: {e}")
+        return None
+    finally:
+        conn.close()
+    archived = []
+    for month in months:
+        if newest and month == newest[0]:
+            continue
+        if archive_sales_month(month) is None:
+            return None
+        archived.append(month)
+    return archived
+
+def create_goods_replica(conn):
+    """
+    Prepares the 'goods' table to be a replica of the inventory service's goods.
+
+    Each replicated row records the inventory 'source_good_id' it mirrors, so renames and
+    deletions find their row. 'replica_state' stores the sequence number of the last
+    change applied, which is committed together with the rows it describes.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the sales database.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS goods (
+            name TEXT PRIMARY KEY NOT NULL,
+            price_per_item REAL NOT NULL,
+            count_in_stock INTEGER NOT NULL
+        );
+    ''')
+    add_column_if_missing(conn, 'goods', 'source_good_id', 'INTEGER')
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_goods_source_good_id ON goods (source_good_id)")
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS replica_state (
+            feed TEXT PRIMARY KEY NOT NULL,
+            last_seq INTEGER NOT NULL,
+            refreshed_at TEXT
+        );
+    ''')
+    conn.execute("INSERT OR IGNORE INTO replica_state (feed, last_seq) VALUES ('goods', 0)")
+
+def fetch_goods_changes(after_seq, limit=GOODS_FEED_PAGE_SIZE):
+    """
+    Reads one page of the inventory service's goods change feed.
+
+    Args:
+        after_seq (int): Sequence number of the last change applied.
+        limit (int): Maximum number of changes to read.
+
+    Returns:
+        dict: The feed page, with the 'changes', the 'last_seq' and 'has_more'.
+
+    Raises:
+        ServiceUnavailable: If the inventory service cannot be reached or refuses the read.
+        ValueError: If its answer is not valid JSON.
+    """
+    response = inventory_client.get('/api/goods/changes', params={'after_seq': int(after_seq), 'limit': int(limit)})
+    if response.status != 200:
+        raise ServiceUnavailable(f"inventory answered HTTP {response.status} to the change feed read")
+    return response.json()
+
+def apply_goods_changes(cur, changes):
+    """
+    Applies goods change feed entries to the local 'goods' table.
+
+    An 'upsert' updates the row mirroring the inventory good, adopts a local row of the
+    same name that mirrors nothing yet, or inserts a new row. The inventory service is
+    authoritative for the price and the stock. Units sold here are held in
+    'stock_reservations' until the feed reflects them: a reservation pushed to the
+    inventory service (see `push_stock_reservations`) is settled by the first change of
+    the good whose sequence number is at least the one its deduction produced. Each
+    row keeps the stock the feed delivered as 'replicated_stock', and 'reserved_count'
+    sums the reservations still pending; the stock on sale is their difference, so a
+    refresh neither puts sold units back on sale nor keeps subtracting sales the
+    inventory already counted.
+
+    Args:
+        cur (sqlite3.Cursor): Cursor of the refresh transaction.
+        changes (list): Feed entries, in sequence order.
+
+    Returns:
+        set: The names of the goods written, to invalidate in the goods cache.
+    """
+    written = set()
+    for change in changes:
+        cur.execute("SELECT name FROM goods WHERE source_good_id = ?", (change['good_id'],))
+        row = cur.fetchone()
+        if row:
+            written.add(row[0])
+        try:
+            if change['operation'] == 'delete':
+                cur.execute("DELETE FROM goods WHERE source_good_id = ?", (change['good_id'],))
+                cur.execute("DELETE FROM stock_reservations WHERE source_good_id = ?", (change['good_id'],))
+                continue
+            written.add(change['name'])
+            values = (change['name'], change['price'], change['stock_count'], change['good_id'])
+            if row:
+                # Settle the reservations whose deduction this change already carries
+                settled = (change['good_id'], change['seq'])
+                cur.execute("""
+                    SELECT IFNULL(SUM(quantity), 0) FROM stock_reservations
+                    WHERE source_good_id = ? AND settled_seq <= ?
+                """, settled)
+                reflected = cur.fetchone()[0]
+                if reflected:
+                    cur.execute("DELETE FROM stock_reservations WHERE source_good_id = ? AND settled_seq <= ?", settled)
+                cur.execute("""
+                    UPDATE goods SET name = ?, price_per_item = ?, replicated_stock = ?,
+                                     count_in_stock = MAX(? - (reserved_count - ?), 0),
+                                     reserved_count = reserved_count - ?
+                    WHERE source_good_id = ?
+                """, values[:3] + (change['stock_count'], reflected, reflected, change['good_id']))
+                continue
+            cur.execute("""
+                UPDATE goods SET name = ?, price_per_item = ?, replicated_stock = ?,
+                                 count_in_stock = MAX(? - reserved_count, 0), source_good_id = ?
+                WHERE name = ? AND source_good_id IS NULL
+            """, values[:3] + (change['stock_count'], change['good_id'], change['name']))
+            if cur.rowcount == 1:
+                # The local sales of an adopted row can now be pushed to its inventory good
+                cur.execute("""
+                    UPDATE stock_reservations SET source_good_id = ? WHERE good_name = ? AND source_good_id IS NULL
+                """, (change['good_id'], change['name']))
+            else:
+                cur.execute("""
+                    INSERT INTO goods (name, price_per_item, count_in_stock, source_good_id, replicated_stock)
+                    VALUES (?, ?, ?, ?, ?)
+                """, values + (change['stock_count'],))
+        except sqlite3.IntegrityError as e:
+            # Another inventory good already holds this name here; keep the replica moving
+            print(f"Skipped goods change {change['seq']} for '{change.get('name')}': {e}")
+    return written
+
+def refresh_goods_replica(fetch=fetch_goods_changes):
+    """
+    Brings the local goods replica up to date with the inventory service's change feed.
+
+    Pages are fetched after the last applied sequence number and each one is applied in
+    its own transaction together with the new sequence number, so an interrupted refresh
+    resumes where it stopped and no change is applied twice, even with two refreshers.
+
+    Args:
+        fetch (function): Returns the feed page after a sequence number; defaults to
+            reading the feed over HTTP.
+
+    Returns:
+        int: The number of changes applied, or None if the feed or the database failed.
+    """
+    applied = 0
+    try:
+        conn = connect_to_db()
+        cur = conn.cursor()
+        while True:
+            after_seq = cur.execute("SELECT last_seq FROM replica_state WHERE feed = 'goods'").fetchone()[0]
+            page = fetch(after_seq, GOODS_FEED_PAGE_SIZE)
+            cur.execute("BEGIN IMMEDIATE")
+            # Another refresher may have applied part of the page while this one fetched it
+            last_seq = cur.execute("SELECT last_seq FROM replica_state WHERE feed = 'goods'").fetchone()[0]
+            changes = [change for change in page['changes'] if change['seq'] > last_seq]
+            written = apply_goods_changes(cur, changes)
+            cur.execute("""
+                UPDATE replica_state SET last_seq = MAX(last_seq, ?), refreshed_at = datetime('now') WHERE feed = 'goods'
+            """, (page['last_seq'],))
+            conn.commit()
+            for name in written:
+                invalidate_good(name)
+            applied += len(changes)
+            if not page['has_more'] or not page['changes']:
+                break
+    except (ServiceUnavailable, ValueError, KeyError) as e:
+        print(f"Error reading the goods change feed: {e}")
+        return None
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Error refreshing the goods replica: {e}")
+        return None
+    finally:
+        conn.close()
+    return applied
+
+def create_stock_reservations(conn):
+    """
+    Creates the 'stock_reservations' table of units sold here that the inventory feed
+    does not reflect yet, seeded with the units already counted in 'reserved_count', and
+    the 'replicated_stock' column holding the last stock the feed delivered for a good.
+
+    A reservation is pending until `push_stock_reservations` deducts it from the
+    inventory service, which records the sequence number of the resulting feed change
+    as 'settled_seq'; `apply_goods_changes` drops it once that change is applied.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the sales database.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS stock_reservations (
+            reservation_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+            good_name TEXT NOT NULL,
+            source_good_id INTEGER,
+            quantity INTEGER NOT NULL,
+            settled_seq INTEGER
+        );
+    ''')
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_stock_reservations_source_good_id
+        ON stock_reservations (source_good_id, settled_seq)
+    """)
+    conn.execute("""
+        INSERT INTO stock_reservations (good_name, source_good_id, quantity)
+        SELECT name, source_good_id, reserved_count FROM goods WHERE reserved_count > 0
+    """)
+    add_column_if_missing(conn, 'goods', 'replicated_stock', 'INTEGER')
+    conn.execute("""
+        UPDATE goods SET replicated_stock = count_in_stock + reserved_count WHERE source_good_id IS NOT NULL
+    """)
+
+def reserve_stock(cur, lines):
+    """
+    Records units sold here as pending reservations of their goods.
+
+    The caller has already decremented 'count_in_stock' and incremented 'reserved_count'
+    in the same transaction.
+
+    Args:
+        cur (sqlite3.Cursor): Cursor of the sale's transaction.
+        lines (list): A list of (good_name, quantity) pairs.
+    """
+    cur.executemany("""
+        INSERT INTO stock_reservations (good_name, source_good_id, quantity)
+        SELECT name, source_good_id, ? FROM goods WHERE name = ?
+    """, [(quantity, good_name) for good_name, quantity in lines])
+
+def deduct_inventory_stock(good_id, quantity, idempotency_key):
+    """
+    Deducts units sold here from the inventory service's stock of a good.
+
+    The idempotency key lets the client retry the call, and a later push retry the
+    same reservation, without deducting twice.
+
+    Args:
+        good_id (int): The inventory service's ID of the good.
+        quantity (int): The number of units sold.
+        idempotency_key (str): Key identifying the reservation.
+
+    Returns:
+        tuple: The HTTP status of the inventory's answer and its JSON body, holding the
+            'seq' of the change carrying the new stock on success.
+
+    Raises:
+        ServiceUnavailable: If the inventory service cannot be reached or fails.
+        ValueError: If its answer is not valid JSON.
+    """
+    response = inventory_client.put(f'/api/goods/deduct/{int(good_id)}', json_body={'quantity': int(quantity)},
+                                    idempotency_key=idempotency_key)
+    if response.status >= 500:
+        raise ServiceUnavailable(f"inventory answered HTTP {response.status} to a stock deduction")
+    return response.status, response.json()
+
+def push_stock_reservations(deduct=deduct_inventory_stock):
+    """
+    Pushes the pending stock reservations to the inventory service.
+
+    Each reservation is deducted from the inventory stock of its good, then, under the
+    write lock, either records the sequence number of the resulting feed change, or is
+    released right away when the replica already applied that change (the sale was then
+    subtracted twice) or the inventory refused the deduction; a released good's stock
+    is recomputed from its 'replicated_stock'. Reservations of
+    local goods that mirror no inventory good stay pending.
+
+    Args:
+        deduct (function): Deducts a reservation from the inventory stock; defaults to
+            calling the inventory service over HTTP.
+
+    Returns:
+        int: The number of reservations pushed, or None if the inventory service or the
+            database failed; the remaining reservations are pushed on the next call.
+    """
+    pushed = 0
+    try:
+        conn = connect_to_db()
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT reservation_id, source_good_id, quantity FROM stock_reservations
+            WHERE settled_seq IS NULL AND source_good_id IS NOT NULL ORDER BY reservation_id
+        """)
+        for reservation_id, source_good_id, quantity in cur.fetchall():
+            status, answer = deduct(source_good_id, quantity, f"stock-reservation-{reservation_id}")
+            cur.execute("BEGIN IMMEDIATE")
+            last_seq = cur.execute("SELECT last_seq FROM replica_state WHERE feed = 'goods'").fetchone()[0]
+            if status == 200 and answer['seq'] > last_seq:
+                cur.execute("UPDATE stock_reservations SET settled_seq = ? WHERE reservation_id = ?",
+                            (answer['seq'], reservation_id))
+            else:
+                if status != 200:
+                    print(f"Inventory refused stock reservation {reservation_id}: {answer.get('status')}")
+                cur.execute("DELETE FROM stock_reservations WHERE reservation_id = ?", (reservation_id,))
+                cur.execute("""
+                    UPDATE goods SET count_in_stock = MAX(replicated_stock - (reserved_count - ?), 0),
+                                     reserved_count = reserved_count - ?
+                    WHERE source_good_id = ?
+                """, (quantity, quantity, source_good_id))
+                row = cur.execute("SELECT name FROM goods WHERE source_good_id = ?", (source_good_id,)).fetchone()
+                if row:
+                    invalidate_good(row[0])
+            conn.commit()
+            pushed += 1
+    except (ServiceUnavailable, ValueError, KeyError) as e:
+        conn.rollback()
+        print(f"Error pushing stock reservations to the inventory: {e}")
+        return None
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Error pushing stock reservations: {e}")
+        return None
+    finally:
+        conn.close()
+    return pushed
+
+def get_goods_replica_state():
+    """
+    Retrieves the progress of the goods replica.
+
+    Returns:
+        dict: The 'last_seq' applied and when the replica was last 'refreshed_at', or an
+            empty dictionary if an error occurs.
+    """
+    state = {}
+    try:
+        conn = connect_to_db()
+        conn.row_factory = sqlite3.Row
+        row = conn.execute("SELECT last_seq, refreshed_at FROM replica_state WHERE feed = 'goods'").fetchone()
+        state = dict(row) if row else {}
+    except sqlite3.Error as e:
+        print(f"Error reading the goods replica state: {e}")
+        state = {}
+    finally:
+        conn.close()
+    return state
+
+def start_goods_replica_refresher(interval=GOODS_REFRESH_INTERVAL):
+    """
+    Pushes the pending stock reservations and refreshes the goods replica every
+    `interval` seconds on a daemon thread.
+
+    Args:
+        interval (float): Seconds between two refreshes.
+
+    Returns:
+        threading.Event: Set it to stop the refresher.
+    """
+    stop = threading.Event()
+
+    def run():
+        while not stop.is_set():
+            push_stock_reservations()
+            refresh_goods_replica()
+            stop.wait(interval)
+
+    threading.Thread(target=run, name='goods-replica-refresher', daemon=True).start()
+    return stop
 
 def display_available_goods():
     """
@@ -82,7 +913,8 @@ def display_available_goods():
 
 def get_good_details(good_name):
     """
-    Retrieves detailed information about a specific good by its name.
+    Retrieves detailed information about a specific good by its name, through the
+    read-through goods cache.
 
     Args:
         good_name (str): The name of the good to retrieve details for.
@@ -90,15 +922,21 @@ def get_good_details(good_name):
     Returns:
         dict: A dictionary containing all details of the good if found, otherwise an empty dictionary.
     """
+    cached = goods_cache.get(good_name)
+    if cached is not None:
+        return dict(cached)
+    generation = goods_cache.generation()
     good = {}
     try:
         conn = connect_to_db()
         conn.row_factory = sqlite3.Row
         cur = conn.cursor()
-        cur.execute("SELECT * FROM goods WHERE name = ?", (good_name,))
+        cur.execute(f"SELECT {GOOD_COLUMNS} FROM goods WHERE name = ?", (good_name,))
         row = cur.fetchone()
         if row:
             good = dict(row)
+            if not conn.in_transaction:
+                goods_cache.set(good_name, dict(good), generation)
     except sqlite3.Error as e:
         print(f"Error fetching good details for '{good_name}': {e}")
         good = {}
@@ -106,55 +944,87 @@ def get_good_details(good_name):
         conn.close()
     return good
 
-def make_sale(customer_username, good_name):
+def make_sale(customer_username, good_name, idempotency_key=None):
     """
     Processes a sale by deducting the item's price from the customer's wallet and decreasing the stock count.
 
+    The sale runs as one guarded transaction: BEGIN IMMEDIATE takes the write lock up
+    front, and the wallet and stock UPDATEs only match when the balance covers the price
+    and the good is in stock, so concurrent sales can neither overdraw a wallet nor sell
+    stock that is gone. The customer and the good are only looked up separately when
+    the sale is refused, to report why.
+
+    When an idempotency key is given and a sale with that key already succeeded, the
+    stored result is returned without touching the wallet, goods or sales tables.
+
     Args:
         customer_username (str): The username of the customer making the purchase.
         good_name (str): The name of the good being purchased.
+        idempotency_key (str, optional): Client-chosen key identifying this sale across retries.
 
     Returns:
-        dict: A message indicating the result of the sale operation.
+        dict: A message indicating the result of the sale operation. A replayed result
+            carries 'replayed': True.
     """
     sale_result = {}
     try:
         conn = connect_to_db()
-        conn.row_factory = sqlite3.Row
         cur = conn.cursor()
+        if not conn.in_transaction:
+            cur.execute("BEGIN IMMEDIATE")
+
+        if idempotency_key:
+            fingerprint = idempotency_store.fingerprint(customer_username, good_name)
+            stored = idempotency_store.lookup(cur, 'make_sale', idempotency_key, fingerprint)
+            if stored is not None:
+                conn.rollback()
+                stored["replayed"] = True
+                return stored
 
-        # Check if the customer has enough money in the wallet
-        cur.execute("SELECT wallet_balance FROM customers WHERE username = ?", (customer_username,))
-        wallet_row = cur.fetchone()
-        if not wallet_row:
-            sale_result["status"] = "Customer not found."
-            return sale_result
-        wallet_balance = wallet_row["wallet_balance"]
-
-        # Check if the good exists and has sufficient stock
-        cur.execute("SELECT price_per_item, count_in_stock FROM goods WHERE name = ?", (good_name,))
-        good_row = cur.fetchone()
-        if not good_row:
-            sale_result["status"] = "Good not found."
-            return sale_result
-
-        price = good_row["price_per_item"]
-        stock = good_row["count_in_stock"]
-
-        if wallet_balance >= price and stock > 0:
-            # Deduct money from the customer's wallet
-            cur.execute("UPDATE customers SET wallet_balance = wallet_balance - ? WHERE username = ?", (price, customer_username))
-            # Decrease the count of the purchased good from the database
-            cur.execute("UPDATE goods SET count_in_stock = count_in_stock - 1 WHERE name = ?", (good_name,))
-            # Record the sale in the sales table
+        # Deduct money from the customer's wallet, only if it covers the price of an in-stock good
+        cur.execute("""
+            UPDATE customers
+            SET wallet_balance = wallet_balance - (SELECT price_per_item FROM goods WHERE name = ?)
+            WHERE username = ?
+              AND wallet_balance >= (SELECT price_per_item FROM goods WHERE name = ? AND count_in_stock > 0)
+        """, (good_name, customer_username, good_name))
+        if cur.rowcount == 1:
+            # Decrease the count of the purchased good; the write lock keeps the stock check valid.
+            # The unit is also reserved until the inventory feed reflects the sale
             cur.execute("""
-                INSERT INTO sales (customer_username, good_name, sale_date, sale_amount)
-                VALUES (?, ?, datetime('now'), ?)
-            """, (customer_username, good_name, price))
-            conn.commit()
+                UPDATE goods SET count_in_stock = count_in_stock - 1, reserved_count = reserved_count + 1
+                WHERE name = ? AND count_in_stock > 0
+            """, (good_name,))
+            reserve_stock(cur, [(good_name, 1)])
+            # Record the sale in the sales table and the rollups
+            cur.execute("SELECT price_per_item FROM goods WHERE name = ?", (good_name,))
+            price = cur.fetchone()[0]
+            sale_ts = sale_timestamp()
+            cur.execute("""
+                INSERT INTO sales (customer_username, good_name, sale_ts, sale_amount)
+                VALUES (?, ?, ?, ?)
+            """, (customer_username, good_name, sale_ts, price))
+            record_sale_rollups(cur, customer_username, sale_ts, [(good_name, 1, price)])
             sale_result["status"] = "Sale successful"
+            if idempotency_key:
+                idempotency_store.save(cur, 'make_sale', idempotency_key, fingerprint, sale_result)
+            conn.commit()
+            invalidate_good(good_name)
         else:
-            sale_result["status"] = "Insufficient funds or item not available for sale"
+            conn.rollback()
+            cur.execute("SELECT 1 FROM customers WHERE username = ?", (customer_username,))
+            if not cur.fetchone():
+                sale_result["status"] = "Customer not found."
+            else:
+                cur.execute("SELECT 1 FROM goods WHERE name = ?", (good_name,))
+                if not cur.fetchone():
+                    sale_result["status"] = "Good not found."
+                else:
+                    sale_result["status"] = "Insufficient funds or item not available for sale"
+    except IdempotencyConflict as e:
+        conn.rollback()
+        sale_result["status"] = str(e)
+        sale_result["conflict"] = True
     except sqlite3.Error as e:
         conn.rollback()
         print(f"Error processing sale for '{customer_username}' and '{good_name}': {e}")
@@ -163,15 +1033,136 @@ def make_sale(customer_username, good_name):
         conn.close()
     return sale_result
 
-def get_customer_sales(customer_username):
+def checkout(customer_username, items):
+    """
+    Sells several goods to a customer in one guarded transaction.
+
+    The prices and stock of all goods are read with a single lookup, the wallet is
+    debited once for the total, every stock row is decremented with one `executemany`
+    and the sales rows (one per unit sold, as `make_sale` records them) are inserted
+    with another. Nothing is written unless the whole cart can be sold.
+
+    Args:
+        customer_username (str): The username of the customer making the purchase.
+        items (list): A list of (good_name, quantity) pairs. Quantities must be positive
+            integers; lines for the same good are merged.
+
+    Returns:
+        dict: A message indicating the result of the checkout. On success it also holds
+            the 'total' charged and the sold 'items'; on a refused line it names the
+            'good_name' at fault.
+    """
+    result = {}
+    quantities = {}
+    for good_name, quantity in items:
+        quantities[good_name] = quantities.get(good_name, 0) + quantity
+    try:
+        conn = connect_to_db()
+        conn.row_factory = sqlite3.Row
+        cur = conn.cursor()
+        if not conn.in_transaction:
+            cur.execute("BEGIN IMMEDIATE")
+
+        names = list(quantities)
+        placeholders = ", ".join("?" for _ in names)
+        cur.execute(f"SELECT name, price_per_item, count_in_stock FROM goods WHERE name IN ({placeholders})", names)
+        goods = {row["name"]: row for row in cur.fetchall()}
+        for good_name in names:
+            if good_name not in goods:
+                conn.rollback()
+                return {"status": "Good not found.", "good_name": good_name}
+            if goods[good_name]["count_in_stock"] < quantities[good_name]:
+                conn.rollback()
+                return {"status": "Insufficient funds or item not available for sale", "good_name": good_name}
+        total = sum(goods[name]["price_per_item"] * quantities[name] for name in names)
+
+        # Debit the wallet once for the whole cart, only if it covers the total
+        cur.execute("""
+            UPDATE customers
+            SET wallet_balance = wallet_balance - ?
+            WHERE username = ? AND wallet_balance >= ?
+        """, (total, customer_username, total))
+        if cur.rowcount != 1:
+            conn.rollback()
+            cur.execute("SELECT 1 FROM customers WHERE username = ?", (customer_username,))
+            if cur.fetchone():
+                return {"status": "Insufficient funds or item not available for sale"}
+            return {"status": "Customer not found."}
+
+        cur.executemany("""
+            UPDATE goods
+            SET count_in_stock = count_in_stock - ?, reserved_count = reserved_count + ?
+            WHERE name = ? AND count_in_stock >= ?
+        """, [(quantities[name], quantities[name], name, quantities[name]) for name in names])
+        if cur.rowcount != len(names):
+            conn.rollback()
+            return {"status": "Insufficient funds or item not available for sale"}
+        reserve_stock(cur, [(name, quantities[name]) for name in names])
+
+        sale_ts = sale_timestamp()
+        cur.executemany("""
+            INSERT INTO sales (customer_username, good_name, sale_ts, sale_amount)
+            VALUES (?, ?, ?, ?)
+        """, [(customer_username, name, sale_ts, goods[name]["price_per_item"])
+              for name in names for _ in range(quantities[name])])
+        record_sale_rollups(cur, customer_username, sale_ts,
+                            [(name, quantities[name], goods[name]["price_per_item"] * quantities[name])
+                             for name in names])
+        conn.commit()
+        for name in names:
+            invalidate_good(name)
+        result["status"] = "Checkout successful"
+        result["total"] = total
+        result["items"] = [{"good_name": name, "quantity": quantities[name],
+                            "amount": goods[name]["price_per_item"] * quantities[name]} for name in names]
+    except sqlite3.Error as e:
+        conn.rollback()
+        print(f"Error processing checkout for '{customer_username}': {e}")
+        result = {"status": "Checkout failed"}
+    finally:
+        conn.close()
+    return result
+
+def customer_sales_queries(conn, customer_username, start_ts=None, end_ts=None):
     """
-    Retrieves all sales made by a specific customer.
+    Routes a customer's sales query, optionally limited to a time range, to its sources.
+
+    Only the archives of the months overlapping the range are attached. Within each source
+    the (customer_username, sale_ts) index serves the range and the ordering.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the sales database, outside a transaction.
+        customer_username (str): The username of the customer.
+        start_ts (int, optional): Earliest sale time included, in epoch milliseconds.
+        end_ts (int, optional): Sale time excluded from the range onwards, in epoch milliseconds.
+
+    Yields:
+        tuple: The (sql, params) query to run on each source, oldest months first.
+    """
+    conditions, params = ["customer_username = ?"], [customer_username]
+    if start_ts is not None:
+        conditions.append("sale_ts >= ?")
+        params.append(start_ts)
+    if end_ts is not None:
+        conditions.append("sale_ts < ?")
+        params.append(end_ts)
+    months = [None if ts is None else datetime.fromtimestamp(ts / 1000, timezone.utc).strftime('%Y-%m')
+              for ts in (start_ts, end_ts)]
+    with closing(iter_sales_sources(conn, *months)) as sources:
+        for table in sources:
+            yield f"SELECT {SALE_COLUMNS} FROM {table} WHERE {' AND '.join(conditions)} ORDER BY sale_ts, sale_id", params
+
+def get_customer_sales(customer_username, start_ts=None, end_ts=None):
+    """
+    Retrieves all sales made by a specific customer, including the archived months.
 
     Args:
         customer_username (str): The username of the customer whose sales records are to be retrieved.
+        start_ts (int, optional): Earliest sale time included, in epoch milliseconds.
+        end_ts (int, optional): Sale time excluded from the range onwards, in epoch milliseconds.
 
     Returns:
-        list: A list of dictionaries, each representing a sale made by the customer.
+        list: A list of dictionaries, each representing a sale made by the customer, oldest first.
               Returns an empty list if an error occurs or no sales are found.
     """
     sales = []
@@ -179,11 +1170,10 @@ def get_customer_sales(customer_username):
         conn = connect_to_db()
         conn.row_factory = sqlite3.Row
         cur = conn.cursor()
-        cur.execute("SELECT * FROM sales WHERE customer_username = ?", (customer_username,))
-        rows = cur.fetchall()
-        for i in rows:
-            sale = dict(i)
-            sales.append(sale)
+        with closing(customer_sales_queries(conn, customer_username, start_ts, end_ts)) as queries:
+            for query, params in queries:
+                cur.execute(query, params)
+                sales.extend(dict(row) for row in cur.fetchall())
     except sqlite3.Error as e:
         print(f"Error fetching sales for customer '{customer_username}': {e}")
         sales = []
@@ -191,9 +1181,167 @@ def get_customer_sales(customer_username):
         conn.close()
     return sales
 
+def iter_customer_sales_ndjson(customer_username, start_ts=None, end_ts=None, batch_size=500):
+    """
+    Streams all sales made by a specific customer, including the archived months, as NDJSON.
+
+    Like `common.streaming.iter_ndjson`, the generator opens its own connection when
+    iteration starts, since Flask iterates a streamed body after the request has ended.
+
+    Args:
+        customer_username (str): The username of the customer whose sales records are streamed.
+        start_ts (int, optional): Earliest sale time included, in epoch milliseconds.
+        end_ts (int, optional): Sale time excluded from the range onwards, in epoch milliseconds.
+        batch_size (int): Number of rows pulled by each `fetchmany` call.
+
+    Yields:
+        str: One or more complete NDJSON lines, oldest sale first. If a query fails part
+            way, a final line with an 'error' key is yielded.
+    """
+    conn = connect_to_db()
+    try:
+        cur = conn.cursor()
+        with closing(customer_sales_queries(conn, customer_username, start_ts, end_ts)) as queries:
+            for query, params in queries:
+                cur.execute(query, params)
+                for lines in iter_cursor_ndjson(cur, batch_size):
+                    yield lines
+    except sqlite3.Error as e:
+        print(f"Error streaming sales for customer '{customer_username}': {e}")
+        yield json.dumps({"error": "Stream aborted"}) + "\n"
+    finally:
+        conn.close()
+
+def get_daily_revenue(start=None, end=None):
+    """
+    Retrieves the number of sales and the revenue of each day from the daily rollup.
+
+    Args:
+        start (str, optional): First day to include, as 'YYYY-MM-DD'.
+        end (str, optional): Last day to include, as 'YYYY-MM-DD'.
+
+    Returns:
+        list: A list of dictionaries with the 'day', 'sale_count' and 'revenue', oldest day
+              first. Returns an empty list if an error occurs.
+    """
+    days = []
+    try:
+        conn = connect_to_db()
+        conn.row_factory = sqlite3.Row
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT day, sale_count, revenue FROM sales_daily_revenue
+            WHERE day >= ? AND day <= ? ORDER BY day
+        """, (start or '', end or '9999-12-31'))
+        days = [dict(row) for row in cur.fetchall()]
+    except sqlite3.Error as e:
+        print(f"Error fetching daily revenue: {e}")
+        days = []
+    finally:
+        conn.close()
+    return days
+
+def get_goods_sales_report(limit=DEFAULT_REPORT_SIZE):
+    """
+    Retrieves the units sold and the revenue of the best-selling goods from the goods rollup.
+
+    Args:
+        limit (int): Maximum number of goods to return.
+
+    Returns:
+        list: A list of dictionaries with the 'good_name', 'units_sold' and 'revenue',
+              highest revenue first. Returns an empty list if an error occurs.
+    """
+    goods = []
+    try:
+        conn = connect_to_db()
+        conn.row_factory = sqlite3.Row
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT good_name, units_sold, revenue FROM sales_by_good
+            ORDER BY revenue DESC, good_name LIMIT ?
+        """, (limit,))
+        goods = [dict(row) for row in cur.fetchall()]
+    except sqlite3.Error as e:
+        print(f"Error fetching the goods sales report: {e}")
+        goods = []
+    finally:
+        conn.close()
+    return goods
+
+def get_customer_spend_report(limit=DEFAULT_REPORT_SIZE, customer_username=None):
+    """
+    Retrieves the lifetime spend of the top customers, or of one customer, from the customer rollup.
+
+    Args:
+        limit (int): Maximum number of customers to return.
+        customer_username (str, optional): Only report this customer.
+
+    Returns:
+        list: A list of dictionaries with the 'customer_username', 'sale_count',
+              'lifetime_spend' and 'last_sale_date', highest spend first. Returns an empty
+              list if an error occurs.
+    """
+    customers = []
+    try:
+        conn = connect_to_db()
+        conn.row_factory = sqlite3.Row
+        cur = conn.cursor()
+        if customer_username is not None:
+            cur.execute("SELECT * FROM sales_by_customer WHERE customer_username = ?", (customer_username,))
+        else:
+            cur.execute("""
+                SELECT * FROM sales_by_customer ORDER BY lifetime_spend DESC, customer_username LIMIT ?
+            """, (limit,))
+        customers = [dict(row) for row in cur.fetchall()]
+    except sqlite3.Error as e:
+        print(f"Error fetching the customer spend report: {e}")
+        customers = []
+    finally:
+        conn.close()
+    return customers
+
+def parse_sale_time(value, end=False):
+    """
+    Converts a time given in a query parameter to epoch milliseconds.
+
+    Args:
+        value (str): Epoch milliseconds, a 'YYYY-MM-DD' day or a 'YYYY-MM-DDTHH:MM:SS' time, in UTC.
+        end (bool): True for the end of a range, which then includes the whole day or second given.
+
+    Returns:
+        int: The time in epoch milliseconds.
+
+    Raises:
+        ValueError: If the value is in none of these formats.
+    """
+    if value.isdigit():
+        return int(value)
+    for time_format, length in (('%Y-%m-%d', 86400000), ('%Y-%m-%dT%H:%M:%S', 1000), ('%Y-%m-%d %H:%M:%S', 1000)):
+        try:
+            moment = datetime.strptime(value, time_format).replace(tzinfo=timezone.utc)
+        except ValueError:
+            continue
+        return int(moment.timestamp() * 1000) + (length if end else 0)
+    raise ValueError(f"Invalid time: {value}")
+
+def parse_report_limit():
+    """
+    Reads the 'limit' query parameter of a report.
+
+    Returns:
+        int: The requested number of rows, or None if it is not an integer between 1 and
+            MAX_REPORT_SIZE.
+    """
+    limit = request.args.get('limit', DEFAULT_REPORT_SIZE, type=int)
+    if limit is None or not 1 <= limit <= MAX_REPORT_SIZE:
+        return None
+    return limit
+
 # Initialize Flask application
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
+db_pool.init_app(app)
 
 @app.route('/api/display_goods', methods=['GET'])
 def api_display_goods():
@@ -231,7 +1379,7 @@ def api_get_good_details(good_name):
 
     Success Response:
         Code: 200
-        Content: Good details dictionary in JSON format.
+        Content: The good's name, price_per_item and count_in_stock in JSON format.
 
     Error Response:
         Code: 404
@@ -246,6 +1394,80 @@ def api_get_good_details(good_name):
     else:
         return jsonify({"error": "Good not found"}), 404
 
+@app.route('/api/cache/stats', methods=['GET'])
+def api_cache_stats():
+    """
+    API Endpoint to retrieve the counters of the goods cache, for sizing it.
+
+    Method:
+        GET
+
+    URL:
+        /api/cache/stats
+
+    Success Response:
+        Code: 200
+        Content: Size, configuration, hit/miss/eviction/expiry/invalidation counters and hit ratio.
+
+    Example:
+        GET /api/cache/stats
+    """
+    return jsonify(goods_cache.stats()), 200
+
+@app.route('/api/goods/replica', methods=['GET'])
+def api_goods_replica_state():
+    """
+    API Endpoint to retrieve how far the local goods replica has caught up with the
+    inventory service's change feed.
+
+    Method:
+        GET
+
+    URL:
+        /api/goods/replica
+
+    Success Response:
+        Code: 200
+        Content: The 'last_seq' applied and the 'refreshed_at' time of the last refresh.
+
+    Error Response:
+        Code: 500
+        Content: Error message indicating server-side failure.
+
+    Example:
+        GET /api/goods/replica
+    """
+    state = get_goods_replica_state()
+    if state:
+        return jsonify(state), 200
+    return jsonify({"error": "Cannot read the goods replica state"}), 500
+
+@app.route('/api/metrics/dependencies', methods=['GET'])
+def api_dependency_metrics():
+    """
+    API Endpoint to retrieve the latency of the calls to other services and the state of
+    their clients.
+
+    Method:
+        GET
+
+    URL:
+        /api/metrics/dependencies
+
+    Success Response:
+        Code: 200
+        Content: The p50/p90/p99/max 'latency' of each dependency in milliseconds, and per
+            client its circuit breaker state, idle connections and request, retry,
+            failure and rejection counters.
+
+    Example:
+        GET /api/metrics/dependencies
+    """
+    return jsonify({
+        "latency": dependency_latency.percentiles(),
+        "clients": {inventory_client.name: inventory_client.stats()},
+    }), 200
+
 @app.route('/api/make_sale', methods=['POST'])
 def api_make_sale():
     """
@@ -257,6 +1479,11 @@ def api_make_sale():
     URL:
         /api/make_sale
 
+    Request Headers:
+        Idempotency-Key (str, optional): Client-chosen key for safe retries. Replaying a
+            key whose sale succeeded returns the stored response, marked with an
+            'Idempotent-Replayed: true' header, and does not sell again.
+
     Request Body:
         JSON object containing sale details:
             - 'customer_username' (str): Username of the customer making the purchase.
@@ -269,6 +1496,8 @@ def api_make_sale():
     Error Response:
         Code: 400
         Content: Error message indicating missing fields or invalid data.
+        Code: 422
+        Content: Error message indicating the Idempotency-Key was used for a different sale.
         Code: 500
         Content: Error message indicating server-side failure.
 
@@ -288,19 +1517,95 @@ def api_make_sale():
 
         customer_username = sale_data['customer_username']
         good_name = sale_data['good_name']
-        sale_result = make_sale(customer_username, good_name)
+        sale_result = make_sale(customer_username, good_name, request.headers.get('Idempotency-Key'))
+        headers = {"Idempotent-Replayed": "true"} if sale_result.pop("replayed", False) else {}
 
         if sale_result["status"] == "Sale successful":
-            return jsonify(sale_result), 200
+            return jsonify(sale_result), 200, headers
         elif sale_result["status"] == "Insufficient funds or item not available for sale":
             return jsonify(sale_result), 400
         elif sale_result["status"] == "Customer not found." or sale_result["status"] == "Good not found.":
             return jsonify(sale_result), 404
+        elif sale_result.pop("conflict", False):
+            return jsonify(sale_result), 422
         else:
             return jsonify(sale_result), 500
     except Exception as e:
         return jsonify({"error": f"Invalid request: {e}"}), 400
 
+@app.route('/api/checkout', methods=['POST'])
+def api_checkout():
+    """
+    API Endpoint to sell a whole cart of goods to a customer in one transaction.
+
+    Method:
+        POST
+
+    URL:
+        /api/checkout
+
+    Request Body:
+        JSON object containing checkout details:
+            - 'customer_username' (str): Username of the customer making the purchase.
+            - 'items' (list): Cart lines, each an object with:
+                - 'good_name' (str): Name of the good being purchased.
+                - 'quantity' (int): Number of units. Must be a positive integer.
+
+    Success Response:
+        Code: 200
+        Content: Message with the total charged and the goods sold.
+
+    Error Response:
+        Code: 400
+        Content: Error message indicating missing fields, invalid data, insufficient funds
+            or insufficient stock. Nothing is sold.
+        Code: 404
+        Content: Error message indicating the customer or a good was not found.
+        Code: 500
+        Content: Error message indicating server-side failure.
+
+    Example:
+        POST /api/checkout
+        {
+            "customer_username": "johndoe",
+            "items": [
+                {"good_name": "Laptop", "quantity": 1},
+                {"good_name": "Mouse", "quantity": 2}
+            ]
+        }
+    """
+    try:
+        checkout_data = request.get_json()
+        if 'customer_username' not in checkout_data:
+            return jsonify({"error": "Missing field: customer_username"}), 400
+        if not isinstance(checkout_data.get('items'), list) or not checkout_data['items']:
+            return jsonify({"error": "Missing field: items"}), 400
+
+        items = []
+        for index, item in enumerate(checkout_data['items']):
+            good_name = item.get('good_name')
+            quantity = item.get('quantity')
+            if not isinstance(good_name, str) or not good_name:
+                return jsonify({"error": f"Invalid good_name in item {index}"}), 400
+            if not isinstance(quantity, int) or quantity <= 0:
+                return jsonify({"error": f"Invalid quantity in item {index}"}), 400
+            items.append((good_name, quantity))
+        if len({good_name for good_name, _ in items}) > MAX_CHECKOUT_LINES:
+            return jsonify({"error": f"Too many items: at most {MAX_CHECKOUT_LINES} goods per checkout"}), 400
+
+        result = checkout(checkout_data['customer_username'], items)
+
+        if result["status"] == "Checkout successful":
+            return jsonify(result), 200
+        elif result["status"] == "Insufficient funds or item not available for sale":
+            return jsonify(result), 400
+        elif result["status"] == "Customer not found." or result["status"] == "Good not found.":
+            return jsonify(result), 404
+        else:
+            return jsonify(result), 500
+    except Exception as e:
+        return jsonify({"error": f"Invalid request: {e}"}), 400
+
 @app.route('/api/customer_sales/<customer_username>', methods=['GET'])
 def api_get_customer_sales(customer_username):
     """
@@ -315,23 +1620,156 @@ def api_get_customer_sales(customer_username):
     URL Parameters:
         customer_username (str): The username of the customer whose sales records are to be retrieved.
 
+    Query Parameters:
+        format (str, optional): 'ndjson' to stream the sales as newline-delimited JSON, one
+            sale per line. A customer without sales then yields an empty 200 stream.
+        start (str, optional): Earliest sale time, as epoch milliseconds, 'YYYY-MM-DD' or
+            'YYYY-MM-DDTHH:MM:SS' (UTC).
+        end (str, optional): Latest sale time, in the same formats; a day includes the whole day.
+        days (int, optional): Only the sales of the last `days` days. Cannot be combined with 'start'.
+
     Success Response:
         Code: 200
-        Content: List of sales dictionaries in JSON format.
+        Content: List of sales dictionaries in JSON format, oldest first, or an
+            'application/x-ndjson' stream.
 
     Error Response:
+        Code: 400
+        Content: Error message indicating a malformed time range.
         Code: 404
-        Content: Error message indicating the customer was not found or has no sales.
+        Content: Error message indicating the customer was not found or has no sales in the range.
 
     Example:
         GET /api/customer_sales/johndoe
+        GET /api/customer_sales/johndoe?days=30
+        GET /api/customer_sales/johndoe?start=2024-01-01&end=2024-03-31&format=ndjson
     """
-    sales = get_customer_sales(customer_username)
+    try:
+        start_ts = parse_sale_time(request.args['start']) if 'start' in request.args else None
+        end_ts = parse_sale_time(request.args['end'], end=True) if 'end' in request.args else None
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if 'days' in request.args:
+        days = request.args.get('days', type=int)
+        if days is None or days <= 0 or start_ts is not None:
+            return jsonify({"error": "days must be a positive integer and cannot be combined with start"}), 400
+        start_ts = sale_timestamp() - days * 86400000
+
+    if wants_ndjson(request):
+        return Response(iter_customer_sales_ndjson(customer_username, start_ts, end_ts), mimetype=NDJSON_MIMETYPE)
+    sales = get_customer_sales(customer_username, start_ts, end_ts)
     if sales:
         return jsonify(sales), 200
     else:
         return jsonify({"error": "No sales found for the customer"}), 404
 
+@app.route('/api/reports/daily_revenue', methods=['GET'])
+def api_daily_revenue():
+    """
+    API Endpoint to retrieve the number of sales and the revenue per day.
+
+    Method:
+        GET
+
+    URL:
+        /api/reports/daily_revenue
+
+    Query Parameters:
+        start (str, optional): First day to include, as 'YYYY-MM-DD'.
+        end (str, optional): Last day to include, as 'YYYY-MM-DD'.
+
+    Success Response:
+        Code: 200
+        Content: List of {'day', 'sale_count', 'revenue'} dictionaries, oldest day first.
+
+    Error Response:
+        Code: 400
+        Content: Error message indicating a malformed day.
+
+    Example:
+        GET /api/reports/daily_revenue?start=2024-01-01&end=2024-01-31
+    """
+    start, end = request.args.get('start'), request.args.get('end')
+    for day in (start, end):
+        if day is not None:
+            try:
+                datetime.strptime(day, '%Y-%m-%d')
+            except ValueError:
+                return jsonify({"error": "Days must be given as YYYY-MM-DD"}), 400
+    return jsonify(get_daily_revenue(start, end)), 200
+
+@app.route('/api/reports/goods', methods=['GET'])
+def api_goods_sales_report():
+    """
+    API Endpoint to retrieve the units sold and the revenue of the best-selling goods.
+
+    Method:
+        GET
+
+    URL:
+        /api/reports/goods
+
+    Query Parameters:
+        limit (int, optional): Number of goods to return, 1 to MAX_REPORT_SIZE. Defaults to 100.
+
+    Success Response:
+        Code: 200
+        Content: List of {'good_name', 'units_sold', 'revenue'} dictionaries, highest revenue first.
+
+    Error Response:
+        Code: 400
+        Content: Error message indicating an invalid limit.
+
+    Example:
+        GET /api/reports/goods?limit=10
+    """
+    limit = parse_report_limit()
+    if limit is None:
+        return jsonify({"error": f"limit must be an integer between 1 and {MAX_REPORT_SIZE}"}), 400
+    return jsonify(get_goods_sales_report(limit)), 200
+
+@app.route('/api/reports/customers', methods=['GET'])
+def api_customer_spend_report():
+    """
+    API Endpoint to retrieve the lifetime spend of the top customers, or of one customer.
+
+    Method:
+        GET
+
+    URL:
+        /api/reports/customers
+
+    Query Parameters:
+        limit (int, optional): Number of customers to return, 1 to MAX_REPORT_SIZE. Defaults to 100.
+        customer_username (str, optional): Only report this customer.
+
+    Success Response:
+        Code: 200
+        Content: List of {'customer_username', 'sale_count', 'lifetime_spend', 'last_sale_date'}
+            dictionaries, highest spend first.
+
+    Error Response:
+        Code: 400
+        Content: Error message indicating an invalid limit.
+        Code: 404
+        Content: Error message indicating the requested customer has no sales.
+
+    Example:
+        GET /api/reports/customers?limit=10
+        GET /api/reports/customers?customer_username=johndoe
+    """
+    limit = parse_report_limit()
+    if limit is None:
+        return jsonify({"error": f"limit must be an integer between 1 and {MAX_REPORT_SIZE}"}), 400
+    customer_username = request.args.get('customer_username')
+    customers = get_customer_spend_report(limit, customer_username)
+    if customer_username is not None and not customers:
+        return jsonify({"error": "No sales found for the customer"}), 404
+    return jsonify(customers), 200
+
 if __name__ == "__main__":
     create_db_table()
+    db_pool.report()
+    report_query_plans()
+    start_goods_replica_refresher()
     app.run(debug=True, port=5002)
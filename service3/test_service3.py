@@ -1,7 +1,8 @@
 import pytest
 import os
 import sqlite3
-from service3 import app, connect_to_db
+from contextlib import closing
+from service3 import app, connect_to_db, idempotency_store
 
 """
 Test Suite for Sales Management API using pytest.
@@ -22,8 +23,8 @@ def client():
     """
     Pytest fixture to set up a test client and initialize a test database.
 
-    This fixture configures the Flask application for testing, overrides the database connection
-    to use a test-specific database, creates the necessary database tables, and provides a test client
+    This fixture configures the Flask application for testing, points the service's connection
+    pool at a test-specific database, creates the necessary database tables, and provides a test client
     for making API requests. After the tests are completed, it cleans up by removing the test database file.
 
     Yields:
@@ -33,30 +34,27 @@ def client():
     app.config['TESTING'] = True
     app.config['DATABASE'] = 'test_sales_database.db'
 
-    def connect_to_db_override():
-        """
-        Overrides the default database connection to use the test database.
-
-        Returns:
-            sqlite3.Connection: A connection object to the test SQLite database.
-        """
-        conn = sqlite3.connect(app.config['DATABASE'])
-        conn.row_factory = sqlite3.Row
-        return conn
-
-    # Override the connect_to_db function in service3 with the test database connection
+    # Point the service's own connection pool at the test database, so every test goes
+    # through the request scope bound to the app: deferred commits, rollbacks, after_commit
     import service3
-    service3.connect_to_db = connect_to_db_override
+    service3.db_pool.use_database(app.config['DATABASE'])
+
+    # Start every test with an empty goods cache, since each test gets a fresh database
+    service3.goods_cache.clear()
 
-    # Create the necessary database tables in the test database
+    # Create the necessary database tables in the test database and apply the migrations
     create_tables_for_test()
+    service3.migrate_db()
 
     # Provide the test client to the tests
     with app.test_client() as client:
         yield client
 
-    # Clean up by removing the test database file after tests are done
-    os.remove(app.config['DATABASE'])
+    # Clean up by closing the pooled connections and removing the test database files
+    service3.db_pool.use_database(service3.DATABASE)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(app.config['DATABASE'] + suffix):
+            os.remove(app.config['DATABASE'] + suffix)
 
 
 def create_tables_for_test():
@@ -100,6 +98,9 @@ def create_tables_for_test():
                 FOREIGN KEY (good_name) REFERENCES goods(name)
             );
         ''')
+
+        # Create the idempotency key table
+        idempotency_store.create_table(conn)
         conn.commit()
     except sqlite3.Error as e:
         print(f"Error creating tables for testing: {e}")
@@ -209,9 +210,9 @@ def test_get_customer_sales(client):
     conn = sqlite3.connect('test_sales_database.db')
     try:
         conn.execute("""
-            INSERT INTO sales (customer_username, good_name, sale_date, sale_amount)
+            INSERT INTO sales (customer_username, good_name, sale_ts, sale_amount)
             VALUES (?, ?, ?, ?)
-        """, ('testuser', 'TestProduct', '2021-01-01', 100.0))
+        """, ('testuser', 'TestProduct', 1609459200000, 100.0))
         conn.commit()
     except sqlite3.Error as e:
         print(f"Error setting up test data for test_get_customer_sales: {e}")
@@ -223,3 +224,556 @@ def test_get_customer_sales(client):
     data = response.get_json()
     assert isinstance(data, list), "Response should be a list of sales."
     assert data[0]['customer_username'] == 'testuser', "Sale should belong to 'testuser'."
+
+
+def test_make_sale_refusals(client):
+    """
+    Test that refused sales keep their status codes and leave wallet and stock untouched.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    conn = sqlite3.connect('test_sales_database.db')
+    conn.execute("INSERT INTO customers (username, wallet_balance) VALUES (?, ?)", ('pooruser', 10.0))
+    conn.execute("INSERT INTO goods (name, price_per_item, count_in_stock) VALUES (?, ?, ?)",
+                 ('PricyProduct', 100.0, 5))
+    conn.commit()
+    conn.close()
+
+    response = client.post('/api/make_sale', json={'customer_username': 'pooruser', 'good_name': 'PricyProduct'})
+    assert response.status_code == 400, "Expected status code 400 for insufficient funds."
+    response = client.post('/api/make_sale', json={'customer_username': 'ghost', 'good_name': 'PricyProduct'})
+    assert response.status_code == 404, "Expected status code 404 for a missing customer."
+    response = client.post('/api/make_sale', json={'customer_username': 'pooruser', 'good_name': 'Ghost'})
+    assert response.status_code == 404, "Expected status code 404 for a missing good."
+
+    conn = sqlite3.connect('test_sales_database.db')
+    balance = conn.execute("SELECT wallet_balance FROM customers WHERE username = 'pooruser'").fetchone()[0]
+    stock = conn.execute("SELECT count_in_stock FROM goods WHERE name = 'PricyProduct'").fetchone()[0]
+    conn.close()
+    assert balance == 10.0 and stock == 5, "Refused sales should not change wallet or stock."
+
+
+def test_concurrent_sales_never_overdraw(client):
+    """
+    Test that concurrent sales never drive a wallet or a stock count below zero.
+
+    This test gives a customer enough money for five items and a good with three in stock,
+    then runs twenty sales concurrently and verifies that exactly three succeed and that
+    the wallet, stock and sales rows agree.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    import threading
+    import service3
+
+    conn = sqlite3.connect('test_sales_database.db')
+    conn.execute("INSERT INTO customers (username, wallet_balance) VALUES (?, ?)", ('racer', 50.0))
+    conn.execute("INSERT INTO goods (name, price_per_item, count_in_stock) VALUES (?, ?, ?)",
+                 ('RaceProduct', 10.0, 3))
+    conn.commit()
+    conn.close()
+
+    results = []
+
+    def buyer():
+        results.append(service3.make_sale('racer', 'RaceProduct')["status"])
+
+    threads = [threading.Thread(target=buyer) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    conn = sqlite3.connect('test_sales_database.db')
+    balance = conn.execute("SELECT wallet_balance FROM customers WHERE username = 'racer'").fetchone()[0]
+    stock = conn.execute("SELECT count_in_stock FROM goods WHERE name = 'RaceProduct'").fetchone()[0]
+    sold = conn.execute("SELECT COUNT(*) FROM sales WHERE customer_username = 'racer'").fetchone()[0]
+    conn.close()
+    assert results.count("Sale successful") == 3, "Only the three items in stock should be sold."
+    assert stock == 0 and sold == 3, "Stock and sales rows should match the successful sales."
+    assert balance == 20.0, "The wallet should be charged exactly once per successful sale."
+
+
+def test_checkout(client):
+    """
+    Test the API endpoint for checking out a cart of several goods.
+
+    This test sets up a customer and two goods, checks out a cart with both goods via a POST
+    request to the `/api/checkout` endpoint, and verifies the total, the wallet, the stock
+    counts and the recorded sales.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    conn = sqlite3.connect('test_sales_database.db')
+    conn.execute("INSERT INTO customers (username, wallet_balance) VALUES (?, ?)", ('shopper', 100.0))
+    conn.execute("INSERT INTO goods (name, price_per_item, count_in_stock) VALUES (?, ?, ?)", ('Pen', 2.0, 10))
+    conn.execute("INSERT INTO goods (name, price_per_item, count_in_stock) VALUES (?, ?, ?)", ('Book', 15.0, 2))
+    conn.commit()
+    conn.close()
+
+    cart = {
+        'customer_username': 'shopper',
+        'items': [
+            {'good_name': 'Pen', 'quantity': 3},
+            {'good_name': 'Book', 'quantity': 2}
+        ]
+    }
+    response = client.post('/api/checkout', json=cart)
+    assert response.status_code == 200, "Expected status code 200 for a successful checkout."
+    data = response.get_json()
+    assert data['total'] == 36.0, "The total should be 3 * 2.0 + 2 * 15.0."
+
+    conn = sqlite3.connect('test_sales_database.db')
+    balance = conn.execute("SELECT wallet_balance FROM customers WHERE username = 'shopper'").fetchone()[0]
+    stock = dict(conn.execute("SELECT name, count_in_stock FROM goods").fetchall())
+    sold = conn.execute("SELECT COUNT(*) FROM sales WHERE customer_username = 'shopper'").fetchone()[0]
+    conn.close()
+    assert balance == 64.0, "The wallet should be debited once for the total."
+    assert stock == {'Pen': 7, 'Book': 0}, "Every stock row should be decremented."
+    assert sold == 5, "One sales row should be recorded per unit sold."
+
+
+def test_checkout_is_all_or_nothing(client):
+    """
+    Test that a checkout the customer cannot afford sells nothing.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    conn = sqlite3.connect('test_sales_database.db')
+    conn.execute("INSERT INTO customers (username, wallet_balance) VALUES (?, ?)", ('saver', 20.0))
+    conn.execute("INSERT INTO goods (name, price_per_item, count_in_stock) VALUES (?, ?, ?)", ('Lamp', 12.0, 5))
+    conn.commit()
+    conn.close()
+
+    cart = {'customer_username': 'saver', 'items': [{'good_name': 'Lamp', 'quantity': 2}]}
+    response = client.post('/api/checkout', json=cart)
+    assert response.status_code == 400, "Expected status code 400 for insufficient funds."
+
+    cart = {'customer_username': 'saver', 'items': [{'good_name': 'Lamp', 'quantity': 1},
+                                                    {'good_name': 'Ghost', 'quantity': 1}]}
+    response = client.post('/api/checkout', json=cart)
+    assert response.status_code == 404, "Expected status code 404 for a missing good."
+    assert response.get_json()['good_name'] == 'Ghost', "The missing good should be named."
+
+    conn = sqlite3.connect('test_sales_database.db')
+    balance = conn.execute("SELECT wallet_balance FROM customers WHERE username = 'saver'").fetchone()[0]
+    stock = conn.execute("SELECT count_in_stock FROM goods WHERE name = 'Lamp'").fetchone()[0]
+    conn.close()
+    assert balance == 20.0 and stock == 5, "A refused checkout should not change wallet or stock."
+
+
+def test_make_sale_idempotency_key(client):
+    """
+    Test that retrying a sale with the same Idempotency-Key does not sell twice.
+
+    This test makes a sale with an Idempotency-Key header, replays it, and verifies that the
+    replay returns the stored response, that the wallet and stock were changed only once,
+    and that reusing the key for a different good is rejected.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    conn = sqlite3.connect('test_sales_database.db')
+    conn.execute("INSERT INTO customers (username, wallet_balance) VALUES (?, ?)", ('retrier', 100.0))
+    conn.execute("INSERT INTO goods (name, price_per_item, count_in_stock) VALUES (?, ?, ?)", ('Mug', 8.0, 5))
+    conn.execute("INSERT INTO goods (name, price_per_item, count_in_stock) VALUES (?, ?, ?)", ('Cup', 6.0, 5))
+    conn.commit()
+    conn.close()
+
+    sale_data = {'customer_username': 'retrier', 'good_name': 'Mug'}
+    headers = {'Idempotency-Key': 'order-42'}
+    first = client.post('/api/make_sale', json=sale_data, headers=headers)
+    replay = client.post('/api/make_sale', json=sale_data, headers=headers)
+    assert first.status_code == 200 and replay.status_code == 200, "Both attempts should succeed."
+    assert replay.headers.get('Idempotent-Replayed') == 'true', "The retry should be marked as a replay."
+    assert replay.get_json() == first.get_json(), "The retry should return the stored response."
+
+    conflict = client.post('/api/make_sale', json={'customer_username': 'retrier', 'good_name': 'Cup'},
+                           headers=headers)
+    assert conflict.status_code == 422, "Reusing a key for another sale should be rejected."
+
+    conn = sqlite3.connect('test_sales_database.db')
+    balance = conn.execute("SELECT wallet_balance FROM customers WHERE username = 'retrier'").fetchone()[0]
+    sold = conn.execute("SELECT COUNT(*) FROM sales WHERE customer_username = 'retrier'").fetchone()[0]
+    conn.close()
+    assert balance == 92.0 and sold == 1, "The sale should be applied exactly once."
+
+
+def test_good_details_cache_is_invalidated_by_sales(client):
+    """
+    Test that good details are cached and that a sale invalidates the sold good.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    conn = sqlite3.connect('test_sales_database.db')
+    conn.execute("INSERT INTO customers (username, wallet_balance) VALUES (?, ?)", ('cachebuyer', 50.0))
+    conn.execute("INSERT INTO goods (name, price_per_item, count_in_stock) VALUES (?, ?, ?)", ('Kettle', 20.0, 2))
+    conn.commit()
+    conn.close()
+
+    client.get('/api/goods_details/Kettle')
+    client.get('/api/goods_details/Kettle')
+    assert client.get('/api/cache/stats').get_json()['hits'] >= 1, "A repeated lookup should hit the cache."
+
+    client.post('/api/make_sale', json={'customer_username': 'cachebuyer', 'good_name': 'Kettle'})
+    data = client.get('/api/goods_details/Kettle').get_json()
+    assert data['count_in_stock'] == 1, "A sale should invalidate the cached stock count."
+
+
+def test_migrations_index_hot_queries(client):
+    """
+    Test that the migrations index the sales lookups and are applied only once.
+
+    The test database declares goods.name as the primary key, so no extra goods index
+    should be created for it.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    import service3
+    assert service3.migrate_db() == len(service3.MIGRATIONS), "Every migration should be applied."
+    assert service3.migrate_db() == len(service3.MIGRATIONS), "A second run should be a no-op."
+
+    plans = service3.report_query_plans()
+    assert not plans['get_customer_sales']['full_scan'], "Sales by customer should use an index."
+    assert not plans['get_good_details']['full_scan'], "Good lookups should use the primary key."
+
+    conn = sqlite3.connect('test_sales_database.db')
+    indexes = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")]
+    conn.close()
+    assert 'idx_goods_name' not in indexes, "The goods primary key already indexes the name."
+
+
+def test_sales_rollups_and_reports(client):
+    """
+    Test that sales are rolled up by day, good and customer and reported from the rollups.
+
+    This test sells goods through make_sale and checkout, then checks the daily revenue,
+    goods and customer reports against the sales recorded.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    conn = sqlite3.connect('test_sales_database.db')
+    conn.execute("INSERT INTO customers (username, wallet_balance) VALUES ('rollupbuyer', 100.0)")
+    conn.execute("INSERT INTO goods (name, price_per_item, count_in_stock) VALUES ('Pen', 2.0, 10)")
+    conn.execute("INSERT INTO goods (name, price_per_item, count_in_stock) VALUES ('Book', 15.0, 10)")
+    conn.commit()
+    conn.close()
+
+    client.post('/api/make_sale', json={'customer_username': 'rollupbuyer', 'good_name': 'Book'})
+    client.post('/api/checkout', json={'customer_username': 'rollupbuyer', 'items': [
+        {'good_name': 'Pen', 'quantity': 3}, {'good_name': 'Book', 'quantity': 1}]})
+
+    days = client.get('/api/reports/daily_revenue').get_json()
+    assert [(day['sale_count'], day['revenue']) for day in days] == [(5, 36.0)], "Every unit should count for today."
+    goods = client.get('/api/reports/goods?limit=1').get_json()
+    assert goods == [{'good_name': 'Book', 'units_sold': 2, 'revenue': 30.0}], "The best seller should come first."
+    customer = client.get('/api/reports/customers?customer_username=rollupbuyer').get_json()[0]
+    assert customer['lifetime_spend'] == 36.0, "The lifetime spend should add up every sale."
+    assert client.get('/api/reports/customers?customer_username=nobody').status_code == 404, \
+        "A customer without sales should not be found."
+    assert client.get('/api/reports/daily_revenue?start=yesterday').status_code == 400, \
+        "A malformed day should be rejected."
+
+
+def test_cold_sales_months_are_archived(client, tmp_path, monkeypatch):
+    """
+    Test that cold months move to read-only archive files and still show in the history.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+        tmp_path (pathlib.Path): Pytest's temporary directory, used for the archives.
+        monkeypatch (MonkeyPatch): Pytest fixture used to point the archives at tmp_path.
+    """
+    import service3
+    monkeypatch.setattr(service3, 'SALES_ARCHIVE_DIR', str(tmp_path))
+    conn = sqlite3.connect('test_sales_database.db')
+    conn.executemany("""
+        INSERT INTO sales (customer_username, good_name, sale_ts, sale_amount) VALUES (?, ?, ?, ?)
+    """, [('archivist', 'Old', service3.parse_sale_time('2020-01-15 10:00:00'), 1.0),
+          ('archivist', 'Older', service3.parse_sale_time('2020-02-10 10:00:00'), 2.0),
+          ('someone', 'Old', service3.parse_sale_time('2020-02-11 10:00:00'), 3.0),
+          ('archivist', 'Old', service3.parse_sale_time('2020-02-29 23:59:59'), 5.0),
+          ('archivist', 'New', service3.sale_timestamp(), 4.0)])
+    conn.commit()
+    conn.close()
+
+    assert service3.archive_cold_sales(hot_months=3) == ['2020-01', '2020-02'], "Both cold months should be archived."
+    assert service3.archive_cold_sales(hot_months=3) == [], "Archived months should not be archived again."
+    assert len(service3.get_customer_sales('someone')) == 1, "Archived sales of other customers should be kept."
+    archive = tmp_path / 'sales_2020_02.db'
+    assert archive.exists() and not archive.stat().st_mode & 0o222, "Each month should get a read-only file."
+
+    conn = sqlite3.connect('test_sales_database.db', uri=True)
+    live = conn.execute("SELECT COUNT(*) FROM sales").fetchone()[0]
+    with closing(service3.iter_sales_sources(conn, '2020-02', '2020-02')) as sources:
+        assert next(sources) == 'sales_archive.sales', "The archived month should be routed to its archive."
+        with pytest.raises(sqlite3.OperationalError, match='readonly'):
+            conn.execute("DELETE FROM sales_archive.sales")
+    conn.close()
+    assert live == 1, "Only the hot month should stay in the live table."
+
+    sales = client.get('/api/customer_sales/archivist').get_json()
+    assert [sale['good_name'] for sale in sales] == ['Old', 'Older', 'Old', 'New'], \
+        "The full history should be returned in order."
+    assert sales[2]['sale_date'] == '2020-02-29 23:59:59', "The last second of a month should stay in its month."
+    stream = client.get('/api/customer_sales/archivist?format=ndjson').get_data(as_text=True)
+    assert len(stream.splitlines()) == 4, "The streamed history should include the archives."
+
+
+def test_customer_sales_time_range(client):
+    """
+    Test the integer sale timestamps and the date range filters of the customer sales.
+
+    This test upgrades a table of text sale dates to integer sale times, sells a good, and
+    checks the derived sale dates, the start/end/days filters, their validation and that
+    the range uses the index.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    import service3
+    conn = sqlite3.connect('test_sales_database.db')
+    conn.execute("INSERT INTO customers (username, wallet_balance) VALUES ('ranger', 50.0)")
+    conn.execute("INSERT INTO goods (name, price_per_item, count_in_stock) VALUES ('Map', 5.0, 5)")
+    conn.execute("INSERT INTO sales (customer_username, good_name, sale_ts, sale_amount) VALUES ('ranger', 'Map', ?, 5.0)",
+                 (service3.parse_sale_time('2021-03-15 12:00:00'),))
+    conn.commit()
+    conn.close()
+
+    # Upgrade a table written before sale_ts, as the migrations do for existing sales
+    legacy = sqlite3.connect(':memory:')
+    legacy.execute("CREATE TABLE sales (sale_id INTEGER PRIMARY KEY, customer_username TEXT NOT NULL, "
+                   "good_name TEXT NOT NULL, sale_date TEXT NOT NULL, sale_amount REAL NOT NULL)")
+    legacy.execute("INSERT INTO sales VALUES (1, 'ranger', 'Map', '2021-03-15 12:00:00', 5.0)")
+    service3.add_sale_ts_column(legacy)
+    service3.drop_sale_dates(legacy)
+    columns = [row[1] for row in legacy.execute("PRAGMA table_info(sales)")]
+    upgraded = legacy.execute("SELECT sale_ts FROM sales").fetchone()[0]
+    legacy.close()
+    assert 'sale_date' not in columns, "The text sale date should be dropped."
+    assert upgraded == 1615809600000, "Existing sale dates should be backfilled as epoch milliseconds."
+    client.post('/api/make_sale', json={'customer_username': 'ranger', 'good_name': 'Map'})
+
+    sales = client.get('/api/customer_sales/ranger').get_json()
+    assert sales[0]['sale_date'] == '2021-03-15 12:00:00', "The sale date should be derived from sale_ts."
+    assert len(sales) == 2 and sales[1]['sale_ts'] > sales[0]['sale_ts'], "Sales should be ordered by time."
+
+    march = client.get('/api/customer_sales/ranger?start=2021-03-01&end=2021-03-15').get_json()
+    assert [sale['sale_date'] for sale in march] == ['2021-03-15 12:00:00'], "The end day should be included."
+    recent = client.get('/api/customer_sales/ranger?days=30').get_json()
+    assert len(recent) == 1, "Only the new sale is from the last 30 days."
+    assert client.get('/api/customer_sales/ranger?start=2021-02-01&end=2021-02-28').status_code == 404, \
+        "A range without sales should not be found."
+    assert client.get('/api/customer_sales/ranger?start=March').status_code == 400, "A malformed time should be rejected."
+
+    plan = service3.report_query_plans()['get_customer_sales']['plan']
+    assert any('idx_sales_customer_ts' in step for step in plan), "The range should use the (customer, sale_ts) index."
+
+
+def test_goods_replica_follows_change_feed(client):
+    """
+    Test that the local goods replica applies the inventory change feed incrementally.
+
+    This test feeds pages of changes through a stub fetch function and checks inserts,
+    the adoption of an existing local good, price and stock updates, renames, deletions,
+    resuming from the stored sequence number and the invalidation of the goods cache.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    import service3
+    conn = sqlite3.connect('test_sales_database.db')
+    conn.execute("INSERT INTO goods (name, price_per_item, count_in_stock) VALUES ('Tea', 3.0, 1)")
+    conn.commit()
+    conn.close()
+    assert client.get('/api/goods_details/Tea').get_json()['count_in_stock'] == 1, "The local good should be cached."
+
+    feed = [
+        {'seq': 1, 'good_id': 7, 'operation': 'upsert', 'name': 'Tea', 'price': 4.0, 'stock_count': 10},
+        {'seq': 2, 'good_id': 8, 'operation': 'upsert', 'name': 'Cup', 'price': 6.0, 'stock_count': 5},
+        {'seq': 3, 'good_id': 8, 'operation': 'upsert', 'name': 'Mug', 'price': 6.5, 'stock_count': 5},
+        {'seq': 4, 'good_id': 9, 'operation': 'upsert', 'name': 'Pot', 'price': 20.0, 'stock_count': 2},
+        {'seq': 5, 'good_id': 9, 'operation': 'delete', 'name': None, 'price': None, 'stock_count': None},
+    ]
+    requested = []
+
+    def fetch(after_seq, limit):
+        requested.append(after_seq)
+        page = [change for change in feed if change['seq'] > after_seq][:2]
+        return {'changes': page, 'last_seq': page[-1]['seq'] if page else after_seq,
+                'has_more': bool(page) and page[-1]['seq'] < feed[-1]['seq']}
+
+    assert service3.refresh_goods_replica(fetch) == 5, "Every change should be applied once."
+    assert requested == [0, 2, 4], "Each page should start after the last applied change."
+    assert client.get('/api/goods_details/Tea').get_json()['count_in_stock'] == 10, \
+        "The adopted good should take the inventory stock and leave the cache."
+    assert client.get('/api/goods_details/Mug').get_json()['price_per_item'] == 6.5, "The renamed good should be updated."
+    assert client.get('/api/goods_details/Cup').status_code == 404, "The old name should be gone."
+    assert client.get('/api/goods_details/Pot').status_code == 404, "The deleted good should be removed."
+
+    feed.append({'seq': 6, 'good_id': 7, 'operation': 'upsert', 'name': 'Tea', 'price': 4.5, 'stock_count': 9})
+    assert service3.refresh_goods_replica(fetch) == 1, "A later refresh should only apply the new change."
+    assert client.get('/api/goods/replica').get_json()['last_seq'] == 6, "The replica should report its progress."
+
+
+def test_goods_feed_is_read_through_the_pooled_client(client):
+    """
+    Test that the replica reads the inventory change feed over the pooled HTTP client.
+
+    The inventory service is replaced by a local stub; the test checks that the replica is
+    refreshed from it, that both pages share one connection and that the call latency is
+    reported on the dependency metrics endpoint.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    import service3
+    from common.http_client import ServiceClient
+    from common.stub_server import StubServer
+
+    change = {'seq': 1, 'good_id': 3, 'operation': 'upsert', 'name': 'Vase', 'price': 12.0, 'stock_count': 4}
+    with StubServer() as stub:
+        stub.add('GET', '/api/goods/changes', body={'changes': [], 'last_seq': 1, 'has_more': False})
+        stub.add('GET', '/api/goods/changes', body={'changes': [change], 'last_seq': 1, 'has_more': True}, times=1)
+        original = service3.inventory_client
+        service3.inventory_client = ServiceClient('inventory', stub.url)
+        try:
+            assert service3.refresh_goods_replica() == 1, "The stubbed change should be applied."
+            assert service3.inventory_client.stats()['connections'] == 1, "Both pages should share one connection."
+        finally:
+            service3.inventory_client.close()
+            service3.inventory_client = original
+
+    assert client.get('/api/goods_details/Vase').get_json()['count_in_stock'] == 4, "The replica should hold the good."
+    metrics = client.get('/api/metrics/dependencies').get_json()
+    assert metrics['latency']['inventory']['count'] >= 2, "Each feed read should be timed."
+
+
+def test_local_sales_survive_replica_refresh(client):
+    """
+    Test that a feed change applied after local sales does not put the sold units back on sale.
+
+    The inventory service never hears of the sales made here, so its next change for a
+    good still carries the stock it had before them. This test sells replicated goods
+    with both `/api/make_sale` and `/api/checkout`, applies such a change and checks that
+    the local stock stays reduced and that a sold-out good cannot be sold again.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    import service3
+    conn = sqlite3.connect('test_sales_database.db')
+    conn.execute("INSERT INTO customers (username, wallet_balance) VALUES ('collector', 500.0)")
+    conn.commit()
+    conn.close()
+
+    feed = [
+        {'seq': 1, 'good_id': 4, 'operation': 'upsert', 'name': 'Vase', 'price': 12.0, 'stock_count': 4},
+        {'seq': 2, 'good_id': 5, 'operation': 'upsert', 'name': 'Bowl', 'price': 9.0, 'stock_count': 1},
+    ]
+
+    def fetch(after_seq, limit):
+        page = [change for change in feed if change['seq'] > after_seq]
+        return {'changes': page, 'last_seq': page[-1]['seq'] if page else after_seq, 'has_more': False}
+
+    assert service3.refresh_goods_replica(fetch) == 2, "The replicated goods should be applied."
+    sale = client.post('/api/make_sale', json={'customer_username': 'collector', 'good_name': 'Bowl'})
+    assert sale.get_json()['status'] == 'Sale successful', "The last Bowl should be sold."
+    cart = {'customer_username': 'collector', 'items': [{'good_name': 'Vase', 'quantity': 3}]}
+    assert client.post('/api/checkout', json=cart).status_code == 200, "Three Vases should be checked out."
+
+    # The inventory service only changes the prices; its stock does not know about the sales
+    feed.append({'seq': 3, 'good_id': 4, 'operation': 'upsert', 'name': 'Vase', 'price': 13.0, 'stock_count': 4})
+    feed.append({'seq': 4, 'good_id': 5, 'operation': 'upsert', 'name': 'Bowl', 'price': 9.5, 'stock_count': 1})
+    assert service3.refresh_goods_replica(fetch) == 2, "The price changes should be applied."
+    vase = client.get('/api/goods_details/Vase').get_json()
+    assert vase['price_per_item'] == 13.0, "The replicated price should be taken."
+    assert vase['count_in_stock'] == 1, "The Vases sold here should stay off the replicated stock."
+    assert client.get('/api/goods_details/Bowl').get_json()['count_in_stock'] == 0, "The Bowl should stay sold out."
+    sale = client.post('/api/make_sale', json={'customer_username': 'collector', 'good_name': 'Bowl'})
+    assert sale.get_json()['status'] == 'Insufficient funds or item not available for sale', \
+        "A sold-out good should not be sold again after a refresh."
+
+    # A restock in the inventory service makes new units available
+    feed.append({'seq': 5, 'good_id': 5, 'operation': 'upsert', 'name': 'Bowl', 'price': 9.5, 'stock_count': 3})
+    assert service3.refresh_goods_replica(fetch) == 1, "The restock should be applied."
+    assert client.get('/api/goods_details/Bowl').get_json()['count_in_stock'] == 2, \
+        "Only the restocked units should be available."
+
+
+def test_pushed_sales_are_settled_by_the_feed(client):
+    """
+    Test that local sales pushed to the inventory stop being subtracted once the feed reflects them.
+
+    A fake inventory service keeps the stock and appends a feed change for every
+    deduction. This test sells replicated goods, pushes the reservations, applies the
+    feed and checks that a later restock is mirrored exactly, including when the feed
+    is applied before the push records its sequence number and when the inventory
+    refuses a deduction. It also checks that the replica's bookkeeping columns are not
+    exposed by `/api/goods_details`.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    import service3
+    conn = sqlite3.connect('test_sales_database.db')
+    conn.execute("INSERT INTO customers (username, wallet_balance) VALUES ('potter', 500.0)")
+    conn.commit()
+    conn.close()
+
+    stock = {7: 5, 8: 2, 9: 1}
+    names = {7: 'Jug', 8: 'Plate', 9: 'Cup'}
+    feed = []
+
+    def publish(good_id):
+        feed.append({'seq': len(feed) + 1, 'good_id': good_id, 'operation': 'upsert',
+                     'name': names[good_id], 'price': 10.0, 'stock_count': stock[good_id]})
+
+    def fetch(after_seq, limit):
+        page = [change for change in feed if change['seq'] > after_seq]
+        return {'changes': page, 'last_seq': page[-1]['seq'] if page else after_seq, 'has_more': False}
+
+    def deduct(good_id, quantity, idempotency_key):
+        if stock[good_id] < quantity:
+            return 400, {'status': 'Insufficient stock to deduct.'}
+        stock[good_id] -= quantity
+        publish(good_id)
+        if good_id == 8:
+            # The refresher applies the change before the push records its sequence number
+            service3.refresh_goods_replica(fetch)
+        return 200, {'status': 'Stock deducted successfully.', 'seq': feed[-1]['seq']}
+
+    for good_id in stock:
+        publish(good_id)
+    service3.refresh_goods_replica(fetch)
+    cart = {'customer_username': 'potter', 'items': [{'good_name': 'Jug', 'quantity': 2},
+                                                     {'good_name': 'Plate', 'quantity': 1},
+                                                     {'good_name': 'Cup', 'quantity': 1}]}
+    assert client.post('/api/checkout', json=cart).status_code == 200, "The cart should be checked out."
+    stock[9] = 0
+    publish(9)  # The last Cup was sold elsewhere before the push
+
+    assert service3.push_stock_reservations(deduct) == 3, "Every reservation should be pushed."
+    service3.refresh_goods_replica(fetch)
+    counts = {name: client.get(f'/api/goods_details/{name}').get_json()['count_in_stock'] for name in names.values()}
+    assert counts == {'Jug': 3, 'Plate': 1, 'Cup': 0}, "The replica should mirror the inventory stock."
+
+    stock[7] += 10
+    publish(7)
+    service3.refresh_goods_replica(fetch)
+    jug = client.get('/api/goods_details/Jug').get_json()
+    assert jug['count_in_stock'] == 13, "A restock should be mirrored without subtracting settled sales."
+    assert set(jug) == {'name', 'price_per_item', 'count_in_stock'}, "Only the good's own columns should be shown."
+
+    conn = sqlite3.connect('test_sales_database.db')
+    reservations = conn.execute("SELECT COUNT(*) FROM stock_reservations").fetchone()[0]
+    reserved = conn.execute("SELECT SUM(reserved_count) FROM goods").fetchone()[0]
+    conn.close()
+    assert (reservations, reserved) == (0, 0), "Settled and refused reservations should be released."
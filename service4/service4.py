@@ -1,11 +1,20 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 from flask_cors import CORS
+import hashlib
 import sqlite3
-from werkzeug.security import generate_password_hash, check_password_hash
-from flask_jwt_extended import (
-    JWTManager, create_access_token, jwt_required,
-    get_jwt_identity
-)
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from common.cache import LRUCache
+from common.db_pool import ConnectionPool
+from common.hashing import HasherBusy, PasswordHasher
+from common.metrics import LatencyRecorder
+from common.migrations import Migration, MigrationRunner, add_column_if_missing, explain_query_plans
+from common.storage import get_env_setting
+from flask_jwt_extended import JWTManager, create_access_token, decode_token
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
@@ -16,14 +25,111 @@ jwt = JWTManager(app)
 
 DATABASE = 'reviews_database.db'
 
+# Claims of verified bearer tokens, keyed by the token's SHA-256 digest. An entry never
+# outlives its token, so an expired token is always verified again and rejected.
+token_cache = LRUCache(maxsize=int(get_env_setting('service4', 'TOKEN_CACHE_SIZE') or 10000),
+                       ttl=float(get_env_setting('service4', 'TOKEN_CACHE_TTL') or 300))
+
+# Password hashing runs in worker processes; when too many hashes are pending, register
+# and login answer 503 at once instead of queueing
+password_hasher = PasswordHasher(
+    workers=int(get_env_setting('service4', 'PASSWORD_HASH_WORKERS') or 2),
+    max_pending=int(get_env_setting('service4', 'PASSWORD_HASH_MAX_PENDING') or 32),
+    method=get_env_setting('service4', 'PASSWORD_HASH_METHOD'),
+)
+
+# Request latencies, with the hashing routes kept apart from the others
+request_latency = LatencyRecorder()
+LATENCY_GROUPS = {'login': 'login', 'register': 'register'}
+
+# Counters of the authentication cost, see /api/auth/stats
+auth_stats = {"requests": 0, "verifications": 0, "failures": 0, "verify_seconds": 0.0}
+auth_stats_lock = threading.Lock()
+
+# Connections are borrowed from a shared pool configured by the service's storage profile
+db_pool = ConnectionPool.from_profile(DATABASE, 'service4', size=4)
+db_pool.init_app(app)
+
+# Schema changes applied by create_db_table, in version order; never edit an applied entry
+MIGRATIONS = [
+    Migration(1, "Add reviews.flagged to databases created before moderation",
+              lambda conn: add_column_if_missing(conn, 'reviews', 'flagged', 'BOOLEAN DEFAULT 0')),
+    Migration(2, "Index reviews by product, by customer and the flagged moderation queue", [
+        "CREATE INDEX IF NOT EXISTS idx_reviews_product_name ON reviews (product_name)",
+        "CREATE INDEX IF NOT EXISTS idx_reviews_customer_username ON reviews (customer_username)",
+        # Partial index: only the few flagged rows are indexed
+        "CREATE INDEX IF NOT EXISTS idx_reviews_flagged ON reviews (flagged) WHERE flagged = 1",
+    ]),
+    Migration(3, "Maintain per-product rating aggregates of the visible reviews",
+              lambda conn: create_rating_summary(conn)),
+    # The rowid (review_id) is implicitly the last column of every index, so
+    # (product_name) serves the 'newest' order and (product_name, rating) the rating orders
+    Migration(4, "Index reviews by product and rating for sorted pagination", [
+        "CREATE INDEX IF NOT EXISTS idx_reviews_product_rating ON reviews (product_name, rating)",
+    ]),
+    Migration(5, "Full-text index of review comments and product names",
+              lambda conn: create_review_search_index(conn)),
+]
+
+# Columns returned by paginated review listings
+REVIEW_LIST_FIELDS = ['review_id', 'product_name', 'customer_username', 'rating', 'comment', 'moderated', 'flagged']
+DEFAULT_REVIEW_PAGE_SIZE = 20
+MAX_REVIEW_PAGE_SIZE = 100
+
+# Sort order of each option and the keyset condition continuing after a (rating, review_id) cursor
+REVIEW_SORTS = {
+    'newest': ("review_id DESC", "review_id < ?"),
+    'highest': ("rating DESC, review_id DESC", "(rating, review_id) < (?, ?)"),
+    'lowest': ("rating ASC, review_id ASC", "(rating, review_id) > (?, ?)"),
+}
+
+# Marks around the matched terms in search snippets
+SEARCH_HIGHLIGHT = ('<mark>', '</mark>')
+
+# Extra predicate of each review status filter
+REVIEW_STATUS_FILTERS = {
+    'all': "",
+    'visible': "AND flagged = 0",
+    'approved': "AND flagged = 0 AND moderated = 1",
+}
+migration_runner = MigrationRunner(MIGRATIONS)
+
+# Hot queries whose plans are reported at startup, with sample parameters
+HOT_QUERIES = {
+    "get_product_reviews": ("SELECT * FROM reviews WHERE product_name = ?", ('name',)),
+    "get_customer_reviews": ("SELECT * FROM reviews WHERE customer_username = ?", ('username',)),
+    "flagged_reviews": ("SELECT * FROM reviews WHERE flagged = 1", ()),
+    "login": ("SELECT password, role FROM users WHERE username = ?", ('username',)),
+    "get_product_reviews_page": ("SELECT * FROM reviews WHERE product_name = ? AND (rating, review_id) < (?, ?) "
+                                 "ORDER BY rating DESC, review_id DESC LIMIT ?", ('name', 5, 0, 20)),
+    "get_product_rating_summary": ("SELECT * FROM product_rating_summary WHERE product_name = ?", ('name',)),
+}
+
+# Adds (sign = +1) or removes (sign = -1) one review row R from its product's aggregate
+_RATING_SUMMARY_CHANGE = """
+    UPDATE product_rating_summary SET
+        review_count = review_count + {sign},
+        rating_sum = rating_sum + {sign} * R.rating,
+        stars_1 = stars_1 + {sign} * (R.rating = 1),
+        stars_2 = stars_2 + {sign} * (R.rating = 2),
+        stars_3 = stars_3 + {sign} * (R.rating = 3),
+        stars_4 = stars_4 + {sign} * (R.rating = 4),
+        stars_5 = stars_5 + {sign} * (R.rating = 5),
+        updated_at = datetime('now')
+    WHERE product_name = R.product_name AND IFNULL(R.flagged, 0) = 0;
+"""
+
 def connect_to_db():
     """
-    Establishes a connection to the SQLite database.
+    Borrows a connection to the SQLite database from the service's connection pool.
+
+    Inside a request the same connection is returned to every caller, so the
+    ownership check and the write that follows it share one transaction.
 
     Returns:
-        sqlite3.Connection: A connection object to the 'reviews_database.db'.
+        PooledConnection: A pooled connection to the 'reviews_database.db'.
     """
-    conn = sqlite3.connect(DATABASE)
+    conn = db_pool.connect()
     conn.row_factory = sqlite3.Row
     return conn
 
@@ -33,6 +139,8 @@ def create_db_table():
     Tables:
         - users: Stores user credentials and roles.
         - reviews: Stores product reviews with moderation status.
+
+    The pending schema migrations are applied afterwards.
     """
     try:
         conn = connect_to_db()
@@ -61,6 +169,171 @@ def create_db_table():
         print(f"Error creating tables: {e}")
     finally:
         conn.close()
+    migrate_db()
+
+def create_rating_summary(conn):
+    """
+    Creates the 'product_rating_summary' table, fills it from the existing reviews and adds
+    the triggers that keep it up to date.
+
+    The summary counts the visible reviews, i.e. those not flagged for moderation. The
+    triggers update it in the same transaction as every insert, update or delete on
+    'reviews', so flagging, moderating, editing and deleting a review all move it between
+    the counters without ever rescanning the product's reviews.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the reviews database.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS product_rating_summary (
+            product_name TEXT PRIMARY KEY NOT NULL,
+            review_count INTEGER NOT NULL DEFAULT 0,
+            rating_sum INTEGER NOT NULL DEFAULT 0,
+            stars_1 INTEGER NOT NULL DEFAULT 0,
+            stars_2 INTEGER NOT NULL DEFAULT 0,
+            stars_3 INTEGER NOT NULL DEFAULT 0,
+            stars_4 INTEGER NOT NULL DEFAULT 0,
+            stars_5 INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT
+        );
+    ''')
+    conn.execute('''
+        INSERT OR REPLACE INTO product_rating_summary
+        SELECT product_name, COUNT(*), SUM(rating), SUM(rating = 1), SUM(rating = 2), SUM(rating = 3),
+               SUM(rating = 4), SUM(rating = 5), datetime('now')
+        FROM reviews WHERE IFNULL(flagged, 0) = 0 GROUP BY product_name
+    ''')
+    add = _RATING_SUMMARY_CHANGE.format(sign='+1')
+    remove = _RATING_SUMMARY_CHANGE.format(sign='-1')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS reviews_summary_insert AFTER INSERT ON reviews BEGIN
+            INSERT OR IGNORE INTO product_rating_summary (product_name) VALUES (NEW.product_name);
+            {add.replace('R.', 'NEW.')}
+        END;
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS reviews_summary_update
+        AFTER UPDATE OF product_name, rating, flagged ON reviews BEGIN
+            {remove.replace('R.', 'OLD.')}
+            INSERT OR IGNORE INTO product_rating_summary (product_name) VALUES (NEW.product_name);
+            {add.replace('R.', 'NEW.')}
+        END;
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS reviews_summary_delete AFTER DELETE ON reviews BEGIN
+            {remove.replace('R.', 'OLD.')}
+        END;
+    ''')
+
+def create_review_search_index(conn):
+    """
+    Creates the 'reviews_fts' FTS5 index over review comments and product names, fills it
+    and adds the triggers that keep it in sync with the 'reviews' table.
+
+    The index is an external-content table: it stores only the inverted index and reads
+    the text back from 'reviews', so comments are not stored twice.
+
+    Args:
+        conn (sqlite3.Connection): Connection to the reviews database.
+    """
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS reviews_fts USING fts5(
+            comment, product_name, content='reviews', content_rowid='review_id'
+        );
+    ''')
+    conn.execute("INSERT INTO reviews_fts (reviews_fts) VALUES ('rebuild')")
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS reviews_fts_insert AFTER INSERT ON reviews BEGIN
+            INSERT INTO reviews_fts (rowid, comment, product_name)
+            VALUES (NEW.review_id, NEW.comment, NEW.product_name);
+        END;
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS reviews_fts_update AFTER UPDATE OF comment, product_name ON reviews BEGIN
+            INSERT INTO reviews_fts (reviews_fts, rowid, comment, product_name)
+            VALUES ('delete', OLD.review_id, OLD.comment, OLD.product_name);
+            INSERT INTO reviews_fts (rowid, comment, product_name)
+            VALUES (NEW.review_id, NEW.comment, NEW.product_name);
+        END;
+    ''')
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS reviews_fts_delete AFTER DELETE ON reviews BEGIN
+            INSERT INTO reviews_fts (reviews_fts, rowid, comment, product_name)
+            VALUES ('delete', OLD.review_id, OLD.comment, OLD.product_name);
+        END;
+    ''')
+
+def migrate_db():
+    """
+    Brings the database schema up to date by applying the pending entries of `MIGRATIONS`.
+
+    Returns:
+        int: The schema version after migrating, or None if a migration failed.
+    """
+    try:
+        conn = connect_to_db()
+        return migration_runner.migrate(conn)
+    except sqlite3.Error as e:
+        print(f"Error migrating the reviews database: {e}")
+        return None
+    finally:
+        conn.close()
+
+def report_query_plans():
+    """
+    Prints the query plan of every entry of `HOT_QUERIES`, marking full table scans.
+
+    Returns:
+        dict: Maps each query name to its plan and whether it scans the whole table.
+    """
+    conn = connect_to_db()
+    try:
+        return explain_query_plans(conn, HOT_QUERIES)
+    finally:
+        conn.close()
+
+@app.before_request
+def start_request_timer():
+    """
+    Notes the start time of the request, for the latency percentiles.
+    """
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_latency(response):
+    """
+    Records the latency of the request under its group in LATENCY_GROUPS, or 'other'.
+
+    Args:
+        response (Response): The response about to be sent.
+
+    Returns:
+        Response: The same response.
+    """
+    started = g.get('request_started')
+    if started is not None:
+        request_latency.record(LATENCY_GROUPS.get(request.endpoint, 'other'), time.perf_counter() - started)
+    return response
+
+# Latency Metrics (Public)
+@app.route('/api/metrics/latency', methods=['GET'])
+def api_latency_metrics():
+    """
+    API endpoint to retrieve request latency percentiles, with login and registration
+    reported apart from the other routes, and the password hashing queue counters.
+
+    Returns:
+        Response: JSON response with the p50/p90/p99/max latency of each group in
+            milliseconds, and how many hashes were rejected because the queue was full.
+    """
+    return jsonify({
+        "latency": request_latency.percentiles(),
+        "password_hashing": {
+            "workers": password_hasher.workers,
+            "max_pending": password_hasher.max_pending,
+            "rejected": password_hasher.rejected,
+        },
+    }), 200
 
 # User Registration
 @app.route('/api/register', methods=['POST'])
@@ -75,7 +348,8 @@ def register():
             - role (str): The role of the user ('user' or 'admin').
 
     Returns:
-        Response: JSON response with a status message.
+        Response: JSON response with a status message, or 503 with a Retry-After header
+            when the password hashing queue is full.
     """
     data = request.get_json()
     username = data.get('username')
@@ -88,7 +362,11 @@ def register():
     if role not in ['user', 'admin']:
         return jsonify({"status": "Error: Invalid role specified."}), 400
 
-    hashed_password = generate_password_hash(password)
+    # Hash before borrowing a connection, so no pooled connection waits on the hasher
+    try:
+        hashed_password = password_hasher.hash(password)
+    except HasherBusy:
+        return jsonify({"status": "Error: Server busy, please retry."}), 503, {'Retry-After': '1'}
 
     try:
         conn = connect_to_db()
@@ -116,7 +394,8 @@ def login():
             - password (str): The user's password.
 
     Returns:
-        Response: JSON response with the access token or an error message.
+        Response: JSON response with the access token or an error message, or 503 with a
+            Retry-After header when the password hashing queue is full.
     """
     data = request.get_json()
     username = data.get('username')
@@ -130,16 +409,96 @@ def login():
         cur = conn.cursor()
         cur.execute("SELECT password, role FROM users WHERE username = ?", (username,))
         user = cur.fetchone()
-        if user and check_password_hash(user['password'], password):
-            access_token = create_access_token(identity={'username': username, 'role': user['role']})
+        conn.close()
+        # Hand the pooled connection back before hashing, so a burst of logins waiting on
+        # the hasher does not hold every connection the other routes need
+        db_pool.release_scope()
+        if user and password_hasher.check(user['password'], password):
+            access_token = create_access_token(identity=username, additional_claims={'role': user['role']})
             return jsonify(access_token=access_token), 200
         else:
             return jsonify({"status": "Error: Invalid username or password."}), 401
+    except HasherBusy:
+        return jsonify({"status": "Error: Server busy, please retry."}), 503, {'Retry-After': '1'}
     except Exception as e:
         return jsonify({"status": f"Error: {str(e)}"}), 500
     finally:
         conn.close()
 
+def verify_token(token):
+    """
+    Verifies a bearer token and returns its claims, skipping the HMAC check for tokens
+    verified recently.
+
+    Tokens carry the username as subject and the role as a flat 'role' claim. Verified
+    claims are cached under the token's digest until the token expires (at most the
+    cache TTL), so a client sending the same token on every request pays for the
+    signature check once.
+
+    Args:
+        token (str): The encoded access token.
+
+    Returns:
+        dict: The 'username' and 'role' of the token.
+
+    Raises:
+        Exception: If the token is malformed, forged, expired or not an access token.
+    """
+    digest = hashlib.sha256(token.encode('utf-8')).hexdigest()
+    identity = token_cache.get(digest)
+    if identity is not None:
+        return identity
+    started = time.perf_counter()
+    try:
+        claims = decode_token(token)
+    finally:
+        with auth_stats_lock:
+            auth_stats["verifications"] += 1
+            auth_stats["verify_seconds"] += time.perf_counter() - started
+    if claims.get('type') != 'access':
+        raise ValueError("Not an access token")
+    identity = {'username': claims['sub'], 'role': claims.get('role', 'user')}
+    remaining = claims['exp'] - time.time() if 'exp' in claims else token_cache.ttl
+    if remaining > 0:
+        token_cache.set(digest, identity, ttl=remaining)
+    return identity
+
+def get_identity():
+    """
+    Returns:
+        dict: The 'username' and 'role' of the current request's token.
+    """
+    return g.identity
+
+# Decorator for Authenticated Routes
+def token_required(fn):
+    """
+    Custom decorator to ensure that the request carries a valid bearer token.
+
+    The token's claims are available to the route through `get_identity()`.
+
+    Args:
+        fn (function): The route function to decorate.
+
+    Returns:
+        function: The decorated function.
+    """
+    def wrapper(*args, **kwargs):
+        with auth_stats_lock:
+            auth_stats["requests"] += 1
+        header = request.headers.get('Authorization', '')
+        if not header.startswith('Bearer '):
+            return jsonify({"status": "Error: Missing bearer token."}), 401
+        try:
+            g.identity = verify_token(header[len('Bearer '):].strip())
+        except Exception:
+            with auth_stats_lock:
+                auth_stats["failures"] += 1
+            return jsonify({"status": "Error: Invalid or expired token."}), 401
+        return fn(*args, **kwargs)
+    wrapper.__name__ = fn.__name__
+    return wrapper
+
 # Decorator for Admin-Only Routes
 def admin_required(fn):
     """
@@ -151,18 +510,36 @@ def admin_required(fn):
     Returns:
         function: The decorated function.
     """
-    @jwt_required()
+    @token_required
     def wrapper(*args, **kwargs):
-        identity = get_jwt_identity()
-        if identity['role'] != 'admin':
+        if get_identity()['role'] != 'admin':
             return jsonify({"status": "Error: Admin privileges required."}), 403
         return fn(*args, **kwargs)
     wrapper.__name__ = fn.__name__
     return wrapper
 
+# Authentication Metrics (Public)
+@app.route('/api/auth/stats', methods=['GET'])
+def api_auth_stats():
+    """
+    API endpoint to retrieve the cost of token verification.
+
+    Returns:
+        Response: JSON response with the number of authenticated requests, full signature
+            verifications and failures, the average verification time and its cost per
+            request in microseconds, and the token cache counters.
+    """
+    with auth_stats_lock:
+        stats = dict(auth_stats)
+    verifications = stats["verifications"]
+    stats["verify_us_avg"] = (stats["verify_seconds"] / verifications * 1e6) if verifications else 0.0
+    stats["verify_us_per_request"] = (stats["verify_seconds"] / stats["requests"] * 1e6) if stats["requests"] else 0.0
+    stats["cache"] = token_cache.stats()
+    return jsonify(stats), 200
+
 # Insert Review (Authenticated Users)
 @app.route('/api/reviews', methods=['POST'])
-@jwt_required()
+@token_required
 def api_add_review():
     """
     API endpoint to add a new review. Only authenticated users can add reviews.
@@ -187,7 +564,7 @@ def api_add_review():
     if not isinstance(rating, int) or not (1 <= rating <= 5):
         return jsonify({"status": "Error: Rating must be an integer between 1 and 5."}), 400
 
-    identity = get_jwt_identity()
+    identity = get_identity()
     customer_username = identity['username']
 
     review = {
@@ -227,7 +604,7 @@ def insert_review(review):
 
 # Update Review (Authenticated Users)
 @app.route('/api/reviews/<int:review_id>', methods=['PUT'])
-@jwt_required()
+@token_required
 def api_update_review(review_id):
     """
     API endpoint to update an existing review. Only the author or an admin can update a review.
@@ -251,7 +628,7 @@ def api_update_review(review_id):
         if not isinstance(rating, int) or not (1 <= rating <= 5):
             return jsonify({"status": "Error: Rating must be an integer between 1 and 5."}), 400
 
-    identity = get_jwt_identity()
+    identity = get_identity()
     customer_username = identity['username']
     user_role = identity['role']
 
@@ -287,7 +664,8 @@ def update_review(review_id, updated_review):
 
     Args:
         review_id (int): The ID of the review to update.
-        updated_review (dict): A dictionary containing the updated review details:
+        updated_review (dict): A dictionary containing the updated review details. Missing
+            fields keep their current value:
             - rating (int): The updated rating of the product (1-5).
             - comment (str): The updated review comment.
 
@@ -297,7 +675,7 @@ def update_review(review_id, updated_review):
     try:
         conn = connect_to_db()
         cur = conn.cursor()
-        cur.execute("UPDATE reviews SET rating = ?, comment = ? WHERE review_id = ?",
+        cur.execute("UPDATE reviews SET rating = COALESCE(?, rating), comment = COALESCE(?, comment) WHERE review_id = ?",
                     (updated_review.get('rating'), updated_review.get('comment'), review_id))
         conn.commit()
         return {"status": "Review updated successfully"}
@@ -308,7 +686,7 @@ def update_review(review_id, updated_review):
 
 # Delete Review (Authenticated Users)
 @app.route('/api/reviews/<int:review_id>', methods=['DELETE'])
-@jwt_required()
+@token_required
 def api_delete_review(review_id):
     """
     API endpoint to delete a review. Only the author or an admin can delete a review.
@@ -319,7 +697,7 @@ def api_delete_review(review_id):
     Returns:
         Response: JSON response with a status message.
     """
-    identity = get_jwt_identity()
+    identity = get_identity()
     customer_username = identity['username']
     user_role = identity['role']
 
@@ -365,18 +743,50 @@ def delete_review(review_id):
 @app.route('/api/reviews/product/<product_name>', methods=['GET'])
 def api_get_product_reviews(product_name):
     """
-    API endpoint to retrieve all reviews for a specific product.
+    API endpoint to retrieve the reviews of a specific product, all at once or one page at a time.
+
+    Without query parameters every review is returned as a list. Passing any of the
+    parameters below switches to keyset pagination, which returns a bounded page and the
+    cursor of the next one.
 
     Args:
         product_name (str): The name of the product.
 
+    Query Parameters:
+        sort (str, optional): 'newest' (default), 'highest' or 'lowest' rating first.
+        status (str, optional): 'all' (default), 'visible' to hide flagged reviews, or
+            'approved' to return only moderated reviews that are not flagged.
+        cursor (str, optional): The 'next_cursor' of the previous page.
+        limit (int, optional): Page size, between 1 and MAX_REVIEW_PAGE_SIZE. Default DEFAULT_REVIEW_PAGE_SIZE.
+
     Returns:
-        Response: JSON response containing a list of reviews.
+        Response: JSON response containing a list of reviews, or, when paginating, an object
+            with 'reviews' and 'next_cursor' (null on the last page).
     """
-    reviews = get_product_reviews(product_name)
-    if isinstance(reviews, dict) and 'status' in reviews:
-        return jsonify(reviews), 500
-    return jsonify(reviews), 200
+    if not any(key in request.args for key in ('sort', 'status', 'cursor', 'limit')):
+        reviews = get_product_reviews(product_name)
+        if isinstance(reviews, dict) and 'status' in reviews:
+            return jsonify(reviews), 500
+        return jsonify(reviews), 200
+
+    sort = request.args.get('sort', 'newest')
+    status = request.args.get('status', 'all')
+    if sort not in REVIEW_SORTS:
+        return jsonify({"status": f"Error: Invalid sort. Use one of: {', '.join(REVIEW_SORTS)}."}), 400
+    if status not in REVIEW_STATUS_FILTERS:
+        return jsonify({"status": f"Error: Invalid status. Use one of: {', '.join(REVIEW_STATUS_FILTERS)}."}), 400
+    try:
+        limit = int(request.args.get('limit', DEFAULT_REVIEW_PAGE_SIZE))
+        cursor = parse_review_cursor(request.args.get('cursor'))
+    except ValueError:
+        return jsonify({"status": "Error: Invalid cursor or limit."}), 400
+    if not 1 <= limit <= MAX_REVIEW_PAGE_SIZE:
+        return jsonify({"status": f"Error: Limit must be between 1 and {MAX_REVIEW_PAGE_SIZE}."}), 400
+
+    page = get_product_reviews_page(product_name, sort, status, cursor, limit)
+    if 'status' in page:
+        return jsonify(page), 500
+    return jsonify(page), 200
 
 def get_product_reviews(product_name):
     """
@@ -399,9 +809,228 @@ def get_product_reviews(product_name):
     finally:
         conn.close()
 
+def parse_review_cursor(cursor):
+    """
+    Parses a review page cursor of the form '<rating>:<review_id>'.
+
+    Args:
+        cursor (str): The cursor sent by the client, or None for the first page.
+
+    Returns:
+        tuple: The (rating, review_id) of the last review of the previous page, or None.
+
+    Raises:
+        ValueError: If the cursor is malformed.
+    """
+    if not cursor:
+        return None
+    rating, review_id = cursor.split(':')
+    return int(rating), int(review_id)
+
+def get_product_reviews_page(product_name, sort='newest', status='all', cursor=None, limit=DEFAULT_REVIEW_PAGE_SIZE):
+    """
+    Retrieves one page of a product's reviews, using keyset pagination.
+
+    The page continues right after the cursor in the chosen order, so each page is an
+    index range scan on (product_name, rating) or (product_name) however deep the client
+    pages.
+
+    Args:
+        product_name (str): The name of the product.
+        sort (str): A key of REVIEW_SORTS.
+        status (str): A key of REVIEW_STATUS_FILTERS.
+        cursor (tuple, optional): The (rating, review_id) of the last review already seen.
+        limit (int): Maximum number of reviews to return.
+
+    Returns:
+        dict: A dictionary with 'reviews' (list) and 'next_cursor' (str, None on the last
+            page), or a status message on error.
+    """
+    order_by, after = REVIEW_SORTS[sort]
+    params = [product_name]
+    keyset = ""
+    if cursor is not None:
+        keyset = f"AND {after}"
+        params.extend([cursor[1]] if sort == 'newest' else list(cursor))
+    params.append(limit + 1)
+    try:
+        conn = connect_to_db()
+        cur = conn.cursor()
+        # Fetch one extra row to know whether another page follows
+        cur.execute(f"""
+            SELECT {", ".join(REVIEW_LIST_FIELDS)} FROM reviews
+            WHERE product_name = ? {REVIEW_STATUS_FILTERS[status]} {keyset}
+            ORDER BY {order_by}
+            LIMIT ?
+        """, params)
+        rows = cur.fetchall()
+        page = {"reviews": [dict(row) for row in rows[:limit]], "next_cursor": None}
+        if len(rows) > limit:
+            last = page["reviews"][-1]
+            page["next_cursor"] = f"{last['rating']}:{last['review_id']}"
+        return page
+    except Exception as e:
+        return {"status": f"Error: {str(e)}"}
+    finally:
+        conn.close()
+
+# Search Reviews (Public)
+@app.route('/api/reviews/search', methods=['GET'])
+def api_search_reviews():
+    """
+    API endpoint to search review comments and product names, best matches first.
+
+    Query Parameters:
+        q (str): The words to search for; every word must match. A word ending in '*'
+            matches as a prefix.
+        product (str, optional): Only search the reviews of this product.
+        status (str, optional): 'all' (default), 'visible' or 'approved', as for product reviews.
+        offset (int, optional): Number of results to skip. Default 0.
+        limit (int, optional): Page size, between 1 and MAX_REVIEW_PAGE_SIZE. Default DEFAULT_REVIEW_PAGE_SIZE.
+
+    Returns:
+        Response: JSON response with the matching 'reviews', each with a highlighted
+            'snippet' of its comment, and 'next_offset' (null on the last page).
+    """
+    match = build_search_query(request.args.get('q', ''))
+    if not match:
+        return jsonify({"status": "Error: Query parameter 'q' is required."}), 400
+    status = request.args.get('status', 'all')
+    if status not in REVIEW_STATUS_FILTERS:
+        return jsonify({"status": f"Error: Invalid status. Use one of: {', '.join(REVIEW_STATUS_FILTERS)}."}), 400
+    try:
+        offset = int(request.args.get('offset', 0))
+        limit = int(request.args.get('limit', DEFAULT_REVIEW_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"status": "Error: Invalid offset or limit."}), 400
+    if offset < 0 or not 1 <= limit <= MAX_REVIEW_PAGE_SIZE:
+        return jsonify({"status": f"Error: Offset must be positive and limit between 1 and {MAX_REVIEW_PAGE_SIZE}."}), 400
+
+    result = search_reviews(match, request.args.get('product'), status, offset, limit)
+    if 'status' in result:
+        return jsonify(result), 500
+    return jsonify(result), 200
+
+def build_search_query(text):
+    """
+    Turns free text into an FTS5 query that cannot fail on syntax.
+
+    Every word is quoted, so characters such as '"', '-' or ':' are searched literally;
+    a trailing '*' is kept outside the quotes to make it a prefix search.
+
+    Args:
+        text (str): The words typed by the user.
+
+    Returns:
+        str: The FTS5 MATCH expression, or an empty string if there is nothing to search.
+    """
+    terms = []
+    for word in text.split():
+        prefix = word.endswith('*')
+        word = word.rstrip('*').replace('"', '')
+        if word:
+            terms.append(f'"{word}"' + ('*' if prefix else ''))
+    return " ".join(terms)
+
+def search_reviews(match, product_name=None, status='all', offset=0, limit=DEFAULT_REVIEW_PAGE_SIZE):
+    """
+    Runs a full-text search over the reviews, ranked by BM25.
+
+    Args:
+        match (str): An FTS5 MATCH expression, see `build_search_query`.
+        product_name (str, optional): Only return reviews of this product.
+        status (str): A key of REVIEW_STATUS_FILTERS.
+        offset (int): Number of results to skip.
+        limit (int): Maximum number of results to return.
+
+    Returns:
+        dict: A dictionary with 'reviews' (list) and 'next_offset' (int, None on the last
+            page), or a status message on error.
+    """
+    params = [SEARCH_HIGHLIGHT[0], SEARCH_HIGHLIGHT[1], match]
+    product_filter = ""
+    if product_name:
+        product_filter = "AND reviews.product_name = ?"
+        params.append(product_name)
+    params.extend([limit + 1, offset])
+    try:
+        conn = connect_to_db()
+        cur = conn.cursor()
+        # Fetch one extra row to know whether another page follows
+        cur.execute(f"""
+            SELECT reviews.review_id, reviews.product_name, reviews.customer_username, reviews.rating,
+                   reviews.moderated, reviews.flagged,
+                   snippet(reviews_fts, 0, ?, ?, '...', 16) AS snippet
+            FROM reviews_fts JOIN reviews ON reviews.review_id = reviews_fts.rowid
+            WHERE reviews_fts MATCH ? {product_filter} {REVIEW_STATUS_FILTERS[status]}
+            ORDER BY reviews_fts.rank
+            LIMIT ? OFFSET ?
+        """, params)
+        rows = cur.fetchall()
+        result = {"reviews": [dict(row) for row in rows[:limit]], "next_offset": None}
+        if len(rows) > limit:
+            result["next_offset"] = offset + limit
+        return result
+    except Exception as e:
+        return {"status": f"Error: {str(e)}"}
+    finally:
+        conn.close()
+
+# Retrieve Product Rating Summary (Public)
+@app.route('/api/reviews/product/<product_name>/summary', methods=['GET'])
+def api_get_product_rating_summary(product_name):
+    """
+    API endpoint to retrieve the rating summary of a product.
+
+    The summary is read from a precomputed row, so it costs the same for a product with
+    one review as for one with a hundred thousand.
+
+    Args:
+        product_name (str): The name of the product.
+
+    Returns:
+        Response: JSON response with the review count, average rating and star histogram.
+    """
+    summary = get_product_rating_summary(product_name)
+    if 'status' in summary:
+        return jsonify(summary), 500
+    return jsonify(summary), 200
+
+def get_product_rating_summary(product_name):
+    """
+    Retrieves the precomputed rating aggregate of a product's visible reviews.
+
+    Args:
+        product_name (str): The name of the product.
+
+    Returns:
+        dict: The 'review_count', 'average_rating' (None without reviews), the star
+            'histogram' keyed '1' to '5' and 'updated_at', or a status message on error.
+    """
+    try:
+        conn = connect_to_db()
+        cur = conn.cursor()
+        cur.execute("SELECT * FROM product_rating_summary WHERE product_name = ?", (product_name,))
+        row = cur.fetchone()
+        if row is None:
+            return {"product_name": product_name, "review_count": 0, "average_rating": None,
+                    "histogram": {str(stars): 0 for stars in range(1, 6)}, "updated_at": None}
+        count = row['review_count']
+        return {
+            "product_name": product_name,
+            "review_count": count,
+            "average_rating": round(row['rating_sum'] / count, 2) if count else None,
+            "histogram": {str(stars): row[f'stars_{stars}'] for stars in range(1, 6)},
+            "updated_at": row['updated_at'],
+        }
+    except Exception as e:
+        return {"status": f"Error: {str(e)}"}
+    finally:
+        conn.close()
+
 # Retrieve Customer Reviews (Authenticated Users)
 @app.route('/api/reviews/customer/<customer_username>', methods=['GET'])
-@jwt_required()
+@token_required
 def api_get_customer_reviews(customer_username):
     """
     API endpoint to retrieve all reviews submitted by a specific customer.
@@ -413,7 +1042,7 @@ def api_get_customer_reviews(customer_username):
     Returns:
         Response: JSON response containing a list of reviews.
     """
-    identity = get_jwt_identity()
+    identity = get_identity()
     requester_username = identity['username']
     user_role = identity['role']
 
@@ -448,7 +1077,7 @@ def get_customer_reviews(customer_username):
 
 # Flag Review (Authenticated Users)
 @app.route('/api/reviews/flag/<int:review_id>', methods=['POST'])
-@jwt_required()
+@token_required
 def api_flag_review(review_id):
     """
     API endpoint to flag a review as inappropriate.
@@ -459,7 +1088,7 @@ def api_flag_review(review_id):
     Returns:
         Response: JSON response with a status message.
     """
-    identity = get_jwt_identity()
+    identity = get_identity()
     customer_username = identity['username']
 
     try:
@@ -585,4 +1214,6 @@ def get_review_details(review_id):
 
 if __name__ == "__main__":
     create_db_table()
+    db_pool.report()
+    report_query_plans()
     app.run(debug=True, port=5004)
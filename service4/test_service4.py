@@ -21,8 +21,8 @@ def client():
     """
     Pytest fixture to set up a test client and initialize a test database.
 
-    This fixture configures the Flask application for testing, overrides the database connection
-    to use a test-specific database, creates the necessary database tables, and provides a test client
+    This fixture configures the Flask application for testing, points the service's connection
+    pool at a test-specific database, creates the necessary database tables, and provides a test client
     for making API requests. After the tests are completed, it cleans up by removing the test database file.
 
     Yields:
@@ -32,20 +32,10 @@ def client():
     app.config['TESTING'] = True
     app.config['DATABASE'] = 'test_reviews_database.db'
 
-    def connect_to_db_override():
-        """
-        Overrides the default database connection to use the test database.
-
-        Returns:
-            sqlite3.Connection: A connection object to the test SQLite database.
-        """
-        conn = sqlite3.connect(app.config['DATABASE'])
-        conn.row_factory = sqlite3.Row
-        return conn
-
-    # Override the connect_to_db function in service4 with the test database connection
+    # Point the service's own connection pool at the test database, so every test goes
+    # through the request scope bound to the app: deferred commits, rollbacks, after_commit
     import service4
-    service4.connect_to_db = connect_to_db_override
+    service4.db_pool.use_database(app.config['DATABASE'])
 
     # Create the necessary database tables in the test database
     create_db_table()
@@ -54,8 +44,11 @@ def client():
     with app.test_client() as client:
         yield client
 
-    # Clean up by removing the test database file after tests are done
-    os.remove(app.config['DATABASE'])
+    # Clean up by closing the pooled connections and removing the test database files
+    service4.db_pool.use_database(service4.DATABASE)
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(app.config['DATABASE'] + suffix):
+            os.remove(app.config['DATABASE'] + suffix)
 
 
 def test_add_review(client):
@@ -198,3 +191,242 @@ def test_moderate_review(client):
     moderated_status = cur.fetchone()[0]
     conn.close()
     assert moderated_status == 1, "Review should be marked as moderated (approved)."
+
+
+def test_product_rating_summary_tracks_review_changes(client):
+    """
+    Test that the rating summary follows inserts, edits, flags, moderation and deletes.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    import service4
+    for username, rating in (('user1', 5), ('user2', 3), ('user3', 4)):
+        service4.insert_review({'product_name': 'ProductS', 'customer_username': username,
+                                'rating': rating, 'comment': ''})
+    summary = client.get('/api/reviews/product/ProductS/summary').get_json()
+    assert summary['review_count'] == 3 and summary['average_rating'] == 4.0, "Three reviews averaging 4."
+    assert summary['histogram'] == {'1': 0, '2': 0, '3': 1, '4': 1, '5': 1}, "Each rating should be counted."
+
+    conn = sqlite3.connect('test_reviews_database.db')
+    review_ids = [row[0] for row in conn.execute(
+        "SELECT review_id FROM reviews WHERE product_name = 'ProductS' ORDER BY review_id")]
+    conn.execute("UPDATE reviews SET flagged = 1 WHERE review_id = ?", (review_ids[0],))
+    conn.commit()
+    conn.close()
+    service4.update_review(review_ids[1], {'rating': 1})
+    service4.delete_review(review_ids[2])
+    summary = client.get('/api/reviews/product/ProductS/summary').get_json()
+    assert summary['review_count'] == 1 and summary['histogram']['1'] == 1, "Only the edited review is visible."
+
+    service4.moderate_review(review_ids[0], 'approve')
+    summary = client.get('/api/reviews/product/ProductS/summary').get_json()
+    assert summary['review_count'] == 2 and summary['average_rating'] == 3.0, "Moderation should restore it."
+
+    empty = client.get('/api/reviews/product/Unknown/summary')
+    assert empty.status_code == 200 and empty.get_json()['review_count'] == 0, "No reviews means zeros."
+
+
+def test_product_reviews_pagination_and_sorting(client):
+    """
+    Test that paging through a product's reviews returns every review once, in order.
+
+    Ratings repeat across reviews so that pages split ties, and one flagged review checks
+    the status filter.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    conn = sqlite3.connect('test_reviews_database.db')
+    ratings = [3, 5, 3, 1, 5, 3, 4]
+    for i, rating in enumerate(ratings):
+        conn.execute("INSERT INTO reviews (product_name, customer_username, rating, comment, flagged) "
+                     "VALUES (?, ?, ?, ?, ?)", ('ProductP', f'user{i}', rating, '', 1 if i == 0 else 0))
+    conn.commit()
+    conn.close()
+
+    def collect(sort, status='all'):
+        reviews, cursor = [], ''
+        while True:
+            page = client.get(f'/api/reviews/product/ProductP?sort={sort}&status={status}&limit=2&cursor={cursor}')
+            assert page.status_code == 200, "Every page should be returned."
+            data = page.get_json()
+            assert len(data['reviews']) <= 2, "A page should not exceed the limit."
+            reviews.extend(data['reviews'])
+            if data['next_cursor'] is None:
+                return reviews
+            cursor = data['next_cursor']
+
+    newest = collect('newest')
+    assert [r['review_id'] for r in newest] == sorted((r['review_id'] for r in newest), reverse=True), \
+        "Newest should be ordered by descending review ID."
+    assert len(newest) == len(ratings), "Every review should be returned exactly once."
+    highest = collect('highest')
+    assert [r['rating'] for r in highest] == sorted(ratings, reverse=True), "Highest should sort by rating."
+    assert len({r['review_id'] for r in highest}) == len(ratings), "No review should repeat across pages."
+    assert [r['rating'] for r in collect('lowest')] == sorted(ratings), "Lowest should sort by rating."
+    assert len(collect('highest', 'visible')) == len(ratings) - 1, "Visible should hide the flagged review."
+    assert collect('newest', 'approved') == [], "No review has been approved yet."
+
+    assert client.get('/api/reviews/product/ProductP?sort=random').status_code == 400, "Unknown sort is a 400."
+    assert client.get('/api/reviews/product/ProductP?cursor=bad').status_code == 400, "Bad cursor is a 400."
+
+
+def test_search_reviews(client):
+    """
+    Test that review search ranks matches, highlights them and follows edits and deletes.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    import service4
+    comments = ['The battery died after a week', 'Battery life is great, battery lasts days',
+                'Nice colour', 'Arrived broken']
+    for i, comment in enumerate(comments):
+        service4.insert_review({'product_name': 'Phone' if i < 3 else 'Case', 'customer_username': f'user{i}',
+                                'rating': 3, 'comment': comment})
+
+    data = client.get('/api/reviews/search?q=battery').get_json()
+    assert len(data['reviews']) == 2, "Both battery reviews should match."
+    assert '<mark>' in data['reviews'][0]['snippet'], "Matches should be highlighted."
+    assert data['reviews'][0]['review_id'] == 2, "More occurrences should rank higher."
+
+    data = client.get('/api/reviews/search?q=batt*&limit=1').get_json()
+    assert len(data['reviews']) == 1 and data['next_offset'] == 1, "A prefix search should page."
+
+    service4.update_review(3, {'comment': 'Battery is fine'})
+    service4.delete_review(1)
+    data = client.get('/api/reviews/search?q=battery&product=Phone').get_json()
+    assert sorted(r['review_id'] for r in data['reviews']) == [2, 3], "The index should follow edits and deletes."
+
+    assert client.get('/api/reviews/search?q="unbalanced').status_code == 200, "Quotes should not break the query."
+    assert client.get('/api/reviews/search').status_code == 400, "A missing query should be rejected."
+
+
+def test_token_verification_is_cached(client):
+    """
+    Test that a logged-in user's token is verified once and then served from the cache.
+
+    The token carries the username and role as flat claims; a forged token and a missing
+    header are rejected, and a regular user cannot reach an admin route.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    import service4
+    service4.token_cache.clear()
+    client.post('/api/register', json={'username': 'reader', 'password': 'secret'})
+    token = client.post('/api/login', json={'username': 'reader', 'password': 'secret'}).get_json()['access_token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    before = client.get('/api/auth/stats').get_json()
+    for _ in range(3):
+        response = client.get('/api/reviews/customer/reader', headers=headers)
+        assert response.status_code == 200, "A valid token should be accepted."
+    after = client.get('/api/auth/stats').get_json()
+    assert after['verifications'] - before['verifications'] == 1, "The signature should be checked once."
+    assert after['cache']['hits'] >= 2, "Repeated requests should hit the token cache."
+
+    assert client.post('/api/reviews/moderate/1', json={'action': 'approve'},
+                       headers=headers).status_code == 403, "A user should not reach admin routes."
+    forged = {'Authorization': f'Bearer {token[:-2]}xx'}
+    assert client.get('/api/reviews/customer/reader', headers=forged).status_code == 401, "A forged token is a 401."
+    assert client.get('/api/reviews/customer/reader').status_code == 401, "A missing token is a 401."
+
+
+def test_login_latency_and_busy_hasher(client):
+    """
+    Test that login latency is reported on its own and that a full hashing queue gives a 503.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    import service4
+    client.post('/api/register', json={'username': 'timed', 'password': 'secret'})
+    client.post('/api/login', json={'username': 'timed', 'password': 'secret'})
+    client.get('/api/reviews/product/Anything')
+    latency = client.get('/api/metrics/latency').get_json()['latency']
+    assert latency['login']['count'] >= 1, "Logins should be recorded in their own group."
+    assert latency['other']['count'] >= 1, "Other routes should be recorded apart."
+
+    hasher = service4.password_hasher
+    service4.password_hasher = service4.PasswordHasher(workers=0, max_pending=0)
+    try:
+        response = client.post('/api/login', json={'username': 'timed', 'password': 'secret'})
+        assert response.status_code == 503, "A full hashing queue should answer 503."
+        assert response.headers.get('Retry-After') == '1', "The client should be told when to retry."
+        response = client.post('/api/register', json={'username': 'late', 'password': 'secret'})
+        assert response.status_code == 503, "Registration should also fail fast when busy."
+    finally:
+        service4.password_hasher = hasher
+
+
+def test_login_releases_the_pooled_connection_before_hashing(client):
+    """
+    Test that login hands its pooled connection back before checking the password.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    import service4
+    client.post('/api/register', json={'username': 'pooled', 'password': 'secret'})
+
+    class RecordingHasher(object):
+        """
+        Password hasher that records the pool usage whenever a password is checked.
+        """
+
+        def __init__(self, hasher):
+            self.hasher = hasher
+            self.pool_stats = []
+
+        def check(self, stored, password):
+            self.pool_stats.append(service4.db_pool.stats())
+            return self.hasher.check(stored, password)
+
+    hasher = service4.password_hasher
+    service4.password_hasher = RecordingHasher(hasher)
+    try:
+        response = client.post('/api/login', json={'username': 'pooled', 'password': 'secret'})
+        stats = service4.password_hasher.pool_stats
+    finally:
+        service4.password_hasher = hasher
+    assert response.status_code == 200, "The login should succeed."
+    assert len(stats) == 1 and stats[0]['idle'] == stats[0]['open'], \
+        "No pooled connection should be held while the password is checked."
+
+
+def test_migrations_upgrade_legacy_reviews_table(client):
+    """
+    Test that the migrations add the flagged column to an old reviews table and index it.
+
+    A database created before moderation existed has no 'flagged' column; the migrations
+    should add it, create the review indexes and record the schema version.
+
+    Args:
+        client (FlaskClient): The test client fixture.
+    """
+    import service4
+    legacy = 'test_legacy_reviews_database.db'
+    conn = sqlite3.connect(legacy)
+    conn.execute('''
+        CREATE TABLE reviews (
+            review_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            product_name TEXT NOT NULL,
+            customer_username TEXT NOT NULL,
+            rating INTEGER NOT NULL CHECK(rating >= 1 AND rating <= 5),
+            comment TEXT,
+            moderated BOOLEAN DEFAULT 0
+        );
+    ''')
+    try:
+        assert service4.migration_runner.migrate(conn) == len(service4.MIGRATIONS), "All migrations should apply."
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(reviews)")]
+        assert 'flagged' in columns, "The flagged column should be added."
+        plans = service4.explain_query_plans(conn, {
+            name: query for name, query in service4.HOT_QUERIES.items() if name != 'login'
+        })
+        assert not any(plan['full_scan'] for plan in plans.values()), "Review lookups should use indexes."
+    finally:
+        conn.close()
+        os.remove(legacy)
@@ -23,6 +23,7 @@ sys.path.insert(0, os.path.abspath('../service1'))
 sys.path.insert(0, os.path.abspath('../service2'))
 sys.path.insert(0, os.path.abspath('../service3'))
 sys.path.insert(0, os.path.abspath('../service4'))
+sys.path.insert(0, os.path.abspath('..'))
 # -- Options for HTML output -------------------------------------------------
 html_theme = 'alabaster'
 html_static_path = ['_static']